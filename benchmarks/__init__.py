@@ -0,0 +1,11 @@
+# -------------------------
+# Benchmarks
+# -------------------------
+# End-to-end load tests for the Flask app. Everything external is replaced
+# by a local stand-in so runs are repeatable and free:
+#   - OpenAI:             a mock HTTP server with configurable latency
+#   - Firestore/Storage:  the in-memory repository (STORAGE_BACKEND=memory)
+#
+#   python -m benchmarks.run --requests 200 --concurrency 8
+#   python -m benchmarks.startup --runs 10
+#   python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
@@ -0,0 +1,60 @@
+import argparse
+import json
+import sys
+
+# -------------------------
+# Compare two benchmark runs
+# -------------------------
+# Prints the change in throughput and latency per scenario and exits with
+# status 1 if any scenario regressed by more than --threshold, so it can
+# gate a CI job.
+METRICS = [("rps", True), ("p50", False), ("p95", False), ("p99", False)]
+
+
+def _value(stats, metric):
+    return stats["rps"] if metric == "rps" else stats["latency_ms"][metric]
+
+
+def compare(old, new, threshold=0.1):
+    """
+    Returns (rows, regressions); rows are (scenario, metric, old, new, change).
+    """
+    rows, regressions = [], []
+    for name, new_stats in new["scenarios"].items():
+        old_stats = old["scenarios"].get(name)
+        if old_stats is None:
+            continue
+        for metric, higher_is_better in METRICS:
+            before, after = _value(old_stats, metric), _value(new_stats, metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            rows.append((name, metric, before, after, change))
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append((name, metric, before, after, change))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative change that counts as a regression (default 0.1)")
+    args = parser.parse_args(argv)
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    rows, regressions = compare(old, new, args.threshold)
+    for name, metric, before, after, change in rows:
+        flag = "  REGRESSION" if (name, metric, before, after, change) in regressions else ""
+        print(f"{name:<22} {metric:<4} {before:>10.2f} -> {after:>10.2f}  {change:+7.1%}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
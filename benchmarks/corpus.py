@@ -0,0 +1,96 @@
+import io
+import random
+
+# -------------------------
+# Benchmark corpora
+# -------------------------
+# Seeded, study-note-like text plus PDF/DOCX files built from it, so every
+# run (and every commit) is measured against the same documents.
+WORDS = (
+    "cell membrane protein enzyme energy reaction equilibrium pressure volume "
+    "temperature entropy market demand supply price elasticity revenue cost "
+    "theorem proof integral derivative limit function vector matrix graph "
+    "revolution empire treaty parliament reform trade colony migration war "
+    "neuron synapse memory learning behaviour stimulus response hypothesis "
+    "experiment variable control sample data analysis model theory evidence"
+).split()
+
+
+def sentence(rng, min_words=8, max_words=20):
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    return " ".join(words).capitalize() + "."
+
+
+def paragraph(rng, sentences=5):
+    return " ".join(sentence(rng) for _ in range(sentences))
+
+
+def note_text(rng, paragraphs=6):
+    """A typed note: a few paragraphs separated by blank lines."""
+    return "\n\n".join(paragraph(rng) for _ in range(paragraphs))
+
+
+def flashcards(rng, count=10):
+    return [{"question": sentence(rng, 5, 10), "answer": sentence(rng, 3, 8)} for _ in range(count)]
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages):
+    """
+    Build a PDF with one page per entry, each line of text on its own row.
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        rows = [f"({_pdf_escape(line)}) Tj T*" for line in text.splitlines()]
+        stream = f"BT /F1 10 Tf 12 TL 50 750 Td {' '.join(rows)} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode())
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_docx(paragraphs):
+    from docx import Document
+    document = Document()
+    for text in paragraphs:
+        document.add_paragraph(text)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def documents(seed=0, count=20, min_pages=2, max_pages=40):
+    """
+    A mixed corpus of (filename, bytes): lecture-slide-sized PDFs with a
+    varying page count and DOCX notes, roughly two PDFs to each DOCX.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        pages = rng.randint(min_pages, max_pages)
+        if i % 3 == 2:
+            corpus.append((f"notes_{i}.docx", make_docx([paragraph(rng) for _ in range(pages * 3)])))
+        else:
+            # ~40 short rows per page, like a dense slide or handout
+            page_texts = ["\n".join(sentence(rng, 6, 12) for _ in range(40)) for _ in range(pages)]
+            corpus.append((f"lecture_{i}.pdf", make_pdf(page_texts)))
+    return corpus
@@ -0,0 +1,265 @@
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from . import corpus
+from .stand_ins import LatencyRepository, MockOpenAI
+
+# -------------------------
+# End-to-end benchmark
+# -------------------------
+# Drives the real Flask app through its test client from a pool of
+# threads, each logged in as the benchmark user. Request payloads are built
+# before the clock starts, and every typed note is fresh text so the LLM
+# cache does not turn summarise requests into lookups.
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _note_form(action):
+    def build(rng, ctx):
+        return "POST", "/edit_note", {"data": {
+            "action": action, "title": "Bench", "notes": corpus.note_text(rng)}}
+    return build
+
+
+def _upload(rng, ctx):
+    name, data = rng.choice(ctx["documents"])
+    return "POST", "/upload_doc", {
+        "data": {"action": "save", "title": name, "document": (io.BytesIO(data), name)},
+        "content_type": "multipart/form-data",
+    }
+
+
+SCENARIOS = {
+    "home": lambda rng, ctx: ("GET", "/", {}),
+    "viewNote": lambda rng, ctx: ("GET", f"/Note/{rng.choice(ctx['note_ids'])}", {}),
+    "flashcards": lambda rng, ctx: ("GET", f"/flashcards/{rng.choice(ctx['note_ids'])}", {}),
+    "edit_note_save": _note_form("save"),
+    "edit_note_summarise": _note_form("summarise"),
+    "edit_note_stream": lambda rng, ctx: ("POST", "/edit_note/stream", {"data": {
+        "notes": corpus.note_text(rng)}}),
+    "upload_doc": _upload,
+    "search": lambda rng, ctx: ("GET", "/search", {"query_string": {
+        "q": " ".join(rng.sample(corpus.WORDS, 2))}}),
+}
+
+
+# -------------------------
+# Statistics
+# -------------------------
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarise(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda value: None if value is None else round(value * 1000, 2)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+            "max": ms(latencies[-1] if latencies else None),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# -------------------------
+# Setup
+# -------------------------
+def load_app(openai_url):
+    """Import the app against the in-memory backend and the mock OpenAI."""
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = openai_url
+    from studyPal import main
+    # Requests are still traced, just not printed
+    logging.getLogger("studypal.requests").setLevel(logging.WARNING)
+    return main
+
+
+def seed_notes(main, rng, count):
+    from studyPal.functions import create_user, save_note, update_note
+    user_id, _ = create_user(main.db, "Bench", "bench@example.com", "bench")
+    note_ids = []
+    for i in range(count):
+        text = corpus.note_text(rng)
+        summary = "".join(f"<p>{corpus.paragraph(rng)}</p>\n" for _ in range(4))
+        note_id = save_note(main.db, user_id, text, summary, f"Note {i}")
+        update_note(main.db, note_id, flashcards=corpus.flashcards(rng))
+        note_ids.append(note_id)
+    return user_id, note_ids
+
+
+def set_latency(main, db_latency):
+    from studyPal.cache import llm_cache
+    from studyPal.metrics import InstrumentedRepository
+    main.db = InstrumentedRepository(LatencyRepository(main.db.repo, db_latency))
+    if llm_cache.shared is not None:
+        llm_cache.shared.db = main.db
+
+
+# -------------------------
+# Runner
+# -------------------------
+def run_scenario(app, user_id, build, ctx, requests, concurrency, seed):
+    """
+    Send `requests` requests split over `concurrency` threads. `seed` makes
+    the payloads repeatable; use a different one per scenario.
+    """
+    results = []
+    lock = threading.Lock()
+
+    def worker(count, worker_seed):
+        rng = random.Random(worker_seed)
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+        for _ in range(count):
+            method, url, kwargs = build(rng, ctx)
+            start = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            response.get_data()  # drain streamed responses
+            latency = time.perf_counter() - start
+            with lock:
+                results.append((latency, response.status_code >= 400))
+
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, n, f"{seed}-{i}") for i, n in enumerate(shares) if n]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    return summarise([r[0] for r in results], sum(r[1] for r in results), elapsed)
+
+
+def wait_for_jobs(main, started, timeout):
+    """
+    Wait for the upload jobs to drain; job latency is queue to done.
+    """
+    from studyPal.jobs import JOBS_COLLECTION, QUEUED, RUNNING, DONE
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not main.db.query(JOBS_COLLECTION, where=[("status", "in", [QUEUED, RUNNING])], limit=1):
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    jobs = [job for _, job in main.db.query(JOBS_COLLECTION)]
+    durations = [(job["updatedAt"] - job["createdAt"]).total_seconds() for job in jobs
+                 if job["status"] == DONE]
+    return summarise(durations, len(jobs) - len(durations), elapsed)
+
+
+def commit_id(cwd=None):
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True, cwd=cwd).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = {}
+    with MockOpenAI(latency=args.openai_latency, jitter=args.openai_jitter,
+                    token_latency=args.openai_token_latency,
+                    error_rate=args.openai_error_rate, seed=args.seed) as server:
+        main = load_app(server.base_url)
+        user_id, note_ids = seed_notes(main, rng, args.notes)
+        if args.db_latency:
+            set_latency(main, args.db_latency)
+        ctx = {"note_ids": note_ids,
+               "documents": corpus.documents(args.seed, args.documents, max_pages=args.max_pages)}
+
+        for name in args.scenarios:
+            started = time.perf_counter()
+            results[name] = run_scenario(main.app, user_id, SCENARIOS[name], ctx,
+                                         args.requests, args.concurrency, f"{args.seed}-{name}")
+            print_row(name, results[name])
+            if name == "upload_doc":
+                results["upload_job"] = wait_for_jobs(main, started, args.job_timeout)
+                print_row("upload_job", results["upload_job"])
+        openai_stats = dict(server.stats)
+
+    return {
+        "commit": commit_id(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "openai": openai_stats,
+        "peak_rss_mb": peak_rss_mb(),
+        "scenarios": results,
+    }
+
+
+def print_row(name, stats):
+    latency = stats["latency_ms"]
+    print(f"{name:<22} {stats['requests']:>6} req {stats['errors']:>4} err "
+          f"{stats['rps'] or 0:>9.2f} req/s  p50 {latency['p50'] or 0:>9.2f} ms  "
+          f"p95 {latency['p95'] or 0:>9.2f} ms  p99 {latency['p99'] or 0:>9.2f} ms  "
+          f"rss {stats['peak_rss_mb']:>7.1f} MB", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the StudyPal app against local stand-ins.")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=list(SCENARIOS),
+                        help="comma separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--notes", type=int, default=200, help="notes seeded before the run")
+    parser.add_argument("--documents", type=int, default=12, help="PDF/DOCX files in the upload corpus")
+    parser.add_argument("--max-pages", type=int, default=40)
+    parser.add_argument("--openai-latency", type=float, default=0.2, help="seconds to first token")
+    parser.add_argument("--openai-jitter", type=float, default=0.05)
+    parser.add_argument("--openai-token-latency", type=float, default=0.0, help="seconds per output token")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="share of requests answered 429")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="seconds added to every storage call")
+    parser.add_argument("--job-timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="results file (default: benchmarks/results/<time>-<commit>.json)")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = run(args)
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{results['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
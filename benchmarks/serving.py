@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from . import corpus
+from .run import RESULTS_DIR, commit_id, load_app, peak_rss_mb, print_row, summarise
+from .stand_ins import MockOpenAI
+
+# -------------------------
+# Serving mode benchmark
+# -------------------------
+# Many concurrent requests over real HTTP against the two serving modes of
+# one process:
+#
+#   sync:  the WSGI app on a fixed pool of --threads threads (like a
+#          threaded gunicorn worker)
+#   async: the ASGI app (studyPal.asgi) under a single uvicorn worker
+#
+# Scenarios: "summarise" and "save" post the editor form without
+# JavaScript, "stream" is the editor's Summarise button (a multipart post
+# to /edit_note/stream read to the end of its events) and "flashcards"
+# opens a note's flashcard page. OpenAI is the mock server with its
+# latency, so the difference is how many requests a worker keeps waiting
+# at once. The rate limiter's budget
+# is lifted and both modes get the same --openai-concurrency calls in
+# flight (and async connections); the requests beyond that wait in the
+# limiter's line. The load generator runs in the same process, which costs
+# both modes the same CPU.
+MODES = ("sync", "async")
+SCENARIOS = ("summarise", "save", "stream", "flashcards")
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """wsgiref server that serves each connection on a fixed thread pool."""
+    request_queue_size = 1024
+
+    def __init__(self, address, app, threads):
+        super().__init__(address, _QuietHandler)
+        self.set_app(app)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._serve, request, client_address)
+
+    def _serve(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def start_sync(app, threads):
+    server = PooledWSGIServer(("127.0.0.1", 0), app, threads)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+        server.pool.shutdown(wait=False)
+    return f"http://127.0.0.1:{server.server_address[1]}", stop
+
+
+def start_async(app):
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", backlog=1024))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+        sock.close()
+    return f"http://127.0.0.1:{sock.getsockname()[1]}", stop
+
+
+def _request(http, scenario, form, note_id):
+    if scenario == "flashcards":
+        return http.get(f"/flashcards/{note_id}")
+    if scenario == "stream":
+        # The browser's FormData: a multipart body
+        return http.post("/edit_note/stream", files={"notes": (None, form["notes"])})
+    return http.post("/edit_note", data=dict(form, action=scenario))
+
+
+async def load(base_url, cookie, scenario, requests, concurrency, seed, note_id=None):
+    """Send `requests` requests of `scenario` with at most `concurrency` open at once."""
+    import httpx
+
+    rng = random.Random(seed)
+    forms = [{"title": "Bench", "notes": corpus.note_text(rng)} for _ in range(requests)]
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookie, limits=limits, timeout=None) as http:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(form):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await _request(http, scenario, form, note_id)
+                    # Streamed summaries report failures as an error event
+                    failed = response.status_code >= 400 or "event: error" in response.text
+                except httpx.HTTPError:
+                    failed = True
+                latencies.append(time.perf_counter() - start)
+                errors += failed
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(form) for form in forms))
+    return summarise(latencies, errors, time.perf_counter() - start)
+
+
+def run(args):
+    # Before the app (and its limiter) is imported
+    os.environ.setdefault("OPENAI_RPM", str(10 ** 6))
+    os.environ.setdefault("OPENAI_TPM", str(10 ** 9))
+    os.environ["OPENAI_MAX_CONCURRENCY"] = str(args.openai_concurrency)
+    os.environ["OPENAI_ASYNC_MAX_CONNECTIONS"] = str(args.openai_concurrency)
+    results = {}
+    with MockOpenAI(latency=args.openai_latency, jitter=args.openai_jitter, seed=args.seed) as server:
+        main = load_app(server.base_url)
+        from studyPal import asgi
+        from studyPal.functions import create_user, save_note
+
+        user_id, _ = create_user(main.db, "Bench", "bench@example.com", "bench")
+        note_id = save_note(main.db, user_id, corpus.note_text(random.Random(args.seed)), None, "Bench",
+                            flashcards=[{"question": f"Q{i}", "answer": f"A{i}"} for i in range(20)])
+        session = main.app.session_interface.get_signing_serializer(main.app).dumps({"user_id": user_id})
+        cookie = {main.app.config["SESSION_COOKIE_NAME"]: session}
+
+        for mode in args.modes:
+            base_url, stop = start_sync(main.app, args.threads) if mode == "sync" else start_async(asgi.app)
+            try:
+                for scenario in args.scenarios:
+                    name = f"{mode}_{scenario}"
+                    results[name] = asyncio.run(load(base_url, cookie, scenario, args.requests,
+                                                     args.concurrency, f"{args.seed}-{name}", note_id))
+                    print_row(name, results[name])
+            finally:
+                stop()
+        openai_stats = dict(server.stats)
+
+    return {
+        "commit": commit_id(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "openai": openai_stats,
+        "peak_rss_mb": peak_rss_mb(),
+        "scenarios": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the sync (WSGI) and async (ASGI) serving modes.")
+    parser.add_argument("--modes", type=lambda s: s.split(","), default=list(MODES))
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=list(SCENARIOS),
+                        help=", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000, help="requests per mode and scenario")
+    parser.add_argument("--concurrency", type=int, default=200, help="requests open at once")
+    parser.add_argument("--threads", type=int, default=16, help="threads of the sync server")
+    parser.add_argument("--openai-concurrency", type=int, default=64, help="OpenAI calls in flight")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--openai-jitter", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="results file (default: benchmarks/results/<time>-<commit>-serving.json)")
+    args = parser.parse_args(argv)
+
+    if set(args.modes) - set(MODES) or set(args.scenarios) - set(SCENARIOS):
+        parser.error("unknown mode or scenario")
+
+    results = run(args)
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{results['commit'] or 'nogit'}-serving.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
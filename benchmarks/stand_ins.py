@@ -0,0 +1,201 @@
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -------------------------
+# Mock OpenAI server
+# -------------------------
+# Speaks just enough of the chat completions API for the app: plain and
+# streamed responses, usage counts, and optional 429s with Retry-After.
+# Flashcard requests (recognised by their system prompt) get a JSON array
+# of cards; everything else gets an HTML summary.
+
+
+class MockOpenAI:
+    """
+    Run a mock OpenAI API on localhost in a background thread.
+
+        with MockOpenAI(latency=0.2) as server:
+            client = OpenAI(api_key="bench", base_url=server.base_url)
+
+    latency is the time to the first token, token_latency the extra time per
+    generated token and error_rate the share of requests answered with 429.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.0, token_latency=0.0, error_rate=0.0,
+                 summary_tokens=150, flashcards=5, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.summary_tokens = summary_tokens
+        self.flashcards = flashcards
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "streamed": 0, "rate_limited": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Responses
+    def _delay(self):
+        with self._lock:
+            jitter = self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+            limited = self._rng.random() < self.error_rate
+        return max(0.0, self.latency + jitter), limited
+
+    def _content(self, body):
+        messages = body.get("messages", [])
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        prompt = messages[-1]["content"] if messages else ""
+        if "flashcard" in system.lower():
+            cards = [
+                {"question": f"Question {i + 1}?", "answer": f"Answer {i + 1}."}
+                for i in range(self.flashcards)
+            ]
+            # Structured output requests get the schema's wrapping object
+            if body.get("response_format", {}).get("type") == "json_schema":
+                return json.dumps({"flashcards": cards})
+            return json.dumps(cards)
+        words = prompt.split()[-self.summary_tokens:] or ["empty"]
+        return "<h2>Summary</h2>\n" + "".join(
+            f"<p>{' '.join(words[i:i + 25])}</p>\n" for i in range(0, len(words), 25))
+
+    def _usage(self, body, content):
+        prompt_tokens = math.ceil(sum(len(m.get("content", "")) for m in body.get("messages", [])) / 4)
+        completion_tokens = math.ceil(len(content) / 4)
+        with self._lock:
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=()):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    return self._send_json(404, {"error": {"message": "not found"}})
+
+                delay, limited = mock._delay()
+                with mock._lock:
+                    mock.stats["requests"] += 1
+                    mock.stats["rate_limited"] += limited
+                if limited:
+                    return self._send_json(429, {"error": {"message": "Rate limit reached",
+                                                           "type": "requests"}},
+                                           headers=[("Retry-After", "1")])
+
+                time.sleep(delay)
+                content = mock._content(body)
+                usage = mock._usage(body, content)
+                completion = {"id": f"chatcmpl-mock{time.monotonic_ns()}",
+                              "created": int(time.time()), "model": body.get("model", "mock")}
+
+                if body.get("stream"):
+                    with mock._lock:
+                        mock.stats["streamed"] += 1
+                    return self._stream(completion, content, usage,
+                                        (body.get("stream_options") or {}).get("include_usage"))
+
+                time.sleep(mock.token_latency * usage["completion_tokens"])
+                self._send_json(200, dict(
+                    completion, object="chat.completion", usage=usage,
+                    choices=[{"index": 0, "finish_reason": "stop",
+                              "message": {"role": "assistant", "content": content}}]))
+
+            def _stream(self, completion, content, usage, include_usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def event(payload):
+                    data = f"data: {payload}\n\n".encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+
+                def chunk(delta, finish_reason=None):
+                    return json.dumps(dict(completion, object="chat.completion.chunk", choices=[
+                        {"index": 0, "delta": delta, "finish_reason": finish_reason}]))
+
+                event(chunk({"role": "assistant", "content": ""}))
+                for i in range(0, len(content), 16):  # ~4 tokens per delta
+                    time.sleep(mock.token_latency * 4)
+                    event(chunk({"content": content[i:i + 16]}))
+                event(chunk({}, "stop"))
+                if include_usage:
+                    event(json.dumps(dict(completion, object="chat.completion.chunk",
+                                          choices=[], usage=usage)))
+                event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+# -------------------------
+# Repository latency
+# -------------------------
+class LatencyRepository:
+    """
+    Wrap a repository so every call takes at least `latency` seconds, to
+    approximate a network round trip to Firestore or Cloud Storage.
+    """
+
+    def __init__(self, repo, latency):
+        self._repo = repo
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self._repo, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return call
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from .run import RESULTS_DIR, commit_id, print_row, summarise
+
+# -------------------------
+# Startup benchmark
+# -------------------------
+# Cold-start cost of a worker: each sample is a fresh interpreter that
+# imports the app, builds it and serves its first request against the
+# in-memory backend. Also lists which heavy SDKs were already imported
+# before the first request.
+HEAVY_MODULES = ["firebase_admin", "google.cloud.firestore", "openai", "httpx",
+                 "pypdf", "docx", "tiktoken", "numpy"]
+
+_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import studyPal.main as main
+imported = time.perf_counter()
+create_app = getattr(main, "create_app", None)
+app = create_app() if create_app else main.app
+created = time.perf_counter()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess["user_id"] = "bench"
+status = client.get("/").status_code
+served = time.perf_counter()
+print(json.dumps({{"import": imported - start, "create_app": created - imported if create_app else None,
+                  "first_request": served - created, "status": status, "heavy_modules": heavy,
+                  "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+
+def sample(cwd):
+    env = dict(os.environ, STORAGE_BACKEND="memory", OPENAI_API_KEY="bench",
+               LLM_CACHE_SHARED="0", PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run([sys.executable, "-c", _PROBE.format(heavy=HEAVY_MODULES)],
+                            cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start time of the StudyPal app.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--cwd", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="checkout to measure (default: this one)")
+    parser.add_argument("--out", help="results file (default: benchmarks/results/startup-<time>-<commit>.json)")
+    args = parser.parse_args(argv)
+
+    sample(args.cwd)  # warm the OS file cache and .pyc files
+    samples = [sample(args.cwd) for _ in range(args.runs)]
+
+    # RSS is the worker's, not this process's (Linux reports kilobytes)
+    peak_rss_mb = round(max(s["peak_rss_kb"] for s in samples) / 1024, 1)
+    scenarios = {}
+    for phase in ("import", "create_app", "first_request"):
+        times = [s[phase] for s in samples if s[phase] is not None]
+        if times:
+            scenarios[phase] = dict(summarise(times, 0, sum(times)), peak_rss_mb=peak_rss_mb)
+            print_row(phase, scenarios[phase])
+    totals = [s["import"] + (s["create_app"] or 0) + s["first_request"] for s in samples]
+    scenarios["total"] = dict(summarise(totals, 0, sum(totals)), peak_rss_mb=peak_rss_mb)
+    print_row("total", scenarios["total"])
+    print("Imported before the first request:", ", ".join(samples[0]["heavy_modules"]) or "none")
+
+    commit = commit_id(args.cwd)
+    results = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {"runs": args.runs, "cwd": args.cwd},
+        "heavy_modules": samples[0]["heavy_modules"],
+        "scenarios": scenarios,
+    }
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"startup-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Bulk export and import of a user's notes.
+
+    python -m studyPal.archive export --user USER_ID [--format zip|jsonl] > notes.zip
+    python -m studyPal.archive import --user USER_ID notes.zip
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import zipfile
+from datetime import datetime
+from .functions import iter_notes, save_notes
+from .note_storage import is_legacy, read_summary, read_text, read_flashcards
+from .uploads import StreamingUpload, new_blob_path, acquire_upload, load_pages, save_pages
+from .extraction import iter_pages, supported_extensions
+from .metrics import stage
+
+logger = logging.getLogger("studypal.archive")
+
+# -------------------------
+# Note archives
+# -------------------------
+# An export holds one JSON record per note:
+#
+#   {"note_id", "title", "created", "original_text", "summary_text",
+#    "flashcards": [{"question", "answer"}], "file": {...} (uploads only)}
+#
+# As JSONL it is one record per line (no files). As a zip it is
+# notes/<note_id>.json per note plus, for uploaded documents,
+# files/<note_id>.<ext> named by the record's "file". Both are generated
+# note by note from a paginated notes query and sent as they are made;
+# files are copied from Storage in EXPORT_CHUNK_BYTES pieces, so neither
+# the note set nor a whole file is held in memory.
+#
+# Importing reads either format and creates the notes with save_notes in
+# batches of IMPORT_BATCH_NOTES. Attached files go through the upload
+# path: stored once per content hash, text extracted by the same
+# extractors (or reused from an earlier extraction of the file), and
+# records without a summary get a regular processing job.
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "50"))
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(1024 * 1024)))
+IMPORT_BATCH_NOTES = int(os.getenv("IMPORT_BATCH_NOTES", "50"))
+ARCHIVE_FORMATS = {"zip": "application/zip", "jsonl": "application/x-ndjson"}
+
+
+# -------------------------
+# Export
+# -------------------------
+def export_record(db, note_id, note_data):
+    """A note's archive record, read straight from storage (not cached)."""
+    created = note_data.get("timestamp")
+    record = {
+        "note_id": note_id,
+        "title": note_data.get("title"),
+        "created": created.isoformat() if isinstance(created, datetime) else created,
+        "original_text": read_text(db, note_data),
+        "summary_text": read_summary(db, note_id, note_data),
+        "flashcards": (note_data.get("flashcards") or []) if is_legacy(note_data) else read_flashcards(db, note_id),
+    }
+    if note_data.get("blob_path"):
+        extension = note_data["blob_path"].rsplit(".", 1)[-1]
+        record["file"] = f"files/{note_id}.{extension}"
+    return record
+
+
+def _iter_records(db, user_id):
+    for note in iter_notes(db, user_id, page_size=EXPORT_PAGE_SIZE):
+        note_id = note.pop("note_id")
+        yield export_record(db, note_id, note), note.get("blob_path")
+
+
+def iter_jsonl(db, user_id):
+    """Yield a user's notes as JSONL, one encoded line per note."""
+    for record, _ in _iter_records(db, user_id):
+        yield (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class _Drain(io.RawIOBase):
+    """Unseekable sink the zip is written into and emptied from."""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def take(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def iter_zip(db, user_id, include_files=True):
+    """Yield a zip archive of a user's notes (and files) piece by piece."""
+    sink = _Drain()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for record, blob_path in _iter_records(db, user_id):
+            archive.writestr(f"notes/{record['note_id']}.json", json.dumps(record, ensure_ascii=False))
+            yield sink.take()
+            if not (include_files and blob_path):
+                continue
+            try:
+                reader = db.open_blob_reader(blob_path, chunk_size=EXPORT_CHUNK_BYTES)
+            except Exception as e:
+                # A missing file should not cost the user the rest of the export
+                logger.warning("File of note %s not exported: %s", record["note_id"], e)
+                continue
+            with reader, archive.open(record["file"], "w", force_zip64=True) as entry:
+                for piece in iter(lambda: reader.read(EXPORT_CHUNK_BYTES), b""):
+                    entry.write(piece)
+                    yield sink.take()
+    yield sink.take()
+
+
+def iter_export(db, user_id, fmt="zip", include_files=True):
+    if fmt == "jsonl":
+        return iter_jsonl(db, user_id)
+    return iter_zip(db, user_id, include_files)
+
+
+# -------------------------
+# Import
+# -------------------------
+def _clean_record(record):
+    """The note fields save_notes takes, or None for an unusable record."""
+    if not isinstance(record, dict) or not (record.get("title") or record.get("summary_text")
+                                             or record.get("original_text") or record.get("file")):
+        return None
+    cards = [
+        {"question": c["question"], "answer": c["answer"]}
+        for c in record.get("flashcards") or []
+        if isinstance(c, dict) and isinstance(c.get("question"), str) and isinstance(c.get("answer"), str)
+    ]
+    return {
+        "title": str(record.get("title") or "Untitled"),
+        "original_text": record.get("original_text") if isinstance(record.get("original_text"), str) else None,
+        "summary_text": record.get("summary_text") if isinstance(record.get("summary_text"), str) else None,
+        "flashcards": cards,
+    }
+
+
+def _store_file(db, source, extension):
+    """
+    Copy an attached file into Storage as an upload (deduplicated by
+    hash). Returns (blob_path, digest, data), data being the content when
+    small enough to keep.
+    """
+    upload = StreamingUpload(db, new_blob_path(extension))
+    for piece in iter(lambda: source.read(EXPORT_CHUNK_BYTES), b""):
+        upload.write(piece)
+    try:
+        upload.wait()
+    except Exception:
+        upload.close()
+        raise
+    blob_path, new = acquire_upload(db, upload.hexdigest, extension, upload.size, blob_path=upload.blob_path)
+    if new:
+        upload.keep()
+    else:
+        upload.cancel()
+    return blob_path, upload.hexdigest, upload.getvalue()
+
+
+def _extract_text(db, digest, blob_path, extension, data):
+    """The file's text, reusing pages extracted from it before."""
+    pages = load_pages(db, digest)
+    if pages is None:
+        if data is None:
+            data = db.get_blob(blob_path)
+        pages = list(iter_pages(data, extension))
+        save_pages(db, digest, pages)
+    return "".join(pages)
+
+
+def _iter_jsonl_records(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except json.JSONDecodeError:
+            yield None, None
+
+
+def _iter_zip_records(archive):
+    for name in archive.namelist():
+        if not (name.startswith("notes/") and name.endswith(".json")):
+            continue
+        try:
+            record = json.loads(archive.read(name))
+        except json.JSONDecodeError:
+            yield None, None
+            continue
+        attached = record.get("file") if isinstance(record, dict) else None
+        yield record, attached if attached in archive.NameToInfo else None
+
+
+def import_archive(db, user_id, stream, fmt, on_queued=None):
+    """
+    Create notes for the user from a JSONL stream or a (seekable) zip
+    file. on_queued(note_id, blob_path, extension, digest) is called for
+    imported files that still need summarising. Returns counts of
+    imported, queued and skipped records.
+    """
+    counts = {"imported": 0, "queued": 0, "skipped": 0}
+    archive = zipfile.ZipFile(stream) if fmt == "zip" else None
+    records = _iter_zip_records(archive) if archive else _iter_jsonl_records(stream)
+    batch = []
+
+    def flush():
+        with stage("import.save"):
+            note_ids = save_notes(db, user_id, batch)
+        counts["imported"] += len(note_ids)
+        for note_id, note in zip(note_ids, batch):
+            if note.get("needs_job"):
+                counts["queued"] += 1
+                if on_queued is not None:
+                    on_queued(note_id, note["blob_path"], note["extension"], note["upload_hash"])
+        batch.clear()
+
+    for record, attached in records:
+        note = _clean_record(record)
+        if note is None:
+            counts["skipped"] += 1
+            continue
+        extension = attached.rsplit(".", 1)[-1].lower() if attached and "." in attached else None
+        if attached and extension in supported_extensions():
+            try:
+                with stage("import.file"), archive.open(attached) as source:
+                    blob_path, digest, data = _store_file(db, source, extension)
+                note.update(blob_path=blob_path, upload_hash=digest, extension=extension)
+                if not note["summary_text"]:
+                    # Summarised by a regular upload job once the note exists
+                    note["needs_job"] = True
+                elif not note["original_text"]:
+                    with stage("import.extract"):
+                        note["original_text"] = _extract_text(db, digest, blob_path, extension, data)
+            except Exception as e:
+                logger.warning("Attached file %s not imported: %s", attached, e)
+        batch.append(note)
+        if len(batch) >= IMPORT_BATCH_NOTES:
+            flush()
+    if batch:
+        flush()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--format", choices=list(ARCHIVE_FORMATS), default="zip")
+    parser.add_argument("path", nargs="?", help="archive to import")
+    args = parser.parse_args()
+
+    from .main import db, client
+    if args.command == "export":
+        for piece in iter_export(db, args.user, args.format):
+            sys.stdout.buffer.write(piece)
+    else:
+        from .jobs import enqueue_upload, get_executor
+        fmt = "jsonl" if args.path.endswith(".jsonl") else "zip"
+        with open(args.path, "rb") as stream:
+            counts = import_archive(db, args.user, stream, fmt, on_queued=lambda note_id, blob_path, ext, digest:
+                                    enqueue_upload(db, client, note_id, args.user, blob_path, ext, upload_hash=digest))
+        get_executor().shutdown(wait=True)
+        print(f"Imported {counts['imported']} notes ({counts['queued']} queued, {counts['skipped']} skipped).")
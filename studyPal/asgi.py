@@ -0,0 +1,399 @@
+"""
+ASGI serving mode: one worker process, one event loop.
+
+    uvicorn studyPal.asgi:app
+    python -m studyPal.asgi [--host 0.0.0.0] [--port 8000]
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Response, request, session, redirect, url_for, render_template
+from . import main
+from .cache import llm_cache, note_cache, AsyncSharedCache
+from .chunking import iter_chunks
+from .functions import (aiSummariser_async, aiSummariser_stream_async, decode_cursor, generate_flashcards_async,
+                        get_flashcards_async, get_notes_async, save_note, LISTING_FIELDS, NOTES_PAGE_SIZE)
+from .services import LazyService, make_async_repository, make_async_openai_client
+
+# -------------------------
+# ASGI serving
+# -------------------------
+# Under a WSGI server (studyPal.main:app) every request holds a worker
+# thread, also while it waits on OpenAI, so a worker summarises at most as
+# many notes at a time as it has threads. Here the requests that spend
+# their time waiting on OpenAI -- summarising a typed note (streamed, as
+# the editor does, or as a form post) and saving one, which generates its
+# flashcards -- are coroutines on the event loop: they await the
+# AsyncOpenAI client, the rate limiter and the LLM cache's shared tier (a
+# Firestore AsyncClient), so a single worker holds hundreds of them at
+# once. The dashboard and the flashcard pages read through the async
+# repository too. Committing a new note also writes to Cloud Storage,
+# which has no asyncio client, so that step runs on a thread.
+#
+# Every other request (note pages, edits of stored notes, uploads,
+# exports) is served by the Flask app itself on a pool of
+# ASGI_WSGI_THREADS threads, with the request body and the response
+# streamed between the event loop and the thread. Both modes run the same
+# views, sessions and metrics; the WSGI path is unchanged.
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "32"))
+ASGI_BODY_CHUNK = 64 * 1024
+
+logger = logging.getLogger("studypal.asgi")
+
+# Async clients are created on first use, on the serving event loop
+adb = LazyService(lambda: make_async_repository(main.db))
+aclient = LazyService(make_async_openai_client)
+
+
+# -------------------------
+# Async views
+# -------------------------
+def serves_async(req):
+    """Whether edit_note_async serves this POST to /edit_note."""
+    return req.form.get("action") in ("summarise", "save") and not req.values.get("note_id")
+
+
+async def edit_note_async():
+    """main.edit_note for new notes: summarise or save without a thread."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    title = request.form.get("title", "Untitled")
+    text = request.form["notes"]
+
+    if request.form.get("action") == "save":
+        try:
+            cards = await generate_flashcards_async(main.db, user_id, None, text, aclient)
+        except Exception as e:
+            # The note is saved either way; its cards can be made on the next edit
+            logger.warning("Flashcards not generated for note %r: %s", title, e)
+            cards = []
+        await asyncio.to_thread(save_note, main.db, user_id, text, None, title, flashcards=cards)
+        return redirect(url_for("home"))
+
+    # The chunks of a long note are summarised concurrently
+    summaries = await asyncio.gather(*(aiSummariser_async(chunk["text"], aclient)
+                                       for chunk in iter_chunks([text])))
+    return render_template("write.html", summary="\n".join(summaries), user_id=user_id, title=title,
+                           content=text, note_id=None)
+
+
+async def home_async():
+    """main.home with the page of notes read through the async repository."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    cursor = request.args.get("cursor")
+    try:
+        start_after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return "Invalid page cursor", 400
+    notes, next_cursor = await get_notes_async(adb, user_id, NOTES_PAGE_SIZE, start_after, LISTING_FIELDS)
+    return render_template("home.html", notes=notes, next_cursor=next_cursor)
+
+
+async def edit_note_stream_async():
+    """main.edit_note_stream over the AsyncOpenAI client."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    text = request.form.get("notes", "")
+
+    async def generate():
+        try:
+            for i, chunk in enumerate(iter_chunks([text])):
+                if i:
+                    yield main.sse_event("\n")
+                async for fragment in aiSummariser_stream_async(chunk["text"], aclient):
+                    yield main.sse_event(fragment)
+            yield main.sse_event("", event="done")
+        except Exception as e:
+            logger.exception("Streaming summary failed: %s", e)
+            yield main.sse_event("Summary failed, please try again.", event="error")
+
+    # An async body is sent by AsgiApp as it is produced
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def flashcards_async(note_id):
+    """main.flashcards read through the async repository."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    cards = await get_flashcards_async(adb, user_id, note_id)
+    return render_template("flashcards.html", flashcards=cards, note_id=note_id)
+
+
+def _method(name):
+    return lambda req: req.method == name
+
+
+# endpoint -> (serves_async(request), view)
+ASYNC_VIEWS = {
+    "home": (_method("GET"), home_async),
+    "edit_note": (serves_async, edit_note_async),
+    "edit_note_stream": (_method("POST"), edit_note_stream_async),
+    "flashcards": (_method("GET"), flashcards_async),
+}
+
+
+# -------------------------
+# WSGI bridge
+# -------------------------
+def wsgi_environ(scope, body):
+    """The WSGI environ of an ASGI http scope, reading the body from `body`."""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        # The body reader ends at the end of the request, with or without
+        # a Content-Length
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin-1").lower(), value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class BodyReader(io.RawIOBase):
+    """
+    wsgi.input for a view running on a thread: reads the request body
+    from the ASGI receive channel on the event loop as the view asks for it.
+    """
+
+    def __init__(self, receive, loop):
+        super().__init__()
+        self._receive = receive
+        self._loop = loop
+        self._pending = b""
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message["type"] == "http.disconnect":
+                raise ConnectionError("Client disconnected")
+            self._pending = message.get("body", b"")
+            self._more = message.get("more_body", False)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def replay(body):
+    """A receive channel that returns an already read body again."""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+    return receive
+
+
+async def read_body(receive):
+    chunks, more = [], True
+    while more:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionError("Client disconnected")
+        chunks.append(message.get("body", b""))
+        more = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+def _start_message(status, headers):
+    return {
+        "type": "http.response.start",
+        "status": int(str(status).split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    }
+
+
+class AsgiApp:
+    """
+    ASGI application around the Flask app: the views in ASYNC_VIEWS run
+    on the event loop, everything else on the WSGI thread pool.
+    """
+
+    def __init__(self, flask_app, threads=None):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads or ASGI_WSGI_THREADS,
+                                           thread_name_prefix="studypal-wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return  # no websockets
+
+        view = ASYNC_VIEWS.get(self._endpoint(scope))
+        if view is not None and (scope["method"] == "GET" or scope["method"] == "POST" and self._small_form(scope)):
+            body = await read_body(receive)
+            if await self._serve_async(scope, body, *view, send):
+                return
+            receive = replay(body)
+        loop = asyncio.get_running_loop()
+        environ = wsgi_environ(scope, io.BufferedReader(BodyReader(receive, loop), ASGI_BODY_CHUNK))
+        await loop.run_in_executor(self.executor, self._serve_wsgi, environ, send, loop)
+
+    def _endpoint(self, scope):
+        try:
+            endpoint, _ = self.flask_app.url_map.bind("").match(scope["path"], method=scope["method"])
+        except Exception:
+            return None  # not found, redirects, wrong method: Flask answers those
+        return endpoint
+
+    def _small_form(self, scope):
+        # Only form posts to the async views are read ahead, multipart ones
+        # (the editor's fetch sends FormData) only with a known length
+        headers = dict(scope.get("headers", []))
+        content_type = headers.get(b"content-type", b"")
+        length = headers.get(b"content-length")
+        if content_type.startswith(b"multipart/form-data"):
+            if not (length and length.isdigit()):
+                return False
+        elif not content_type.startswith(b"application/x-www-form-urlencoded"):
+            return False
+        limit = self.flask_app.config.get("MAX_CONTENT_LENGTH")
+        return not (limit and length and length.isdigit() and int(length) > limit)
+
+    async def _serve_async(self, scope, body, accepts, view, send):
+        """Run `view` as Flask would; False if it does not take the request."""
+        app = self.flask_app
+        with app.request_context(wsgi_environ(scope, io.BytesIO(body))):
+            try:
+                if not accepts(request):
+                    return False
+            except Exception:
+                return False  # let Flask report a malformed request
+            # Same hooks as a Flask dispatch: metrics timing, session saving
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await view(**(request.view_args or {}))
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                response = app.handle_exception(e)
+            await send(_start_message(response.status_code, response.headers.to_wsgi_list()))
+            body = response.response
+            if not hasattr(body, "__aiter__"):
+                await send({"type": "http.response.body", "body": response.get_data()})
+                return True
+            # A streamed body (async generator): sent as it is produced
+            try:
+                async for piece in body:
+                    if isinstance(piece, str):
+                        piece = piece.encode("utf-8")
+                    if piece:
+                        await send({"type": "http.response.body", "body": piece, "more_body": True})
+            finally:
+                await body.aclose()
+            await send({"type": "http.response.body", "body": b""})
+        return True
+
+    def _serve_wsgi(self, environ, send, loop):
+        """Run the Flask app on this (pool) thread, sending its response
+        through the event loop as it is produced."""
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+        sent = False
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [_start_message(status, headers)]
+
+        result = None
+        try:
+            result = self.flask_app(environ, start_response)
+            for chunk in result:
+                if not sent:
+                    call(started[0])
+                    sent = True
+                if chunk:
+                    call({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not sent:
+                call(started[0])
+                sent = True
+        except Exception:
+            logger.exception("Error serving %s %s", environ["REQUEST_METHOD"], environ["PATH_INFO"])
+            # Once the status is sent, the body can only end where it stopped
+            if not sent:
+                call(_start_message(500, [("Content-Type", "text/plain; charset=utf-8")]))
+                call({"type": "http.response.body", "body": b"Internal Server Error", "more_body": True})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        call({"type": "http.response.body", "body": b""})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app(flask_app=None, threads=None):
+    if llm_cache.shared is not None:
+        # Read the shared LLM cache through the async repository too
+        llm_cache.async_shared = AsyncSharedCache(adb, collection=llm_cache.shared.collection,
+                                                  ttl=llm_cache.shared.ttl)
+    if note_cache.shared is not None:
+        note_cache.async_shared = AsyncSharedCache(adb, collection=note_cache.shared.collection,
+                                                   ttl=note_cache.shared.ttl)
+    return AsgiApp(flask_app or main.app, threads)
+
+
+# Module-level app for ASGI servers (studyPal.asgi:app)
+app = create_asgi_app()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
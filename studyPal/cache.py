@@ -0,0 +1,442 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from .metrics import REGISTRY
+
+logger = logging.getLogger("studypal.cache")
+
+# -------------------------
+# LLM result cache
+# -------------------------
+# Results are content addressed: the key is a hash of the calling function,
+# the model and the full prompt, so identical requests from any user hit
+# the same entry. Lookups go local LRU -> shared repository tier -> OpenAI.
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Firestore documents are capped at 1 MiB, leave room for the other fields
+SHARED_MAX_VALUE_BYTES = 900 * 1024
+
+
+def value_size(value):
+    """Approximate size in bytes of a cached string or JSON-like value."""
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(json.dumps(value, default=str))
+
+
+def cache_key(function, model, *prompt_parts):
+    h = hashlib.sha256()
+    for part in (function, model, *prompt_parts):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU with a per-entry TTL, bounded both by entry
+    count and by the total size of the cached strings.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, _, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, size=None):
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+class SharedCache:
+    """
+    Shared cache tier: one document per key in a repository collection
+    ("llm_cache" by default). Expired entries are ignored on read; on
+    Firestore a TTL policy on `expiresAt` deletes them for good.
+    """
+
+    def __init__(self, db, collection="llm_cache", ttl=CACHE_TTL):
+        self.db = db
+        self.collection = collection
+        self.ttl = ttl
+
+    @staticmethod
+    def _value(data):
+        if data is None:
+            return None
+        if data["expiresAt"] < datetime.now(timezone.utc):
+            return None
+        return data["value"]
+
+    def _entry(self, value):
+        if value_size(value) > SHARED_MAX_VALUE_BYTES:
+            return None
+        return {"value": value, "expiresAt": datetime.now(timezone.utc) + timedelta(seconds=self.ttl)}
+
+    def get(self, key):
+        return self._value(self.db.get(self.collection, key))
+
+    def set(self, key, value):
+        entry = self._entry(value)
+        if entry is not None:
+            self.db.set(self.collection, key, entry)
+
+    def delete(self, key):
+        self.db.delete(self.collection, key)
+
+
+class AsyncSharedCache(SharedCache):
+    """
+    The same shared tier over an async repository (asgi.py): the same
+    documents, with get/set/delete awaited.
+    """
+
+    async def get(self, key):
+        return self._value(await self.db.get(self.collection, key))
+
+    async def set(self, key, value):
+        entry = self._entry(value)
+        if entry is not None:
+            await self.db.set(self.collection, key, entry)
+
+    async def delete(self, key):
+        await self.db.delete(self.collection, key)
+
+
+class LLMCache:
+    """
+    Two-tier cache in front of the OpenAI calls, with hit/miss counters.
+    """
+
+    def __init__(self, local=None, shared=None):
+        self.local = local if local is not None else LRUCache()
+        self.shared = shared
+        self.async_shared = None  # AsyncSharedCache used by the *_async methods
+        self._lock = threading.Lock()
+        self._stats = {"local_hits": 0, "shared_hits": 0, "misses": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count("local_hits")
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                # The shared tier is an optimisation, never a point of failure
+                logger.warning("LLM cache read failed: %s", e)
+                self._count("errors")
+            if value is not None:
+                self._count("shared_hits")
+                self.local.set(key, value)
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as e:
+                logger.warning("LLM cache write failed: %s", e)
+                self._count("errors")
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, computing and storing it on a miss.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    # Coroutine versions for the ASGI app; the shared tier is read through
+    # async_shared, so a lookup never blocks the event loop
+    async def get_async(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count("local_hits")
+            return value
+        if self.async_shared is not None:
+            try:
+                value = await self.async_shared.get(key)
+            except Exception as e:
+                logger.warning("LLM cache read failed: %s", e)
+                self._count("errors")
+            if value is not None:
+                self._count("shared_hits")
+                self.local.set(key, value)
+                return value
+        self._count("misses")
+        return None
+
+    async def set_async(self, key, value):
+        self.local.set(key, value)
+        if self.async_shared is not None:
+            try:
+                await self.async_shared.set(key, value)
+            except Exception as e:
+                logger.warning("LLM cache write failed: %s", e)
+                self._count("errors")
+
+    async def get_or_compute_async(self, key, compute):
+        """get_or_compute with an async compute()."""
+        value = await self.get_async(key)
+        if value is None:
+            value = await compute()
+            await self.set_async(key, value)
+        return value
+
+    def clear(self):
+        """
+        Drop the local tier and reset the counters.
+        """
+        self.local.clear()
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["local_hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["local_entries"] = len(self.local)
+        return stats
+
+
+# -------------------------
+# Note cache
+# -------------------------
+# Read-through cache for the note reads behind viewNote, flashcards and
+# downloadNote: the note document, its summary and its flashcards, each
+# cached under "<kind>:<note_id>". Lookups go local LRU (bounded by entry
+# count and by the JSON size of the values) -> optional shared tier
+# ("note_cache" collection, one read instead of a subcollection query)
+# -> the repository.
+#
+# Every write to a note (save_note, update_note, delete_note, migrations,
+# edits) calls invalidate(), which drops the note from both tiers. Other
+# worker processes only see the shared tier dropped, so their local
+# entries expire after NOTE_CACHE_TTL seconds. A load that overlaps an
+# invalidation is returned but not cached. To measure staleness, a
+# NOTE_CACHE_VERIFY_RATE share of hits is read again from the repository
+# and counted as stale when it differs.
+NOTE_CACHE_TTL = int(os.getenv("NOTE_CACHE_TTL", "60"))  # seconds
+NOTE_CACHE_MAX_ENTRIES = int(os.getenv("NOTE_CACHE_MAX_ENTRIES", "2048"))
+NOTE_CACHE_MAX_BYTES = int(os.getenv("NOTE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+NOTE_CACHE_VERIFY_RATE = float(os.getenv("NOTE_CACHE_VERIFY_RATE", "0.01"))
+NOTE_CACHE_KINDS = ("note", "summary", "flashcards")
+
+NOTE_CACHE_LOOKUPS = REGISTRY.counter(
+    "studypal_note_cache_lookups_total", "Note cache lookups, by kind and result.", ("kind", "result"))
+NOTE_CACHE_STALE = REGISTRY.counter(
+    "studypal_note_cache_stale_reads_total", "Sampled note cache hits that differed from the repository.", ("kind",))
+
+
+class NoteCache:
+    """
+    Two-tier read-through cache of note data. Values are copied on the way
+    in and out, so callers may modify what they get.
+    """
+
+    def __init__(self, local=None, shared=None, verify_rate=NOTE_CACHE_VERIFY_RATE):
+        self.local = local if local is not None else LRUCache(
+            NOTE_CACHE_MAX_ENTRIES, NOTE_CACHE_MAX_BYTES, NOTE_CACHE_TTL)
+        self.shared = shared
+        self.async_shared = None  # AsyncSharedCache used by get_or_load_async
+        self.verify_rate = verify_rate
+        self._lock = threading.Lock()
+        self._invalidations = 0
+        self._stats = {"local_hits": 0, "shared_hits": 0, "misses": 0, "stale": 0, "verified": 0, "errors": 0}
+
+    def _count(self, name, kind=None):
+        with self._lock:
+            self._stats[name] += 1
+        if name == "stale":
+            NOTE_CACHE_STALE.inc(kind=kind)
+        elif kind is not None:
+            NOTE_CACHE_LOOKUPS.inc(kind=kind, result=name[:-1] if name.endswith("hits") else name)
+
+    def _lookup(self, key, kind):
+        value = self.local.get(key)
+        if value is not None:
+            self._count("local_hits", kind)
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                logger.warning("Note cache read failed: %s", e)
+                self._count("errors")
+            if value is not None:
+                self._count("shared_hits", kind)
+                self.local.set(key, value, value_size(value))
+                return value
+        return None
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            if generation != self._invalidations:
+                # The note changed while it was being read
+                return
+        self.local.set(key, value, value_size(value))
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as e:
+                logger.warning("Note cache write failed: %s", e)
+                self._count("errors")
+
+    def get_or_load(self, kind, note_id, load):
+        """
+        The cached `kind` data of a note, calling load() on a miss. None
+        (a missing note) is never cached.
+        """
+        key = f"{kind}:{note_id}"
+        value = self._lookup(key, kind)
+        if value is not None and random.random() < self.verify_rate:
+            generation = self._invalidations
+            fresh = load()
+            self._count("verified")
+            if fresh != value:
+                self._count("stale", kind)
+                self.invalidate(note_id)
+                if fresh is not None:
+                    self._store(key, copy.deepcopy(fresh), generation + 1)
+                return fresh
+        if value is None:
+            self._count("misses", kind)
+            generation = self._invalidations
+            value = load()
+            if value is None:
+                return None
+            self._store(key, copy.deepcopy(value), generation)
+            return value
+        return copy.deepcopy(value)
+
+    async def get_or_load_async(self, kind, note_id, load):
+        """
+        get_or_load for the ASGI app, with an async load() and the shared
+        tier read through async_shared. Hits are not sampled for staleness.
+        """
+        key = f"{kind}:{note_id}"
+        value = self.local.get(key)
+        if value is not None:
+            self._count("local_hits", kind)
+            return copy.deepcopy(value)
+        if self.async_shared is not None:
+            try:
+                value = await self.async_shared.get(key)
+            except Exception as e:
+                logger.warning("Note cache read failed: %s", e)
+                self._count("errors")
+            if value is not None:
+                self._count("shared_hits", kind)
+                self.local.set(key, value, value_size(value))
+                return copy.deepcopy(value)
+        self._count("misses", kind)
+        generation = self._invalidations
+        value = await load()
+        if value is None:
+            return None
+        with self._lock:
+            # Not cached if the note changed while it was being read
+            current = generation == self._invalidations
+        if current:
+            self.local.set(key, copy.deepcopy(value), value_size(value))
+            if self.async_shared is not None:
+                try:
+                    await self.async_shared.set(key, value)
+                except Exception as e:
+                    logger.warning("Note cache write failed: %s", e)
+                    self._count("errors")
+        return value
+
+    def invalidate(self, note_id):
+        with self._lock:
+            self._invalidations += 1
+        for kind in NOTE_CACHE_KINDS:
+            key = f"{kind}:{note_id}"
+            self.local.delete(key)
+            if self.shared is not None:
+                try:
+                    self.shared.delete(key)
+                except Exception as e:
+                    logger.warning("Note cache invalidation failed: %s", e)
+                    self._count("errors")
+
+    def clear(self):
+        self.local.clear()
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["local_hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["stale_rate"] = stats["stale"] / stats["verified"] if stats["verified"] else 0.0
+        stats["local_entries"] = len(self.local)
+        return stats
+
+
+# Process-wide caches used by functions.py; main.py attaches the shared tiers.
+llm_cache = LLMCache()
+note_cache = NoteCache()
@@ -0,0 +1,135 @@
+import math
+import os
+import re
+
+# -------------------------
+# Token counting
+# -------------------------
+# tiktoken gives exact counts for the OpenAI models; without it we fall back
+# to the usual ~4 characters per token estimate. It is imported on first use.
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "8000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "200"))
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")  # gpt-4o family
+        except Exception:
+            _encoding = False  # tiktoken or its encoding files unavailable, use the estimate
+    return _encoding or None
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+# -------------------------
+# Structure-preserving chunker
+# -------------------------
+# Paragraphs end at a blank line, sentences at terminal punctuation. Every
+# piece keeps its trailing whitespace so a chunk's text is exactly
+# document[start:end].
+_PARAGRAPH_RE = re.compile(r".*?(?:\n[ \t]*\n\s*|\Z)", re.DOTALL)
+_SENTENCE_RE = re.compile(r".*?(?:[.!?]+[\"')\]]*\s+|\Z)", re.DOTALL)
+_WORD_RE = re.compile(r"\S+\s*|\s+")
+
+
+def _split(text, pattern):
+    return [m.group(0) for m in pattern.finditer(text) if m.group(0)]
+
+
+def _units(text, max_tokens):
+    """
+    Break text into pieces of at most max_tokens, preferring paragraph, then
+    sentence, then word boundaries. Yields (piece, tokens).
+    """
+    for paragraph in _split(text, _PARAGRAPH_RE):
+        tokens = count_tokens(paragraph)
+        if tokens <= max_tokens:
+            yield paragraph, tokens
+            continue
+        for sentence in _split(paragraph, _SENTENCE_RE):
+            tokens = count_tokens(sentence)
+            if tokens <= max_tokens:
+                yield sentence, tokens
+                continue
+            piece, piece_tokens = "", 0
+            for word in _split(sentence, _WORD_RE):
+                word_tokens = count_tokens(word)
+                if piece and piece_tokens + word_tokens > max_tokens:
+                    yield piece, piece_tokens
+                    piece, piece_tokens = "", 0
+                piece += word
+                piece_tokens += word_tokens
+            if piece:
+                yield piece, piece_tokens
+
+
+def iter_chunks(pages, max_tokens=None, overlap_tokens=None):
+    """
+    Stream token-bounded chunks out of an iterable of page texts.
+
+    Pages are consumed one at a time and chunks break on page, paragraph or
+    sentence boundaries. The last `overlap_tokens` worth of units from each
+    chunk are repeated at the start of the next one. Each chunk is a dict:
+
+        {"index", "text", "tokens", "start", "end", "pages": [first, last]}
+
+    where start/end are character offsets into "".join(pages) and pages are
+    1-based page numbers.
+    """
+    max_tokens = max_tokens or CHUNK_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    current = []  # (text, tokens, start, page)
+    current_tokens = 0
+    index = 0
+    offset = 0
+
+    def make_chunk():
+        return {
+            "index": index,
+            "text": "".join(unit[0] for unit in current),
+            "tokens": current_tokens,
+            "start": current[0][2],
+            "end": current[-1][2] + len(current[-1][0]),
+            "pages": [current[0][3], current[-1][3]],
+        }
+
+    for page_number, page in enumerate(pages, start=1):
+        units = list(_units(page, max_tokens))
+        page_tokens = sum(tokens for _, tokens in units)
+        # A page that does not fit starts a new chunk if the current one is
+        # already reasonably full, rather than being cut mid-page
+        start_new_chunk = bool(current) and current_tokens + page_tokens > max_tokens \
+            and current_tokens >= max_tokens // 2
+        for text, tokens in units:
+            if current and (start_new_chunk or current_tokens + tokens > max_tokens):
+                start_new_chunk = False
+                yield make_chunk()
+                index += 1
+                # Carry the tail of the chunk over as overlap, as long as it
+                # still leaves room for the new unit
+                carried, carried_tokens = [], 0
+                for unit in reversed(current):
+                    if carried_tokens + unit[1] > overlap_tokens or \
+                            carried_tokens + unit[1] + tokens > max_tokens:
+                        break
+                    carried.insert(0, unit)
+                    carried_tokens += unit[1]
+                current, current_tokens = carried, carried_tokens
+            current.append((text, tokens, offset, page_number))
+            current_tokens += tokens
+            offset += len(text)
+
+    if current:
+        yield make_chunk()
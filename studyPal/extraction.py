@@ -0,0 +1,166 @@
+import collections
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+# -------------------------
+# Text extraction engine
+# -------------------------
+# Every format registers a page generator taking the raw file bytes. Large
+# PDFs are split into page ranges parsed in a pool of worker processes, so
+# extraction neither holds the GIL of the web/job worker nor runs on a
+# single core. The parsers (pypdf, python-docx) are imported on first use.
+MAX_PAGES = int(os.getenv("EXTRACT_MAX_PAGES", "1000"))
+MAX_TEXT_BYTES = int(os.getenv("EXTRACT_MAX_TEXT_BYTES", str(20 * 1024 * 1024)))
+EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "16"))
+
+
+class ExtractionLimitError(ValueError):
+    """Raised when a document has more pages or text than we accept."""
+
+
+EXTRACTORS = {}
+
+
+def register_extractor(extension):
+    """
+    Decorator registering fn(data, max_pages) -> iterator of page texts.
+    """
+    def decorator(fn):
+        EXTRACTORS[extension] = fn
+        return fn
+    return decorator
+
+
+def supported_extensions():
+    return tuple(EXTRACTORS)
+
+
+def iter_pages(data, extension, max_pages=None, max_bytes=None):
+    """
+    Yield the text of a document one page at a time, enforcing the page
+    and extracted-text limits as it goes.
+    """
+    if extension not in EXTRACTORS:
+        raise ValueError(f"Unsupported file type: {extension}")
+    max_pages = max_pages or MAX_PAGES
+    max_bytes = max_bytes or MAX_TEXT_BYTES
+
+    total_bytes = 0
+    for page_number, page in enumerate(EXTRACTORS[extension](data, max_pages), start=1):
+        if page_number > max_pages:
+            raise ExtractionLimitError(f"Document has more than {max_pages} pages.")
+        total_bytes += len(page.encode("utf-8"))
+        if total_bytes > max_bytes:
+            raise ExtractionLimitError(f"Document has more than {max_bytes} bytes of text.")
+        yield page
+
+
+def extract_text(data, extension, **limits):
+    """
+    Extract a whole document into one string.
+    """
+    buffer = io.StringIO()
+    for page in iter_pages(data, extension, **limits):
+        buffer.write(page)
+    return buffer.getvalue()
+
+
+# -------------------------
+# PDF
+# -------------------------
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn rather than fork: the parent process runs job and request
+        # threads, and forking a multi-threaded process is unsafe
+        _pool = ProcessPoolExecutor(
+            max_workers=EXTRACT_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _extract_pdf_range(source, start, stop):
+    """Page texts start..stop of a PDF given as bytes or a file path."""
+    reader = _pdf_reader(source)
+    return [(reader.pages[i].extract_text() or "") + "\n" for i in range(start, stop)]
+
+
+# Worker processes keep the reader of the file they parsed last, so the
+# document structure is read once per worker rather than once per range
+_worker_reader = (None, None)
+
+
+def _pdf_reader(source):
+    global _worker_reader
+    from pypdf import PdfReader
+    if not isinstance(source, str):
+        return PdfReader(io.BytesIO(source))
+    # Temporary file names can come round again
+    stat = os.stat(source)
+    key = (source, stat.st_ino, stat.st_mtime_ns)
+    if _worker_reader[0] != key:
+        _worker_reader = (key, PdfReader(source))
+    return _worker_reader[1]
+
+
+@register_extractor("pdf")
+def pdf_pages(data, max_pages):
+    from pypdf import PdfReader
+    page_count = len(PdfReader(io.BytesIO(data)).pages)
+    # Read one page past the limit so iter_pages can report it
+    page_count = min(page_count, max_pages + 1)
+
+    if EXTRACT_PROCESSES <= 1 or page_count <= PAGES_PER_TASK:
+        for page in _extract_pdf_range(data, 0, page_count):
+            yield page
+        return
+
+    # The workers read the document from a temporary file instead of each
+    # task being sent a copy of it, and only a few ranges per worker are
+    # in flight, so a slow reader does not pile up parsed pages
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+        f.write(data)
+        f.flush()
+        ranges = iter([(start, min(start + PAGES_PER_TASK, page_count))
+                       for start in range(0, page_count, PAGES_PER_TASK)])
+        futures = collections.deque()
+        try:
+            while True:
+                while len(futures) < EXTRACT_PROCESSES * 2:
+                    pages = next(ranges, None)
+                    if pages is None:
+                        break
+                    futures.append(_get_pool().submit(_extract_pdf_range, f.name, *pages))
+                if not futures:
+                    break
+                for page in futures.popleft().result():
+                    yield page
+        finally:
+            for future in futures:
+                future.cancel()
+            # Ranges already running still read the file
+            concurrent.futures.wait(futures)
+
+
+# -------------------------
+# DOCX
+# -------------------------
+@register_extractor("docx")
+def docx_pages(data, max_pages):
+    # DOCX has no fixed pages, so the whole document is a single page
+    from docx import Document
+    reader = Document(io.BytesIO(data))
+    buffer = io.StringIO()
+    for para in reader.paragraphs:
+        buffer.write(para.text)
+        buffer.write("\n")
+    yield buffer.getvalue()
@@ -1,8 +1,31 @@
 import uuid
 import hashlib
-from firebase_admin import firestore
+import base64
+from datetime import datetime
 import json
 import re
+from .cache import cache_key, llm_cache, note_cache
+from .metrics import REGISTRY, stage, record_usage
+from .ratelimit import openai_limiter, INTERACTIVE
+from .chunking import count_tokens
+from .repository import ID, SERVER_TIMESTAMP
+from .uploads import release_upload
+from .search import index_note, index_notes, unindex_note
+from .review import sync_note_cards, remove_note_cards
+from .note_storage import (
+    LAYOUT_VERSION,
+    is_legacy,
+    write_text,
+    read_text,
+    write_summary,
+    read_summary,
+    write_flashcards,
+    read_flashcards,
+    read_flashcards_async,
+    write_chunks,
+    delete_body,
+    migrate_note,
+)
 
 # -------------------------
 # User functions
@@ -15,24 +38,22 @@ def generate_user_id():
 
 def create_user(db, name, email, password):
     user_id = generate_user_id()
-    users_ref = db.collection("users")
-    users_ref.document(user_id).set({
+    db.set("users", user_id, {
         "name": name,
         "email": email,
         "password": hash_password(password),
-        "createdAt": firestore.SERVER_TIMESTAMP
+        "createdAt": SERVER_TIMESTAMP
     })
     return user_id, f"User {name} created."
 
 def login_user(db, email, password):
-    users_ref = db.collection("users")
-    query = users_ref.where("email", "==", email).limit(1).get()
+    query = db.query("users", where=[("email", "==", email)], limit=1)
     if not query:
         return False, "User not found", None
-    user = query[0]
-    stored_hash = user.to_dict()["password"]
+    user_id, user = query[0]
+    stored_hash = user["password"]
     if stored_hash == hash_password(password):
-        return True, f"Welcome {user.to_dict()['name']}", user.id
+        return True, f"Welcome {user['name']}", user_id
     else:
         return False, "Incorrect password", None
 
@@ -40,8 +61,40 @@ def login_user(db, email, password):
 # -------------------------
 # AI functions
 # -------------------------
-def aiSummariser(text, client):
-        model = "gpt-4o-mini",
+MODEL = "gpt-4o-mini"
+# Completion tokens reserved from the rate limiter before a call; the
+# response's usage replaces the estimate
+COMPLETION_TOKENS_ESTIMATE = 1000
+SUMMARY_SYSTEM_PROMPT = "You are a helpful study assistant that formats notes perfectly in HTML."
+FLASHCARD_SYSTEM_PROMPT = "You are a helpful study assistant. Your ONLY output must be a valid, parsable JSON object whose 'flashcards' key holds an array of flashcard objects, each with 'question' and 'answer' keys. Do not output any markdown code fences (```json) or text."
+# Structured output: the API only returns JSON matching this schema
+FLASHCARD_SCHEMA = {
+    "name": "flashcards",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "flashcards": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"question": {"type": "string"}, "answer": {"type": "string"}},
+                    "required": ["question", "answer"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["flashcards"],
+        "additionalProperties": False,
+    },
+}
+
+def _estimate_tokens(messages):
+    return sum(count_tokens(m["content"]) for m in messages) + COMPLETION_TOKENS_ESTIMATE
+
+
+def _summary_request(text):
+        """Build the summary messages and their LLM cache key."""
         prompt=f"""
             Summarize the following text for revision. 
     
@@ -57,69 +110,384 @@ def aiSummariser(text, client):
             Text to summarize: {text}"""
         messages_list = [
             # Message 0: The System Role (must be a dictionary)
-            {"role": "system", "content": "You are a helpful study assistant that formats notes perfectly in HTML."},
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
             
             # Message 1: The User Prompt (must be a dictionary)
             {"role": "user", "content": prompt}
         ]
+        return messages_list, cache_key("aiSummariser", MODEL, SUMMARY_SYSTEM_PROMPT, prompt)
+
+
+def aiSummariser(text, client, priority=INTERACTIVE):
+        messages_list, key = _summary_request(text)
+
+        def summarise():
+            with stage("openai.summary"):
+                # Waits for a rate limiter slot and retries 429s (ratelimit.py)
+                response = openai_limiter.call(lambda: client.chat.completions.create(
+                    model=MODEL,
+                    messages=messages_list
+                ), _estimate_tokens(messages_list), priority)
+            record_usage("aiSummariser", getattr(response, "usage", None))
+            return _summary_html(response)
+
+        # Identical text (re-uploaded slides, repeated "summarise" clicks)
+        # is served from the LLM cache instead of a new paid call
+        return llm_cache.get_or_compute(key, summarise)
+
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", # Using gpt-4o-mini as in your example
-            messages=messages_list
-        )
-        
+def _summary_html(response):
         # Get the raw HTML content
         html_summary = response.choices[0].message.content.strip()
-        
+
         # A small cleanup to remove potential markdown code fences
         # sometimes the AI wraps its HTML output in ```html ... ```
         if html_summary.startswith("```html"):
             html_summary = html_summary[7:] # Remove "```html\n"
         if html_summary.endswith("```"):
             html_summary = html_summary[:-3] # Remove "```"
-            
+
         return html_summary.strip()
 
 
+async def aiSummariser_async(text, aclient, priority=INTERACTIVE):
+        """
+        aiSummariser for the ASGI app: awaits an AsyncOpenAI client, and
+        the LLM cache's shared tier, instead of blocking a thread.
+        """
+        messages_list, key = _summary_request(text)
+
+        async def summarise():
+            with stage("openai.summary"):
+                response = await openai_limiter.call_async(lambda: aclient.chat.completions.create(
+                    model=MODEL,
+                    messages=messages_list
+                ), _estimate_tokens(messages_list), priority)
+            record_usage("aiSummariser", getattr(response, "usage", None))
+            return _summary_html(response)
+
+        return await llm_cache.get_or_compute_async(key, summarise)
+
+
+class FenceStripper:
+    """
+    Incremental version of aiSummariser's code-fence cleanup. Text is held
+    back only while it could still be a leading "```html" or a trailing
+    "```", so everything else is passed on as soon as it arrives.
+    """
+    _TAIL_RE = re.compile(r"\s*(?:`{1,3}\s*)?$")
+
+    def __init__(self):
+        self._pending = ""
+        self._started = False
+        self._leading = True
+
+    def feed(self, delta):
+        self._pending += delta
+        if not self._started:
+            head = self._pending.lstrip()
+            if len(head) < 7 and "```html".startswith(head):
+                return ""
+            if head.startswith("```html"):
+                head = head[7:]
+            self._pending = head
+            self._started = True
+        if self._leading:
+            self._pending = self._pending.lstrip()
+            self._leading = not self._pending
+        cut = self._TAIL_RE.search(self._pending).start()
+        out, self._pending = self._pending[:cut], self._pending[cut:]
+        return out
+
+    def finish(self):
+        tail = self._pending.strip()
+        if not self._started and tail.startswith("```html"):
+            tail = tail[7:]
+        if tail.endswith("```"):
+            tail = tail[:-3]
+        self._pending = ""
+        return tail.rstrip()
+
+
+def aiSummariser_stream(text, client, priority=INTERACTIVE):
+        """
+        Like aiSummariser, but yields the HTML summary in fragments as the
+        model generates it. The complete summary is added to the LLM cache.
+        """
+        messages_list, key = _summary_request(text)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        # The call holds its limiter slot until the stream has been read
+        stream = openai_limiter.stream(lambda: client.chat.completions.create(
+            model=MODEL,
+            messages=messages_list,
+            stream=True,
+            stream_options={"include_usage": True}
+        ), _estimate_tokens(messages_list), priority)
+        stripper = FenceStripper()
+        parts = []
+        with stage("openai.summary_stream"):
+            for event in stream:
+                # The final event carries the usage and no choices
+                record_usage("aiSummariser_stream", getattr(event, "usage", None))
+                if not event.choices:
+                    continue
+                fragment = stripper.feed(event.choices[0].delta.content or "")
+                if fragment:
+                    parts.append(fragment)
+                    yield fragment
+        fragment = stripper.finish()
+        if fragment:
+            parts.append(fragment)
+            yield fragment
+        llm_cache.set(key, "".join(parts).strip())
+
+
+async def aiSummariser_stream_async(text, aclient, priority=INTERACTIVE):
+        """
+        aiSummariser_stream for the ASGI app: an async generator over an
+        AsyncOpenAI stream.
+        """
+        messages_list, key = _summary_request(text)
+        cached = await llm_cache.get_async(key)
+        if cached is not None:
+            yield cached
+            return
+
+        stream = openai_limiter.stream_async(lambda: aclient.chat.completions.create(
+            model=MODEL,
+            messages=messages_list,
+            stream=True,
+            stream_options={"include_usage": True}
+        ), _estimate_tokens(messages_list), priority)
+        stripper = FenceStripper()
+        parts = []
+        with stage("openai.summary_stream"):
+            async for event in stream:
+                record_usage("aiSummariser_stream", getattr(event, "usage", None))
+                if not event.choices:
+                    continue
+                fragment = stripper.feed(event.choices[0].delta.content or "")
+                if fragment:
+                    parts.append(fragment)
+                    yield fragment
+        fragment = stripper.finish()
+        if fragment:
+            parts.append(fragment)
+            yield fragment
+        await llm_cache.set_async(key, "".join(parts).strip())
+
+
 # ------------------------------------
 # Notes/Summariations functions
 # ------------------------------------
 
-def save_note(db, user_id, original_text, summary_text, title):
-    note_id = str(uuid.uuid4())
-    notes_ref = db.collection("notes").document(note_id)
-    notes_ref.set({
+def _new_note_writes(db, user_id, note_id, title, original_text=None, summary_text=None, flashcards=None,
+                     file_url=None, upload_hash=None, blob_path=None, writes=None):
+    """
+    The note document fields of a new note, adding the writes for its
+    summary sections, flashcards and review records to `writes`. The raw
+    text goes to Storage straight away.
+    """
+    fields = {
         "user_id": user_id,
-        "original_text": original_text,
-        "summary_text": summary_text,
         "title": title,
-        "timestamp": firestore.SERVER_TIMESTAMP
-    })
+        "layout": LAYOUT_VERSION,
+        "timestamp": SERVER_TIMESTAMP
+    }
+    if file_url:
+        fields["file_url"] = file_url
+    if upload_hash:
+        fields["upload_hash"] = upload_hash
+    if blob_path:
+        fields["blob_path"] = blob_path
+    if original_text:
+        fields.update(write_text(db, note_id, original_text))
+    if summary_text:
+        fields.update(write_summary(db, note_id, summary_text, new=True, writes=writes))
+    if flashcards:
+        fields.update(write_flashcards(db, note_id, flashcards, new=True, writes=writes))
+        sync_note_cards(db, user_id, note_id, flashcards, new=True, writes=writes)
+    return fields
+
+
+def save_note(db, user_id, original_text, summary_text, title, file_url=None, upload_hash=None, blob_path=None,
+              flashcards=None):
+    """
+    Create a note. Only metadata goes in the note document; the text,
+    summary and flashcards are stored as described in note_storage.py.
+    upload_hash and blob_path reference the note's uploaded file (uploads.py).
+
+    Everything is committed in one batch with the note document last, so
+    the dashboard never lists a note whose parts are missing.
+    """
+    note_id = str(uuid.uuid4())
+    writes = []
+    fields = _new_note_writes(db, user_id, note_id, title, original_text, summary_text, flashcards,
+                              file_url, upload_hash, blob_path, writes)
+    # Title (and summary) searchable straight away (see search.py)
+    fields.update(index_note(db, note_id, fields, title=title, summary=summary_text, flashcards=flashcards))
+    writes.append(("set", "notes", note_id, fields))
+    db.write_batch(writes)
+    note_cache.invalidate(note_id)
     return note_id
 
-def get_notes(db, user_id):
+
+def save_notes(db, user_id, notes):
     """
-    Retrieve all notes for a specific user.
+    Create many notes of a user at once. notes is a list of dicts with
+    "title" and optionally "original_text", "summary_text", "flashcards",
+    "file_url", "upload_hash" and "blob_path". The search index is updated
+    once per segment and all writes go out in as few batches as possible,
+    every note document after all the notes' parts. Returns the new ids.
     """
-    notes_ref = db.collection("notes")
-    docs = notes_ref.where("user_id", "==", user_id).stream()
-    return [
-        {"note_id": doc.id, **doc.to_dict()}
-        for doc in docs
-    ]
+    writes, documents = [], []
+    for note in notes:
+        note_id = str(uuid.uuid4())
+        fields = _new_note_writes(
+            db, user_id, note_id, note.get("title") or "Untitled", note.get("original_text"),
+            note.get("summary_text"), note.get("flashcards"), note.get("file_url"),
+            note.get("upload_hash"), note.get("blob_path"), writes)
+        documents.append((note_id, fields))
+    indexed = index_notes(db, user_id, [
+        (note_id, fields["title"], note.get("summary_text"), note.get("flashcards"))
+        for (note_id, fields), note in zip(documents, notes)])
+    for note_id, fields in documents:
+        fields.update(indexed.get(note_id, {}))
+        writes.append(("set", "notes", note_id, fields))
+    db.write_batch(writes)
+    for note_id, _ in documents:
+        note_cache.invalidate(note_id)
+    return [note_id for note_id, _ in documents]
 
-def update_note(db, note_id, original_text=None, summary_text=None):
+def get_note(db, note_id, summary=False, text=False):
     """
-    Update a note's text and/or summary.
+    Fetch a note's metadata, plus its summary and/or raw text on request.
+    Returns None if the note does not exist.
     """
-    notes_ref = db.collection("notes").document(note_id)
-    updates = {}
-    if original_text:
-        updates["original_text"] = original_text
-    if summary_text:
-        updates["summary_text"] = summary_text
+    # Read through the note cache (cache.py); writers below invalidate it
+    note_data = note_cache.get_or_load("note", note_id, lambda: db.get("notes", note_id))
+    if note_data is None:
+        return None
+    if summary:
+        note_data["summary_text"] = note_cache.get_or_load(
+            "summary", note_id, lambda: read_summary(db, note_id, note_data))
+    if text:
+        note_data["original_text"] = read_text(db, note_data)
+    if is_legacy(note_data) and "file_url" not in note_data:
+        original = note_data.get("original_text") or ""
+        if original.startswith("http"):
+            note_data["file_url"] = original
+    # Don't hand legacy inline bodies to callers that did not ask for them
+    if is_legacy(note_data):
+        for field, wanted in (("summary_text", summary), ("original_text", text), ("flashcards", False)):
+            if not wanted:
+                note_data.pop(field, None)
+    note_data["note_id"] = note_id
+    return note_data
+
+# Fields the dashboard needs; everything else stays on the server
+LISTING_FIELDS = ["title", "timestamp"]
+NOTES_PAGE_SIZE = 20
+
+def encode_cursor(note):
+    """
+    Opaque pagination cursor for the position just after `note`.
+    """
+    payload = json.dumps({"t": note["timestamp"].isoformat(), "id": note["note_id"]})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor):
+    """
+    The [timestamp, note_id] position of a cursor; raises ValueError if
+    it is not one encode_cursor made.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return [datetime.fromisoformat(payload["t"]), str(payload["id"])]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid page cursor: {cursor!r}") from e
+
+def get_notes(db, user_id, page_size=None, cursor=None, fields=None):
+    """
+    Retrieve a user's notes, newest first.
+
+    Returns (notes, next_cursor). With page_size, at most that many notes
+    are read and next_cursor continues after the last one (None on the last
+    page); cursor is such a string or its decode_cursor position. fields
+    limits the document fields that are read.
+    On Firestore this needs a composite index on user_id + timestamp desc
+    + __name__ desc.
+    """
+    docs = db.query("notes", **_notes_query(user_id, page_size, cursor, fields))
+    return _notes_page(docs, page_size)
+
+async def get_notes_async(adb, user_id, page_size=None, cursor=None, fields=None):
+    """get_notes over an async repository (asgi.py)."""
+    docs = await adb.query("notes", **_notes_query(user_id, page_size, cursor, fields))
+    return _notes_page(docs, page_size)
+
+def _notes_query(user_id, page_size, cursor, fields):
+    return {
+        "where": [("user_id", "==", user_id)],
+        "order_by": [("timestamp", "desc"), (ID, "desc")],
+        "start_after": decode_cursor(cursor) if isinstance(cursor, str) else cursor,
+        # Read one extra note to learn whether there is another page
+        "limit": page_size + 1 if page_size else None,
+        "fields": fields,
+    }
+
+def _notes_page(docs, page_size):
+    notes = [{"note_id": doc_id, **data} for doc_id, data in docs]
+    next_cursor = None
+    if page_size and len(notes) > page_size:
+        notes = notes[:page_size]
+        next_cursor = encode_cursor(notes[-1])
+    return notes, next_cursor
+
+def iter_notes(db, user_id, fields=None, page_size=NOTES_PAGE_SIZE):
+    """
+    Yield every note of a user, reading one page at a time.
+    """
+    cursor = None
+    while True:
+        notes, cursor = get_notes(db, user_id, page_size, cursor, fields)
+        yield from notes
+        if not cursor:
+            return
+
+def update_note(db, note_id, original_text=None, summary_text=None, flashcards=None, chunks=None):
+    """
+    Update a note's text, summary, flashcards and/or chunk records
+    (incremental.py), committing the changed parts and the note document
+    in one batch.
+    """
+    note_data = None
+    if original_text is not None or summary_text is not None or flashcards is not None:
+        # Bring old inline notes over to the split layout before touching them
+        note_data = db.get("notes", note_id)
+        if note_data is not None:
+            migrate_note(db, note_id, note_data)
+    updates, writes = {}, []
+    if note_data is not None and (summary_text is not None or flashcards is not None):
+        updates.update(index_note(db, note_id, note_data, summary=summary_text, flashcards=flashcards))
+    if original_text is not None:
+        updates.update(write_text(db, note_id, original_text))
+    if summary_text is not None:
+        updates.update(write_summary(db, note_id, summary_text, writes=writes))
+    if flashcards is not None:
+        updates.update(write_flashcards(db, note_id, flashcards, writes=writes))
+        if note_data is not None:
+            sync_note_cards(db, note_data["user_id"], note_id, flashcards, writes=writes)
+    if chunks is not None:
+        updates.update(write_chunks(db, note_id, chunks, writes=writes))
     if updates:
-        notes_ref.update(updates)
+        writes.append(("update", "notes", note_id, updates))
+        db.write_batch(writes)
+        note_cache.invalidate(note_id)
         return True
     return False
 
@@ -127,13 +495,28 @@ def delete_note(db, note_id):
     """
     Delete a specific note by note_id.
     """
-    notes_ref = db.collection("notes").document(note_id)
-    notes_ref.delete()
+    note_data = db.get("notes", note_id)
+    if note_data is not None:
+        delete_body(db, note_id, note_data)
+        unindex_note(db, note_id, note_data)
+        remove_note_cards(db, note_data["user_id"], note_id)
+    db.delete("notes", note_id)
+    note_cache.invalidate(note_id)
+    if note_data is not None and note_data.get("upload_hash"):
+        # The uploaded file goes once no other note uses it
+        release_upload(db, note_data["upload_hash"])
 
 # --------------------------------
 #flashcard functions
 # --------------------------------
-def generate_flashcards(db, user_id, note_id, summary_text, client):
+FLASHCARD_OUTPUTS = REGISTRY.counter(
+    "studypal_flashcard_outputs_total",
+    "Flashcard responses by how they were made usable: valid, repaired, rerequested or failed.",
+    ("result",))
+
+
+def _flashcard_request(summary_text):
+    """Build the flashcard messages and their LLM cache key."""
     # 1. Define the detailed prompt structure
     prompt = (
         f"Generate 5 high-quality, concise flashcards from the following summarized study text.\n\n"
@@ -143,34 +526,204 @@ def generate_flashcards(db, user_id, note_id, summary_text, client):
         "b) At least one **example/function** card (e.g., 'Give an example of Y.').\n"
         "c) At least one card focusing on a **scheduling algorithm** or **OS type**.\n\n"
         f"Text to analyze:\n---\n{summary_text}\n---\n\n"
-        "Return the result STRICTLY as a valid JSON array of objects. Do not include any introductory or concluding text. "
-        "The objects must have only two keys: 'question' (the question) and 'answer' (the direct answer)."
+        "Return the result STRICTLY as a JSON object with a 'flashcards' array. Do not include any introductory or concluding text. "
+        "The array's objects must have only two keys: 'question' (the question) and 'answer' (the direct answer)."
     )
+    messages = [
+        # System content is optimized to enforce the JSON output
+        {"role": "system", "content": FLASHCARD_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    return messages, cache_key("generate_flashcards", MODEL, FLASHCARD_SYSTEM_PROMPT, prompt)
+
+
+def _flashcard_retry(messages, output):
+    """The messages of the one re-request, pointing at the bad output."""
+    return messages + [
+        {"role": "assistant", "content": output},
+        {"role": "user", "content": "That reply was not valid JSON in the required format. "
+                                    "Reply again with only the JSON object and its 'flashcards' array."},
+    ]
+
+
+def _checked_cards(output, rerequested):
+    """
+    Parse a flashcard response into cached JSON, counting how it was made
+    usable. None if the first response needs a re-request; raises
+    ValueError if the re-request did not help either.
+    """
+    cards, repaired = parse_flashcards(output)
+    if not cards:
+        if not rerequested:
+            return None
+        FLASHCARD_OUTPUTS.inc(result="failed")
+        raise ValueError("Model returned no usable flashcards")
+    FLASHCARD_OUTPUTS.inc(result="rerequested" if rerequested else "repaired" if repaired else "valid")
+    return json.dumps(cards)
+
+
+def generate_flashcards(db, user_id, note_id, summary_text, client, priority=INTERACTIVE):
+    """
+    Generate flashcards for a (chunk) summary. Returns a list of
+    {"question", "answer"} dicts; raises ValueError if the model's output
+    cannot be made into at least one card.
+    """
+    messages, key = _flashcard_request(summary_text)
+
+    # 2. Make the API call (or reuse the cached result for identical text)
+    def request(messages):
+        with stage("openai.flashcards"):
+            response = openai_limiter.call(lambda: client.chat.completions.create(
+                # Swapping to gpt-4o-mini is good for cost/speed, but sometimes gpt-4
+                # is better at strictly following complex JSON output rules.
+                model=MODEL,
+                messages=messages,
+                response_format={"type": "json_schema", "json_schema": FLASHCARD_SCHEMA},
+            ), _estimate_tokens(messages), priority)
+        record_usage("generate_flashcards", getattr(response, "usage", None))
+        return (response.choices[0].message.content or "").strip()
+
+    def generate():
+        output = request(messages)
+        cards = _checked_cards(output, rerequested=False)
+        if cards is None:
+            # 3. Local repair failed: ask once more, pointing at the bad output
+            cards = _checked_cards(request(_flashcard_retry(messages, output)), rerequested=True)
+        return cards
+
+    # Only validated cards are cached; failures raise and are retried next time
+    cards, _ = parse_flashcards(llm_cache.get_or_compute(key, generate))
+    return cards
 
-    # 2. Make the API call
-    response = client.chat.completions.create(
-        # Swapping to gpt-4o-mini is good for cost/speed, but sometimes gpt-4
-        # is better at strictly following complex JSON output rules.
-        model="gpt-4o-mini",
-        messages=[
-            # System content is optimized to enforce the JSON output
-            {"role": "system", "content": "You are a helpful study assistant. Your ONLY output must be a valid, parsable JSON array of flashcard objects, each with 'question' and 'answer' keys. Do not output any markdown code fences (```json) or text."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    return response.choices[0].message.content.strip()
+
+async def generate_flashcards_async(db, user_id, note_id, summary_text, aclient, priority=INTERACTIVE):
+    """
+    generate_flashcards for the ASGI app, over an AsyncOpenAI client.
+    """
+    messages, key = _flashcard_request(summary_text)
+
+    async def request(messages):
+        with stage("openai.flashcards"):
+            response = await openai_limiter.call_async(lambda: aclient.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                response_format={"type": "json_schema", "json_schema": FLASHCARD_SCHEMA},
+            ), _estimate_tokens(messages), priority)
+        record_usage("generate_flashcards", getattr(response, "usage", None))
+        return (response.choices[0].message.content or "").strip()
+
+    async def generate():
+        output = await request(messages)
+        cards = _checked_cards(output, rerequested=False)
+        if cards is None:
+            cards = _checked_cards(await request(_flashcard_retry(messages, output)), rerequested=True)
+        return cards
+
+    cards, _ = parse_flashcards(await llm_cache.get_or_compute_async(key, generate))
+    return cards
+
+
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+
+
+def _close_truncated(text):
+    """
+    Cut a truncated JSON array (or {"flashcards": [...]} object) back to
+    its last complete element and close it again. None if there is none.
+    """
+    start = text.find("[")
+    if start < 0:
+        return None
+    depth, in_string, escaped, last_end = 0, False, False, None
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+            if depth == 1:
+                last_end = i  # an element of the array just closed
+            elif depth == 0:
+                return text[start:i + 1]
+    if last_end is None:
+        return None
+    return text[start:last_end + 1] + "]"
+
+
+def parse_flashcards(output):
+    """
+    Parse model output into a list of valid cards. Returns (cards,
+    repaired), repaired being True when the raw output was not valid JSON
+    and had to be fixed up locally. Cards without a non-empty question and
+    answer are dropped.
+    """
+    text = _FENCE_RE.sub("", (output or "").strip())
+    repaired = text != (output or "").strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        closed = _close_truncated(text)
+        if closed is None:
+            return [], True
+        try:
+            data = json.loads(closed)
+        except json.JSONDecodeError:
+            return [], True
+        repaired = True
+    if isinstance(data, dict):
+        data = data.get("flashcards", [])
+    if not isinstance(data, list):
+        return [], repaired
+
+    cards = []
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        question, answer = item.get("question"), item.get("answer")
+        if isinstance(question, str) and isinstance(answer, str) and question.strip() and answer.strip():
+            cards.append({"question": question.strip(), "answer": answer.strip()})
+    return cards, repaired
 
 
 def get_flashcards(db, user_id, note_id):
-    """Fetches the flashcards list directly from the note document."""
-    
-    note_doc = db.collection("notes").document(note_id).get()
+    """Fetches the flashcards list from the note's flashcards subcollection."""
+
+    return note_cache.get_or_load("flashcards", note_id, lambda: _load_flashcards(db, note_id))
+
+
+async def get_flashcards_async(adb, user_id, note_id):
+    """get_flashcards over an async repository (asgi.py)."""
+    return await note_cache.get_or_load_async("flashcards", note_id, lambda: _load_flashcards_async(adb, note_id))
+
+
+def _load_flashcards(db, note_id):
+    cards = read_flashcards(db, note_id)
+    if cards:
+        return cards
+
+    # Notes stored before the subcollection layout keep them inline
+    note_data = db.get("notes", note_id, fields=["flashcards"])
     
-    if note_doc.exists:
-        note_data = note_doc.to_dict()
+    if note_data is not None:
         # Retrieve the 'flashcards' field, default to an empty list if not found
         cards = note_data.get("flashcards", [])
         return cards
     
     return []
 
+
+async def _load_flashcards_async(adb, note_id):
+    cards = await read_flashcards_async(adb, note_id)
+    if cards:
+        return cards
+    note_data = await adb.get("notes", note_id, fields=["flashcards"])
+    return note_data.get("flashcards", []) if note_data is not None else []
@@ -0,0 +1,101 @@
+import hashlib
+import os
+from .functions import aiSummariser, generate_flashcards, update_note
+from .chunking import iter_chunks
+from .pipeline import process_chunks, reduce_summaries
+from .note_storage import read_text, read_chunks
+from .metrics import stage
+from .similarity import dedupe_flashcards
+from .ratelimit import INTERACTIVE
+
+# -------------------------
+# Incremental re-summarisation
+# -------------------------
+# Editing a written note only re-runs the model on the chunks whose text
+# changed. Each chunk's summary and flashcards are kept as a chunk record
+# (note_storage.py). On save, the stored chunks that still appear verbatim
+# and in order in the new text are reused; only the text between them is
+# re-chunked and sent to aiSummariser/generate_flashcards. Chunks do not
+# overlap, so an edit inside one chunk leaves its neighbours untouched.
+EDIT_CHUNK_TOKENS = int(os.getenv("EDIT_CHUNK_TOKENS", "2000"))
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _new_chunks(text, offset, max_tokens):
+    for chunk in iter_chunks([text], max_tokens, overlap_tokens=0):
+        if chunk["text"].strip():
+            yield {"text": chunk["text"], "start": offset + chunk["start"], "end": offset + chunk["end"]}
+
+
+def diff_chunks(old_text, old_chunks, new_text, max_tokens=None):
+    """
+    Split new_text into chunks, reusing stored chunk records where possible.
+
+    Returns a list of (chunk, record) pairs in document order, where chunk
+    is {"text", "start", "end"} and record is the old chunk record it
+    matches, or None for new text that has to be processed.
+    """
+    max_tokens = max_tokens or EDIT_CHUNK_TOKENS
+    plan, position = [], 0
+    for record in old_chunks:
+        piece = (old_text or "")[record["start"]:record["end"]]
+        # Records of failed chunks, or of a text that has been replaced
+        # since, are not reused
+        if not piece or record.get("hash") != text_hash(piece):
+            continue
+        found = new_text.find(piece, position)
+        if found < 0:
+            continue
+        plan += [(chunk, None) for chunk in _new_chunks(new_text[position:found], position, max_tokens)]
+        plan.append(({"text": piece, "start": found, "end": found + len(piece)}, record))
+        position = found + len(piece)
+    plan += [(chunk, None) for chunk in _new_chunks(new_text[position:], position, max_tokens)]
+    return plan
+
+
+def resummarise_note(db, client, user_id, note_id, text, priority=INTERACTIVE):
+    """
+    Replace a note's text and bring its summary and flashcards up to date,
+    calling the model only for changed chunks. Returns the number of
+    chunks and of re-processed chunks.
+    """
+    note_data = db.get("notes", note_id) or {}
+    old_text = read_text(db, note_data) if note_data else None
+    plan = diff_chunks(old_text, read_chunks(db, note_id), text)
+    changed = [chunk for chunk, record in plan if record is None]
+
+    with stage("edit.summarise"):
+        results = iter(process_chunks(
+            changed,
+            lambda chunk: aiSummariser(chunk["text"], client, priority=priority),
+            lambda chunk_summary: generate_flashcards(
+                db, user_id, note_id, chunk_summary, client, priority=priority),
+        ))
+
+    records = []
+    for chunk, record in plan:
+        if record is None:
+            result = next(results)
+            record = {
+                # A failed chunk gets no hash so the next save retries it
+                "hash": None if result["error"] else text_hash(chunk["text"]),
+                "summary": result["summary"],
+                "flashcards": result["flashcards"],
+            }
+        records.append(dict(record, start=chunk["start"], end=chunk["end"]))
+
+    with stage("edit.reduce"):
+        summary = reduce_summaries(
+            [r["summary"] for r in records],
+            lambda merged: aiSummariser(merged, client, priority=priority),
+        )
+    flashcards = dedupe_flashcards([card for r in records for card in r["flashcards"]])
+
+    with stage("edit.save"):
+        # Note, summary, flashcards and chunk records in one batch
+        update_note(db, note_id, original_text=text, summary_text=summary, flashcards=flashcards,
+                    chunks=records)
+    return {"chunks": len(records), "changed": len(changed)}
@@ -0,0 +1,337 @@
+import io
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from .functions import aiSummariser, generate_flashcards, update_note
+from .extraction import iter_pages
+from .chunking import iter_chunks
+from .pipeline import process_chunks, reduce_summaries
+from .repository import SERVER_TIMESTAMP
+from .metrics import stage
+from .ratelimit import BACKGROUND
+from .uploads import load_pages, save_pages
+from .similarity import dedupe_flashcards
+
+logger = logging.getLogger("studypal.jobs")
+
+# -------------------------
+# Job records
+# -------------------------
+# One job document per uploaded note, stored in the "jobs" collection under
+# the same id as the note so the status of a note is a single lookup.
+#
+# A running job holds a lease: every update_job refreshes its updatedAt,
+# and a job that has not been updated for JOB_LEASE_SECONDS is taken to
+# belong to a worker that died. Such a job can be claimed again (by
+# resume_pending_jobs) or retried like a failed one.
+#
+# Each claim stores a new lease token, and the worker passes it to every
+# update_job, which fails with LeaseLost once the job was claimed again
+# or requeued. A worker that stalled past its lease therefore stops at its
+# next update instead of overwriting the new worker's results.
+JOBS_COLLECTION = "jobs"
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def create_job(db, note_id, user_id, blob_path, extension, upload_hash=None):
+    """
+    Record a queued processing job for an uploaded document. upload_hash
+    names the deduplicated file (uploads.py) whose extracted pages the job
+    reuses or saves.
+    """
+    db.set(JOBS_COLLECTION, note_id, {
+        "note_id": note_id,
+        "user_id": user_id,
+        "blob_path": blob_path,
+        "extension": extension,
+        "upload_hash": upload_hash,
+        "status": QUEUED,
+        "stage": QUEUED,
+        "progress": 0,
+        "total": 0,
+        "error": None,
+        "createdAt": SERVER_TIMESTAMP,
+        "updatedAt": SERVER_TIMESTAMP,
+    })
+
+
+def get_job(db, note_id):
+    """
+    Fetch the job record for a note, or None if there is none.
+    """
+    return db.get(JOBS_COLLECTION, note_id)
+
+
+class LeaseLost(Exception):
+    """The job was claimed by another worker (or requeued) since this one claimed it."""
+
+
+def update_job(db, note_id, lease=None, **fields):
+    """
+    Update a job and refresh its lease. With the `lease` token of a claim,
+    the update is made only while that claim still holds the job, and
+    LeaseLost is raised otherwise.
+    """
+    fields["updatedAt"] = SERVER_TIMESTAMP
+    if lease is None:
+        db.update(JOBS_COLLECTION, note_id, fields)
+        return
+
+    def _update(job):
+        if not job or job.get("lease") != lease:
+            return None
+        return fields
+
+    if db.transact_update(JOBS_COLLECTION, note_id, _update) is None:
+        raise LeaseLost(note_id)
+
+
+def lease_expired(job):
+    """
+    Whether a running job's worker has stopped updating it for longer
+    than JOB_LEASE_SECONDS.
+    """
+    if job.get("status") != RUNNING:
+        return False
+    updated = job.get("updatedAt")
+    if not isinstance(updated, datetime):
+        return True
+    return datetime.now(timezone.utc) - updated > timedelta(seconds=JOB_LEASE_SECONDS)
+
+
+def claim_job(db, note_id):
+    """
+    Atomically move a queued job, or a running one whose lease expired, to
+    running. Returns the lease token of the claim, or None if another
+    worker holds it (or it does not exist).
+    """
+    lease = uuid.uuid4().hex
+
+    def _claim(job):
+        if not job or not (job.get("status") == QUEUED or lease_expired(job)):
+            return None
+        return {
+            "status": RUNNING,
+            "stage": RUNNING,
+            "lease": lease,
+            "claimed_at": SERVER_TIMESTAMP,
+            "updatedAt": SERVER_TIMESTAMP,
+        }
+
+    return lease if db.transact_update(JOBS_COLLECTION, note_id, _claim) is not None else None
+
+
+def requeue_job(db, note_id):
+    """
+    Put a failed job, or a running one whose lease expired, back on the
+    queue. Completed summary levels are kept, so the re-run resumes where
+    the previous attempt stopped.
+    """
+    def _requeue(job):
+        if not job or not (job.get("status") == FAILED or lease_expired(job)):
+            return None
+        return {
+            "status": QUEUED,
+            "stage": QUEUED,
+            "progress": 0,
+            "error": None,
+            "lease": None,
+            "updatedAt": SERVER_TIMESTAMP,
+        }
+
+    return db.transact_update(JOBS_COLLECTION, note_id, _requeue) is not None
+
+
+# -------------------------
+# Intermediate summary levels
+# -------------------------
+# Each map-reduce level is stored as its own document, "<note_id>_<level>",
+# tagged with a key of the inputs it was built from.
+SUMMARY_LEVELS_COLLECTION = "summary_levels"
+
+
+def load_summary_level(db, note_id, level, key):
+    data = db.get(SUMMARY_LEVELS_COLLECTION, f"{note_id}_{level}")
+    if data is None or data.get("key") != key:
+        return None
+    return data["summaries"]
+
+
+def save_summary_level(db, note_id, level, key, summaries):
+    db.set(SUMMARY_LEVELS_COLLECTION, f"{note_id}_{level}", {
+        "note_id": note_id,
+        "level": level,
+        "key": key,
+        "summaries": summaries,
+    })
+
+
+def delete_summary_levels(db, note_id):
+    levels = db.query(SUMMARY_LEVELS_COLLECTION, where=[("note_id", "==", note_id)], fields=[])
+    db.write_batch([("delete", SUMMARY_LEVELS_COLLECTION, doc_id, None) for doc_id, _ in levels])
+
+
+# -------------------------
+# Upload pipeline
+# -------------------------
+def note_exists(db, note_id):
+    return db.get("notes", note_id, fields=["user_id"]) is not None
+
+
+def run_upload_job(db, client, note_id, data=None):
+    """
+    Extract, summarise and generate flashcards for an uploaded document.
+
+    `data` is the raw file content when the job runs in the process that
+    received the upload; other workers download it from Storage instead.
+    """
+    lease = claim_job(db, note_id)
+    if lease is None:
+        return False
+    if not note_exists(db, note_id):
+        # Deleted while queued: nothing to fill in
+        db.delete(JOBS_COLLECTION, note_id)
+        return False
+
+    job = get_job(db, note_id)
+    upload_hash = job.get("upload_hash")
+    try:
+        # The same file was processed before: reuse its page texts
+        stored_pages = load_pages(db, upload_hash) if upload_hash else None
+        if data is None and stored_pages is None:
+            with stage("job.download"):
+                data = db.get_blob(job["blob_path"])
+
+        update_job(db, note_id, lease, stage="extracting")
+        text = io.StringIO()
+        extracted = []
+
+        def pages():
+            for page in stored_pages or iter_pages(data, job["extension"]):
+                text.write(page)
+                extracted.append(page)
+                yield page
+
+        with stage("job.extract"):
+            chunks = list(iter_chunks(pages()))
+        if upload_hash and stored_pages is None:
+            save_pages(db, upload_hash, extracted)
+
+        update_job(db, note_id, lease, stage="summarising", total=len(chunks))
+        with stage("job.summarise"):
+            results = process_chunks(
+                chunks,
+                lambda chunk: aiSummariser(chunk["text"], client, priority=BACKGROUND),
+                lambda chunk_summary: generate_flashcards(
+                    db, job["user_id"], note_id, chunk_summary, client, priority=BACKGROUND),
+                on_chunk_done=lambda done: update_job(db, note_id, lease, progress=done),
+            )
+
+        def save_level(level, key, summaries):
+            update_job(db, note_id, lease)  # keeps the lease
+            save_summary_level(db, note_id, level, key, summaries)
+
+        update_job(db, note_id, lease, stage="reducing")
+        with stage("job.reduce"):
+            summary = reduce_summaries(
+                [r["summary"] for r in results],
+                lambda text: aiSummariser(text, client, priority=BACKGROUND),
+                load_level=lambda level, key: load_summary_level(db, note_id, level, key),
+                save_level=save_level,
+            )
+        # Overlapping chunks tend to produce the same card twice
+        flashcards = dedupe_flashcards([card for r in results for card in r["flashcards"]])
+        failed_chunks = [
+            {"index": chunk["index"], "pages": chunk["pages"], "error": r["error"]}
+            for chunk, r in zip(chunks, results) if r["error"]
+        ]
+
+        # Renewing the lease right before writing the note leaves no other
+        # worker able to claim the job for JOB_LEASE_SECONDS
+        update_job(db, note_id, lease, stage="saving")
+        if not note_exists(db, note_id):
+            db.delete(JOBS_COLLECTION, note_id)
+            delete_summary_levels(db, note_id)
+            return False
+        with stage("job.save"):
+            update_note(db, note_id, original_text=text.getvalue(),
+                        summary_text=summary, flashcards=flashcards)
+        update_job(db, note_id, lease, status=DONE, stage=DONE, failed_chunks=failed_chunks)
+        delete_summary_levels(db, note_id)
+    except LeaseLost:
+        logger.warning("Upload job %s was claimed by another worker; stopping", note_id)
+        return False
+    except Exception as e:
+        # Jobs run in the web process have nobody waiting on their future
+        logger.exception("Upload job %s failed", note_id)
+        try:
+            update_job(db, note_id, lease, status=FAILED, stage=FAILED, error=str(e))
+        except LeaseLost:
+            pass
+        raise
+    return True
+
+
+# -------------------------
+# Worker pool
+# -------------------------
+_executor = None
+
+
+def get_executor():
+    """
+    Process-wide pool of job worker threads, sized by JOB_WORKERS.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("JOB_WORKERS", "4")),
+            thread_name_prefix="studypal-job",
+        )
+    return _executor
+
+
+def enqueue_upload(db, client, note_id, user_id, blob_path, extension, data=None, upload_hash=None):
+    """
+    Record a job for the note and hand it to the worker pool.
+    """
+    create_job(db, note_id, user_id, blob_path, extension, upload_hash)
+    return get_executor().submit(run_upload_job, db, client, note_id, data)
+
+
+def resume_pending_jobs(db, client):
+    """
+    Submit every queued job in the repository, and every running job whose
+    lease expired, to this process's worker pool. Jobs claimed by another
+    worker in the meantime are skipped.
+    """
+    pending = [note_id for note_id, _ in db.query(JOBS_COLLECTION, where=[("status", "==", QUEUED)], fields=[])]
+    running = db.query(JOBS_COLLECTION, where=[("status", "==", RUNNING)], fields=["status", "updatedAt"])
+    pending += [note_id for note_id, job in running if lease_expired(job)]
+    return [
+        get_executor().submit(run_upload_job, db, client, note_id)
+        for note_id in pending
+    ]
+
+
+def run_worker(db, client, poll_interval=5):
+    """
+    Standalone worker loop: keep picking up queued jobs from the repository.
+    """
+    while True:
+        for future in resume_pending_jobs(db, client):
+            future.exception()  # wait; run_upload_job logs its own failures
+        time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    from .main import db, client
+    run_worker(db, client)
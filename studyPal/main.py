@@ -1,76 +1,137 @@
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, Request, render_template, request, redirect, url_for, session, jsonify, Response, stream_with_context
+import logging
 import os
-import random
-import firebase_admin
-import json
-from firebase_admin import credentials, firestore, storage
-from openai import OpenAI
+import zipfile
 from .functions import (
     create_user,
     login_user,
     aiSummariser,
+    aiSummariser_stream,
     save_note,
     generate_flashcards,
     get_flashcards,
+    get_notes,
+    get_note,
+    decode_cursor,
+    LISTING_FIELDS,
+    NOTES_PAGE_SIZE,
 )
+from .incremental import resummarise_note
+from .search import index_note, search_notes
+from .similarity import related_notes
+from .review import due_cards, record_review, GRADES, REVIEW_BATCH_CARDS, REVIEW_MAX_BATCH_CARDS
+from .archive import iter_export, import_archive, ARCHIVE_FORMATS
+from .uploads import StreamingUpload, new_blob_path, acquire_upload, SIGNED_URL_SECONDS
+from .jobs import enqueue_upload, get_job, requeue_job, run_upload_job, get_executor
+from .cache import llm_cache, note_cache, SharedCache, NOTE_CACHE_TTL
+from .ratelimit import openai_limiter
+from .chunking import iter_chunks
+from .extraction import supported_extensions
+from .metrics import init_app as init_metrics
+from .services import LazyService, make_repository, make_openai_client
 from dotenv import load_dotenv 
-from pypdf import PdfReader
-from docx import Document
 from werkzeug.exceptions import RequestEntityTooLarge
-from werkzeug.utils import secure_filename
+
+logger = logging.getLogger("studypal.main")
 
 
 load_dotenv()
+logging.basicConfig(format="%(message)s")
+logging.getLogger("studypal").setLevel(os.getenv("LOG_LEVEL", "INFO"))
 
 # -------------------------
-# Initialize Firebase
+# Services
 # -------------------------
-json_str = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
-
-if json_str:
-    # Load from GitHub Secret / env var
-    service_account_info = json.loads(json_str)
-    cred = credentials.Certificate(service_account_info)
-elif os.path.exists("adminKey.json"):
-    # Local fallback (optional)
-    cred = credentials.Certificate("adminKey.json")
-else:
-    raise RuntimeError(
-        "Service account credentials not set. "
-        "Set GOOGLE_APPLICATION_CREDENTIALS_JSON or provide adminKey.json."
-    )
-
-firebase_admin.initialize_app(cred)
-db = firestore.client()
-bucket = storage.bucket('studypal-93412.firebasestorage.app')  # <-- Specify bucket name explicitly
+# Firebase and OpenAI are only set up when a request first needs them
+# (see services.py)
+db = LazyService(make_repository)
+client = LazyService(make_openai_client)
 
 # -------------------------
-# Initialize OpenAI
+# App factory
 # -------------------------
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "100"))
+_routes = []
+
+
+def route(rule, **options):
+    """Like app.route, for the app(s) built by create_app."""
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
+
+
+def create_app():
+    app = Flask(__name__)
+    app.secret_key = "supper_secret_key"
+    # Uploads are streamed to Storage, so this no longer bounds memory use
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+    app.request_class = UploadRequest
+
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    app.register_error_handler(RequestEntityTooLarge, handle_file_too_large)
+
+    # Request timings, /metrics and the per-request log line (see metrics.py)
+    init_metrics(app)
+
+    # Share cached summaries/flashcards between all worker processes
+    if os.getenv("LLM_CACHE_SHARED", "1") == "1":
+        llm_cache.shared = SharedCache(db)
+    # Note reads shared between workers (see the note cache in cache.py)
+    if os.getenv("NOTE_CACHE_SHARED", "0") == "1":
+        note_cache.shared = SharedCache(db, collection="note_cache", ttl=NOTE_CACHE_TTL)
+    # Let a 429 seen by one worker process pause all of them
+    if os.getenv("OPENAI_RATE_SHARED", "0") == "1":
+        openai_limiter.shared = db
+    return app
+
+
+class UploadRequest(Request):
+    """
+    Hands documents posted to upload_doc to a StreamingUpload instead of a
+    temporary file, so they go to Storage while the body is still arriving.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        extension = filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else None
+        if self.endpoint == "upload_doc" and session.get("user_id") and extension in supported_extensions():
+            return StreamingUpload(db, new_blob_path(extension), content_type)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
 
-# -------------------------
-# Initialize Flask
-# -------------------------
-app = Flask(__name__)
-app.secret_key = "supper_secret_key"
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB max upload size
 
 # -------------------------
 # Routes
 # -------------------------
-@app.route("/")
+@route("/")
 def home():
     user_id = session.get("user_id")
     if not user_id:
         return redirect(url_for("login"))
 
-    notes_ref = db.collection("notes").where("user_id", "==", user_id)
-    notes = [dict(doc.to_dict(), note_id=doc.id) for doc in notes_ref.stream()]
-    return render_template("home.html", notes=notes)
+    cursor = request.args.get("cursor")
+    try:
+        start_after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return "Invalid page cursor", 400
+    notes, next_cursor = get_notes(db, user_id, NOTES_PAGE_SIZE, start_after, LISTING_FIELDS)
+    return render_template("home.html", notes=notes, next_cursor=next_cursor)
+
+
+@route("/search")
+def search():
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    # Ranked from the user's search index alone (see search.py)
+    query = request.args.get("q", "").strip()
+    notes = search_notes(db, user_id, query) if query else []
+    return render_template("home.html", notes=notes, next_cursor=None, query=query)
 
 
-@app.route("/signup", methods=["GET", "POST"])
+@route("/signup", methods=["GET", "POST"])
 def signup():
     if request.method == "POST":
         name = request.form["name"]
@@ -83,7 +144,7 @@ def signup():
     return render_template("signup.html")
 
 
-@app.route("/login", methods=["GET", "POST"])
+@route("/login", methods=["GET", "POST"])
 def login():
     if "user_id" in session:
         return redirect(url_for("home"))
@@ -101,13 +162,13 @@ def login():
     return render_template("login.html")
 
 
-@app.route("/logout")
+@route("/logout")
 def logout():
     session.pop('user_id', None)
     return redirect(url_for('login'))
 
 
-@app.route("/flashcards/<note_id>")
+@route("/flashcards/<note_id>")
 def flashcards(note_id):
     user_id = session.get("user_id")
     if not user_id:
@@ -117,54 +178,178 @@ def flashcards(note_id):
     return render_template("flashcards.html", flashcards=cards, note_id=note_id)
 
 
-@app.route("/Note/<note_id>")
+# -------------------------
+# Spaced Repetition Routes
+# -------------------------
+@route("/study")
+def study():
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    # The page loads the due cards itself, a batch at a time (see review.py)
+    return render_template("review.html", note_id=request.args.get("note_id"), grades=list(GRADES))
+
+
+@route("/review/due")
+def reviewDue():
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    after = None
+    if "after_due" in request.args or "after_id" in request.args:
+        after_due = request.args.get("after_due", type=float)
+        if after_due is None or not request.args.get("after_id"):
+            return jsonify({"error": "after_due and after_id must be given together."}), 400
+        after = [after_due, request.args["after_id"]]
+    limit = request.args.get("limit", REVIEW_BATCH_CARDS, type=int)
+    limit = min(max(limit, 1), REVIEW_MAX_BATCH_CARDS)
+    cards, cursor = due_cards(db, user_id, limit=limit, after=after, note_id=request.args.get("note_id"))
+    return jsonify({"cards": cards, "cursor": cursor})
+
+
+@route("/review/<card_id>", methods=["POST"])
+def reviewCard(card_id):
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    grade = (request.get_json(silent=True) or {}).get("grade") or request.form.get("grade")
+    if grade not in GRADES:
+        return jsonify({"error": f"grade must be one of {', '.join(GRADES)}."}), 400
+    state = record_review(db, user_id, card_id, grade)
+    if state is None:
+        return jsonify({"error": "No such card."}), 404
+    return jsonify({"card_id": card_id, "due": state["due"], "interval": state["interval"]})
+
+
+@route("/Note/<note_id>")
 def viewNote(note_id):
     user_id = session.get("user_id")
     if not user_id:
         return redirect(url_for("login"))
 
-    note_doc = db.collection("notes").document(note_id).get()
-    if note_doc.exists:
-        note_data = note_doc.to_dict()
-        note_data['note_id'] = note_id  # <-- Add note_id for template links
-    else:
-        note_data = None
+    # Metadata plus summary sections; the raw text and flashcards are not read
+    note_data = get_note(db, note_id, summary=True)
+
+    related = []
+    if note_data and note_data.get("user_id") == user_id:
+        try:
+            related = related_notes(db, user_id, [note_id])[note_id]
+        except Exception as e:
+            logger.warning("Related notes unavailable: %s", e)
 
-    return render_template("note.html", note=note_data)
+    return render_template("note.html", note=note_data, related=related)
 
 
-@app.route("/edit_note", methods=["GET", "POST"])
+@route("/Note/<note_id>/related")
+def relatedNotes(note_id):
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    note_data = get_note(db, note_id)
+    if not note_data or note_data.get("user_id") != user_id:
+        return jsonify({"error": "Note not found."}), 404
+
+    limit = request.args.get("limit", type=int)
+    return jsonify({"note_id": note_id, "related": related_notes(db, user_id, [note_id], limit)[note_id]})
+
+
+@route("/edit_note", methods=["GET", "POST"])
 def edit_note():
     user_id = session.get("user_id")
     if not user_id:
         return redirect(url_for("login"))
 
+    # Editing an existing note (?note_id=... or the form's hidden field)
+    note_id = request.values.get("note_id") or None
+    if note_id:
+        note_data = get_note(db, note_id, text=True)
+        if not note_data or note_data.get("user_id") != user_id:
+            return "Note not found", 404
+
     if request.method == "POST":
         title = request.form.get("title", "Untitled")
         text = request.form["notes"]
         action = request.form.get("action")
 
+        if action == "save" and note_id:
+            # Only the changed chunks are summarised again (see incremental.py)
+            if title != note_data.get("title"):
+                # Index against the stored document, not a possibly cached copy
+                current = db.get("notes", note_id)
+                db.update("notes", note_id, dict(index_note(db, note_id, current, title=title), title=title))
+                note_cache.invalidate(note_id)
+            resummarise_note(db, client, user_id, note_id, text)
+            return redirect(url_for("viewNote", note_id=note_id))
+
         if action == "save":
-            note_id = save_note(db, user_id, text, None, title)
-            generate_flashcards(db, user_id, note_id, text, client)
+            try:
+                cards = generate_flashcards(db, user_id, None, text, client)
+            except Exception as e:
+                # The note is saved either way; its cards can be made on the next edit
+                logger.warning("Flashcards not generated for note %r: %s", title, e)
+                cards = []
+            # Note, text and cards are committed together
+            save_note(db, user_id, text, None, title, flashcards=cards)
             return redirect(url_for("home"))
 
         if action == "summarise":
-            summary = aiSummariser(text, client)
-            return render_template("write.html", summary=summary, user_id=user_id, title=title, content=text)
-
+            # Long notes are summarised chunk by chunk to stay within the
+            # model's context window
+            summary = "\n".join(aiSummariser(chunk["text"], client) for chunk in iter_chunks([text]))
+            return render_template("write.html", summary=summary, user_id=user_id, title=title, content=text,
+                                   note_id=note_id)
+
+    if note_id:
+        return render_template("write.html", user_id=user_id, title=note_data.get("title"),
+                               content=note_data.get("original_text") or "", note_id=note_id)
     return render_template("write.html", user_id=user_id)
 
 
-@app.errorhandler(RequestEntityTooLarge)
+# -------------------------
+# Streaming Summary Route (server-sent events)
+# -------------------------
+def sse_event(data, event=None):
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return "\n".join(lines) + "\n\n"
+
+
+@route("/edit_note/stream", methods=["POST"])
+def edit_note_stream():
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    text = request.form.get("notes", "")
+
+    def generate():
+        try:
+            for i, chunk in enumerate(iter_chunks([text])):
+                if i:
+                    yield sse_event("\n")
+                for fragment in aiSummariser_stream(chunk["text"], client):
+                    yield sse_event(fragment)
+            yield sse_event("", event="done")
+        except Exception as e:
+            logger.exception("Streaming summary failed: %s", e)
+            yield sse_event("Summary failed, please try again.", event="error")
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 def handle_file_too_large(e):
-    return "File too large. Maximum allowed size is 10 MB.", 413
+    return f"File too large. Maximum allowed size is {MAX_UPLOAD_MB} MB.", 413
 
 
 # -------------------------
 # Upload Document Route
 # -------------------------
-@app.route("/upload_doc", methods=["GET", "POST"])
+@route("/upload_doc", methods=["GET", "POST"])
 def upload_doc():
     user_id = session.get("user_id")
     if not user_id:
@@ -178,88 +363,149 @@ def upload_doc():
             return "No file uploaded or action not save", 400
 
         extension = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{user_id}_{random.randint(1000,9999)}_{secure_filename(file.filename)}"
-
-        blob = bucket.blob(f"notes/{filename}")
-        file.stream.seek(0) # IMPORTANT: Reset stream for upload
-        blob.upload_from_file(file)
-        blob.make_public()
-        file_url = blob.public_url
-
-        text = ""
-        file.stream.seek(0) # IMPORTANT: Reset stream for text extraction
-        if extension == 'pdf':
-            reader = PdfReader(file)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-        elif extension == 'docx':
-            reader = Document(file)
-            for para in reader.paragraphs:
-                text += para.text + "\n"
-        else:
+        if extension not in supported_extensions():
             return "Unsupported file type", 400
 
-        # Save initial note and get note_id
-        note_id = save_note(db, user_id, text, None, title) 
-
-        # Generate summary & flashcards
-        summary = ""
-        flashcards = [] # <-- Initialization for accumulation
-        
-        # Safer chunk size for API processing
-        chars_per_chunk = 40000 
-        start = 0
-        
-        while start < len(text):
-            chunk = text[start:start + chars_per_chunk]
-            
-            # 1. Generate Summary (HTML)
-            chunk_summary = aiSummariser(chunk, client)
-            summary += chunk_summary + "\n"
-
-            # 2. Generate Flashcards (JSON String)
-            json_string = generate_flashcards(db, user_id, note_id, chunk_summary, client)
-            
-            # CRITICAL: Parse the JSON and accumulate the cards
-            try:
-                cards_list = json.loads(json_string) 
-                flashcards.extend(cards_list)
-            except json.JSONDecodeError as e:
-                print(f"Error parsing flashcards JSON for chunk starting at {start}: {e}")
-                # Log the faulty JSON output for debugging
-                # print(f"Faulty JSON: {json_string}") 
-                pass # Continue processing the next chunk if one fails
-                
-            start += chars_per_chunk
-
-        # Update Firestore with file URL, full summary, AND flashcards
-        db.collection("notes").document(note_id).update({
-            "original_text": file_url,
-            "summary_text": summary,
-            "flashcards": flashcards # <-- Saving the complete list
-        })
+        # The form parser has streamed the file into Storage as it arrived
+        # (UploadRequest); wait for Storage to have all of it before the
+        # file is counted. Files are kept once per content hash
+        # (uploads.py): a duplicate's own blob is removed again.
+        upload = file.stream
+        try:
+            upload.wait()
+        except Exception:
+            return "Upload failed, please try again.", 502
+        blob_path, new = acquire_upload(db, upload.hexdigest, extension, upload.size,
+                                        file.mimetype, upload.blob_path)
+        if new:
+            upload.keep()
+        else:
+            upload.cancel()
+        upload_hash = upload.hexdigest
+
+        # Save the note straight away; summary and flashcards are filled in
+        # by a background job (see jobs.py). Small files are handed to the
+        # job in memory, bigger ones it downloads.
+        note_id = save_note(db, user_id, None, None, title, blob_path=blob_path, upload_hash=upload_hash)
+        enqueue_upload(db, client, note_id, user_id, blob_path, extension, upload.getvalue(),
+                       upload_hash=upload_hash)
 
         return redirect(url_for("home"))
 
     return render_template("upload.html", user_id=user_id)
 
+# -------------------------
+# Export / Import Routes
+# -------------------------
+@route("/export")
+def exportNotes():
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    fmt = request.args.get("format", "zip")
+    if fmt not in ARCHIVE_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(ARCHIVE_FORMATS)}."}), 400
+    include_files = request.args.get("files", "1") != "0"
+    # Built note by note while it is sent (see archive.py)
+    return Response(
+        stream_with_context(iter_export(db, user_id, fmt, include_files)),
+        mimetype=ARCHIVE_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename=studypal-notes.{fmt}"},
+    )
+
+
+@route("/import", methods=["POST"])
+def importNotes():
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    file = request.files.get("archive")
+    fmt = file.filename.rsplit(".", 1)[-1].lower() if file and "." in file.filename else None
+    if fmt not in ARCHIVE_FORMATS:
+        return jsonify({"error": "Upload a .zip or .jsonl archive."}), 400
+
+    def queue_job(note_id, blob_path, extension, digest):
+        enqueue_upload(db, client, note_id, user_id, blob_path, extension, upload_hash=digest)
+
+    try:
+        counts = import_archive(db, user_id, file.stream, fmt, on_queued=queue_job)
+    except zipfile.BadZipFile:
+        return jsonify({"error": "The archive is not a valid zip file."}), 400
+    return jsonify(counts)
+
+
+# -------------------------
+# Processing Status Route
+# -------------------------
+@route("/Note/<note_id>/status")
+def noteStatus(note_id):
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    job = get_job(db, note_id)
+    if not job or job.get("user_id") != user_id:
+        return jsonify({"error": "No processing job for this note."}), 404
+
+    return jsonify({
+        "note_id": note_id,
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "total": job["total"],
+        "error": job.get("error"),
+    })
+
+
+@route("/Note/<note_id>/retry", methods=["POST"])
+def retryNote(note_id):
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("login"))
+
+    job = get_job(db, note_id)
+    if not job or job.get("user_id") != user_id or not requeue_job(db, note_id):
+        return jsonify({"error": "No failed job to retry for this note."}), 404
+
+    # Any worker can run it; completed summary levels are reused
+    get_executor().submit(run_upload_job, db, client, note_id)
+    return jsonify({"note_id": note_id, "status": "queued"}), 202
+
+
+# -------------------------
+# Cache Stats Routes
+# -------------------------
+@route("/stats/llm_cache")
+def llmCacheStats():
+    return jsonify(llm_cache.stats())
+
+
+@route("/stats/note_cache")
+def noteCacheStats():
+    return jsonify(note_cache.stats())
+
+
 # -------------------------
 # Download Route (redirects to Storage file)
 # -------------------------
-@app.route("/Note/<note_id>/download")
+@route("/Note/<note_id>/download")
 def downloadNote(note_id):
     user_id = session.get("user_id")
     if not user_id:
         return redirect(url_for("login"))
 
-    note_doc = db.collection("notes").document(note_id).get()
-    if not note_doc.exists:
+    note_data = get_note(db, note_id)
+    if note_data is None or note_data.get("user_id") != user_id:
         return "Note not found", 404
 
-    note_data = note_doc.to_dict()
-    file_url = note_data.get("original_text")
-
-    if file_url and file_url.startswith("http"):
+    # Uploaded files are private; hand out a short-lived signed URL
+    if note_data.get("blob_path"):
+        return redirect(db.signed_url(note_data["blob_path"], SIGNED_URL_SECONDS))
+    # Notes uploaded before kept a public URL
+    file_url = note_data.get("file_url")
+    if file_url:
         return redirect(file_url)  # <-- Redirects user to download the actual file
     return "No file associated with this note.", 404
 
@@ -267,6 +513,9 @@ def downloadNote(note_id):
 # -------------------------
 # Run App
 # -------------------------
+# Module-level app for `flask run` and WSGI servers (studyPal.main:app)
+app = create_app()
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
 
@@ -0,0 +1,298 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# -------------------------
+# Metrics
+# -------------------------
+# A small in-process registry rendered in the Prometheus text format at
+# /metrics. Every request, stage, repository call and OpenAI call is
+# counted into histograms; that costs a clock read and a dict update, so
+# it is always on. The per-request breakdown (and its log line) is only
+# collected for a TRACE_SAMPLE_RATE share of requests.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger("studypal.requests")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def count(self, **labels):
+        counts = self._values.get(tuple(labels[name] for name in self.labels))
+        return counts[-1] if counts else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(self.labels, key, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {counts[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {counts[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        self._metrics.append(Counter(name, help, labels))
+        return self._metrics[-1]
+
+    def gauge(self, name, help, labels=()):
+        self._metrics.append(Gauge(name, help, labels))
+        return self._metrics[-1]
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        self._metrics.append(Histogram(name, help, labels, buckets))
+        return self._metrics[-1]
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "studypal_request_seconds", "Time to handle a request.", ("route", "method", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "studypal_stage_seconds", "Time spent in a stage, repository call or OpenAI call.", ("stage",))
+STAGE_ERRORS = REGISTRY.counter(
+    "studypal_stage_errors_total", "Stages that raised an exception.", ("stage",))
+OPENAI_TOKENS = REGISTRY.counter(
+    "studypal_openai_tokens_total", "OpenAI tokens used, from response.usage.", ("function", "kind"))
+
+
+# -------------------------
+# Per-request traces
+# -------------------------
+class Trace:
+
+    def __init__(self):
+        self.stages = {}  # name -> [count, seconds]
+        self.tokens = {"prompt": 0, "completion": 0}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+
+_trace = contextvars.ContextVar("studypal_trace", default=None)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as `name`, in the stage histogram and in the current
+    request's trace if it is sampled.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(name, elapsed)
+
+
+def record_usage(function, usage):
+    """
+    Count the tokens of an OpenAI response's `usage`, if it has one.
+    """
+    if usage is None:
+        return
+    prompt, completion = usage.prompt_tokens or 0, usage.completion_tokens or 0
+    OPENAI_TOKENS.inc(prompt, function=function, kind="prompt")
+    OPENAI_TOKENS.inc(completion, function=function, kind="completion")
+    trace = _trace.get()
+    if trace is not None:
+        trace.tokens["prompt"] += prompt
+        trace.tokens["completion"] += completion
+
+
+# -------------------------
+# Repository calls
+# -------------------------
+class InstrumentedRepository:
+    """
+    Wrap a repository so every call is timed as a "db.<method>" or, for
+    blobs, "storage.<method>" stage.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def __getattr__(self, name):
+        attr = getattr(self.repo, name)
+        if not callable(attr):
+            return attr
+        label = f"storage.{name}" if "blob" in name or name == "signed_url" else f"db.{name}"
+
+        def call(*args, **kwargs):
+            with stage(label):
+                return attr(*args, **kwargs)
+        setattr(self, name, call)  # later lookups skip __getattr__
+        return call
+
+
+class AsyncInstrumentedRepository(InstrumentedRepository):
+    """InstrumentedRepository for an async repository's coroutines."""
+
+    def __getattr__(self, name):
+        attr = getattr(self.repo, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            with stage(f"db.{name}"):
+                return await attr(*args, **kwargs)
+        setattr(self, name, call)
+        return call
+
+
+# -------------------------
+# Flask integration
+# -------------------------
+def init_app(app, sample_rate=None):
+    """
+    Time every request of `app`, log a JSON line for sampled ones and serve
+    the registry at /metrics. Streamed responses are timed up to the point
+    the view returns, not until the stream ends.
+    """
+    from flask import Response, g, request
+
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+
+    @app.before_request
+    def _start_request():
+        g.metrics_start = time.perf_counter()
+        g.metrics_token = _trace.set(Trace() if random.random() < rate else None)
+
+    @app.after_request
+    def _finish_request(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(elapsed, route=route, method=request.method,
+                                status=str(response.status_code))
+
+        trace = _trace.get()
+        _trace.reset(g.pop("metrics_token"))
+        if trace is not None and logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                "event": "request",
+                "route": route,
+                "method": request.method,
+                "status": response.status_code,
+                "duration_ms": round(elapsed * 1000, 2),
+                "stages": {name: {"count": count, "ms": round(seconds * 1000, 2)}
+                           for name, (count, seconds) in trace.stages.items()},
+                "openai_tokens": trace.tokens,
+            }))
+        return response
+
+    @app.teardown_request
+    def _drop_trace(exc):
+        # after_request is skipped when a view raises
+        token = g.pop("metrics_token", None)
+        if token is not None:
+            _trace.reset(token)
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,42 @@
+"""
+Move notes written with inline bodies to the split storage layout
+described in note_storage.py.
+
+    python -m studyPal.migrate_notes [--dry-run]
+"""
+import argparse
+from .note_storage import is_legacy, migrate_note
+from .repository import ID
+
+PAGE_SIZE = 100
+
+
+def migrate_notes(db, dry_run=False, page_size=PAGE_SIZE):
+    """
+    Walk every note and migrate the legacy ones. Safe to re-run: notes
+    already in the new layout are skipped. Returns (migrated, skipped).
+    """
+    migrated = skipped = 0
+    last_id = None
+    while True:
+        docs = db.query("notes", order_by=[(ID, "asc")],
+                        start_after=[last_id] if last_id else None, limit=page_size)
+        for note_id, note_data in docs:
+            if not is_legacy(note_data):
+                skipped += 1
+            elif dry_run or migrate_note(db, note_id, note_data):
+                migrated += 1
+        if len(docs) < page_size:
+            return migrated, skipped
+        last_id = docs[-1][0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only count the notes to migrate")
+    args = parser.parse_args()
+
+    from .main import db
+    migrated, skipped = migrate_notes(db, dry_run=args.dry_run)
+    verb = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{verb} {migrated} notes ({skipped} already up to date).")
@@ -0,0 +1,177 @@
+from .repository import DELETE_FIELD
+from .cache import note_cache
+
+# -------------------------
+# Note storage layout
+# -------------------------
+# A note document only holds small metadata. The heavy parts live apart so
+# each route reads just what it renders:
+#   - raw text:       blob note_text/<note_id>.txt
+#   - summary:        notes/<note_id>/summary/<index>, one HTML section each
+#   - flashcards:     notes/<note_id>/flashcards/<index>, one card each
+#   - chunks:         notes/<note_id>/chunks/<index>, per-chunk results of
+#                     written notes, for incremental edits (incremental.py)
+# Notes written before this layout (no "layout" field) keep everything
+# inline; the readers below fall back to those fields.
+LAYOUT_VERSION = 2
+SECTION_MAX_CHARS = 200 * 1024  # well below Firestore's 1 MiB document cap
+
+
+def is_legacy(note_data):
+    return note_data.get("layout", 1) < LAYOUT_VERSION
+
+
+def _replace_subcollection(db, note_id, name, items, new=False, writes=None):
+    """
+    Replace a subcollection's documents. With a `writes` list the writes
+    are added to it, to be committed together with the rest of the note
+    (see save_note), instead of being committed here.
+    """
+    path = f"notes/{note_id}/{name}"
+    pending = [("set", path, f"{i:05d}", dict(item, index=i)) for i, item in enumerate(items)]
+    if not new:
+        # Drop leftovers from a previous, longer version
+        stale = db.query(path, where=[("index", ">=", len(items))], fields=[])
+        pending += [("delete", path, doc_id, None) for doc_id, _ in stale]
+    if writes is not None:
+        writes.extend(pending)
+    else:
+        db.write_batch(pending)
+
+
+def _read_subcollection(db, note_id, name):
+    return [data for _, data in db.query(f"notes/{note_id}/{name}", order_by=[("index", "asc")])]
+
+
+# -------------------------
+# Raw text
+# -------------------------
+def text_blob_path(note_id):
+    return f"note_text/{note_id}.txt"
+
+
+def write_text(db, note_id, text):
+    """
+    Store a note's raw text; returns the note fields pointing at it.
+    """
+    path = text_blob_path(note_id)
+    db.put_blob(path, text, content_type="text/plain; charset=utf-8")
+    return {"text_path": path}
+
+
+def read_text(db, note_data):
+    if note_data.get("text_path"):
+        return db.get_blob(note_data["text_path"]).decode("utf-8")
+    text = note_data.get("original_text")
+    # Legacy upload notes kept the file URL in original_text
+    if is_legacy(note_data) and text and text.startswith("http"):
+        return None
+    return text
+
+
+# -------------------------
+# Summary sections
+# -------------------------
+def split_sections(html):
+    """
+    Split summary HTML into sections of at most SECTION_MAX_CHARS, breaking
+    between lines so tags are not cut apart.
+    """
+    sections, current, size = [], [], 0
+    for line in html.splitlines(keepends=True):
+        if current and size + len(line) > SECTION_MAX_CHARS:
+            sections.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def write_summary(db, note_id, html, new=False, writes=None):
+    sections = split_sections(html or "")
+    _replace_subcollection(db, note_id, "summary", [{"html": s} for s in sections], new, writes)
+    return {"summary_sections": len(sections)}
+
+
+def read_summary(db, note_id, note_data):
+    if is_legacy(note_data):
+        return note_data.get("summary_text")
+    if not note_data.get("summary_sections"):
+        return None
+    return "".join(s["html"] for s in _read_subcollection(db, note_id, "summary"))
+
+
+# -------------------------
+# Flashcards
+# -------------------------
+def write_flashcards(db, note_id, cards, new=False, writes=None):
+    _replace_subcollection(db, note_id, "flashcards", cards, new, writes)
+    return {"flashcard_count": len(cards)}
+
+
+def read_flashcards(db, note_id):
+    cards = _read_subcollection(db, note_id, "flashcards")
+    for card in cards:
+        card.pop("index", None)
+    return cards
+
+
+async def read_flashcards_async(adb, note_id):
+    docs = await adb.query(f"notes/{note_id}/flashcards", order_by=[("index", "asc")])
+    cards = [data for _, data in docs]
+    for card in cards:
+        card.pop("index", None)
+    return cards
+
+
+# -------------------------
+# Chunk records
+# -------------------------
+def write_chunks(db, note_id, chunks, new=False, writes=None):
+    _replace_subcollection(db, note_id, "chunks", chunks, new, writes)
+    return {"chunk_count": len(chunks)}
+
+
+def read_chunks(db, note_id):
+    return _read_subcollection(db, note_id, "chunks")
+
+
+# -------------------------
+# Whole notes
+# -------------------------
+def delete_body(db, note_id, note_data):
+    """
+    Remove a note's text blob and subcollections.
+    """
+    if note_data.get("text_path"):
+        db.delete_blob(note_data["text_path"])
+    _replace_subcollection(db, note_id, "summary", [])
+    _replace_subcollection(db, note_id, "flashcards", [])
+    _replace_subcollection(db, note_id, "chunks", [])
+
+
+def migrate_note(db, note_id, note_data):
+    """
+    Move a legacy note's inline text, summary and flashcards into the new
+    layout. Returns False if the note was already migrated.
+    """
+    if not is_legacy(note_data):
+        return False
+    updates = {"layout": LAYOUT_VERSION, "original_text": DELETE_FIELD}
+
+    original = note_data.get("original_text")
+    if original and original.startswith("http"):
+        updates["file_url"] = original
+    elif original:
+        updates.update(write_text(db, note_id, original))
+
+    updates.update(write_summary(db, note_id, note_data.get("summary_text")))
+    updates.update(write_flashcards(db, note_id, note_data.get("flashcards") or []))
+    updates["summary_text"] = DELETE_FIELD
+    updates["flashcards"] = DELETE_FIELD
+
+    db.update("notes", note_id, updates)
+    note_cache.invalidate(note_id)
+    return True
@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .chunking import count_tokens
+
+logger = logging.getLogger("studypal.pipeline")
+
+# -------------------------
+# Concurrent chunk executor
+# -------------------------
+# Each chunk runs summarise -> flashcards in its own task, so a chunk's
+# flashcard call starts as soon as its summary is ready while the other
+# chunks are still being summarised. Rate-limit and server errors are
+# retried by the OpenAI rate limiter (ratelimit.py) alone, so an error
+# reaching this executor is final: a failed flashcard call still never
+# throws away the summary it was built from.
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "4"))
+
+
+def process_chunks(chunks, summarise, make_cards, max_workers=None, on_chunk_done=None):
+    """
+    Summarise every chunk and generate its flashcards concurrently.
+
+    summarise(chunk) -> summary and make_cards(summary) -> list of cards are
+    called from worker threads. Returns one dict per chunk, in document
+    order, with "summary", "flashcards" and "error" (None on success). A
+    chunk that fails keeps whatever stage succeeded.
+    on_chunk_done(done_count) is called as each chunk finishes.
+    """
+    max_workers = max_workers or CHUNK_WORKERS
+    chunks = list(chunks)
+    results = [None] * len(chunks)
+
+    def run(index, chunk):
+        result = {"summary": "", "flashcards": [], "error": None}
+        try:
+            result["summary"] = summarise(chunk)
+            result["flashcards"] = make_cards(result["summary"])
+        except Exception as e:
+            logger.warning("Chunk %s failed: %s", index, e)
+            result["error"] = str(e)
+        results[index] = result
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="studypal-chunk") as pool:
+        futures = [pool.submit(run, i, chunk) for i, chunk in enumerate(chunks)]
+        for done_count, _ in enumerate(as_completed(futures), start=1):
+            if on_chunk_done:
+                on_chunk_done(done_count)
+
+    return results
+
+
+# -------------------------
+# Map-reduce summarisation
+# -------------------------
+# Chunk summaries are concatenated as long as the result fits in
+# SUMMARY_MAX_TOKENS. Beyond that they are grouped and re-summarised level
+# by level (each level in parallel) until the merged summary fits.
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "4000"))
+REDUCE_INPUT_TOKENS = int(os.getenv("REDUCE_INPUT_TOKENS", "8000"))
+
+
+def group_summaries(summaries, max_tokens):
+    """
+    Split summaries into consecutive groups of roughly max_tokens each.
+    Every group holds at least two summaries so each level shrinks.
+    """
+    groups, group, group_tokens = [], [], 0
+    for summary in summaries:
+        tokens = count_tokens(summary)
+        if len(group) >= 2 and group_tokens + tokens > max_tokens:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(summary)
+        group_tokens += tokens
+    if len(group) == 1 and groups:
+        groups[-1].append(group[0])
+    elif group:
+        groups.append(group)
+    return groups
+
+
+def levels_key(summaries):
+    h = hashlib.sha256()
+    for summary in summaries:
+        h.update(summary.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def reduce_summaries(summaries, summarise, max_tokens=None, max_workers=None,
+                     load_level=None, save_level=None):
+    """
+    Merge chunk summaries into a single summary of at most about max_tokens.
+
+    summarise(text) -> summary is used for every merge. load_level(level, key)
+    and save_level(level, key, summaries) let callers persist each level so
+    a re-run resumes from the last completed one; key identifies the inputs
+    the level was built from.
+    """
+    max_tokens = max_tokens or SUMMARY_MAX_TOKENS
+    max_workers = max_workers or CHUNK_WORKERS
+    summaries = [s for s in summaries if s]
+    level = 0
+
+    while len(summaries) > 1 and sum(count_tokens(s) for s in summaries) > max_tokens:
+        level += 1
+        key = levels_key(summaries)
+        stored = load_level(level, key) if load_level else None
+        if stored is not None:
+            summaries = stored
+            continue
+
+        groups = group_summaries(summaries, REDUCE_INPUT_TOKENS)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="studypal-reduce") as pool:
+            summaries = list(pool.map(lambda group: summarise("\n".join(group)), groups))
+        if save_level:
+            save_level(level, key, summaries)
+
+    return "".join(s + "\n" for s in summaries)
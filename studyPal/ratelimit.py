@@ -0,0 +1,429 @@
+import asyncio
+import email.utils
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger("studypal.ratelimit")
+
+# -------------------------
+# OpenAI rate limiting
+# -------------------------
+# Every OpenAI call waits for a slot from the process-wide governor. A slot
+# needs one request from the requests/min bucket, the call's estimated
+# tokens from the tokens/min bucket, and a free place among
+# OPENAI_MAX_CONCURRENCY calls in flight. Waiting calls are served by
+# priority class first (interactive requests before background upload
+# jobs), then in arrival order.
+#
+# A 429 pauses the whole process for its Retry-After and halves the refill
+# rate, which then creeps back up with every successful call. Set
+# OPENAI_RATE_PROCESSES to the number of worker processes sharing the
+# account so their budgets add up to the account limits. When a shared
+# repository is attached, a 429 seen by one process pauses all of them.
+# Coroutines (the ASGI app, asgi.py) queue in the same line through
+# call_async.
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_RATE_PROCESSES = int(os.getenv("OPENAI_RATE_PROCESSES", "1"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_BACKOFF = float(os.getenv("OPENAI_BACKOFF", "1.0"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "60"))
+SHARED_POLL_SECONDS = 1.0
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "studypal_openai_queue_depth", "OpenAI calls waiting for a slot.", ("priority",))
+IN_FLIGHT = REGISTRY.gauge("studypal_openai_in_flight", "OpenAI calls in flight.")
+WAIT_SECONDS = REGISTRY.histogram(
+    "studypal_openai_wait_seconds", "Time OpenAI calls waited for a slot.", ("priority",))
+RETRIES = REGISTRY.counter(
+    "studypal_openai_retries_total", "OpenAI calls retried, by reason.", ("reason",))
+RATE_FACTOR = REGISTRY.gauge(
+    "studypal_openai_rate_factor", "Share of the configured rate currently used (lowered after 429s).")
+
+
+class TokenBucket:
+    """
+    Holds up to `per_minute` units and refills continuously.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def refill(self, now, factor=1.0):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * factor)
+        self.updated = now
+
+    def wait_time(self, amount, factor=1.0):
+        # Calls bigger than the bucket only wait for a full bucket
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / (self.rate * factor))
+
+
+def retry_reason(error):
+    """
+    "rate_limit" or "server" for errors worth retrying, else None.
+    """
+    status = getattr(error, "status_code", None)
+    if status == 429:
+        # An exhausted quota will not come back by waiting
+        return None if getattr(error, "code", None) == "insufficient_quota" else "rate_limit"
+    if status in (500, 502, 503, 504):
+        return "server"
+    if status is None and type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return "server"
+    return None
+
+
+def retry_after(error):
+    """
+    Seconds to wait according to the error's Retry-After headers, if any.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class RateLimiter:
+
+    def __init__(self, requests_per_min=None, tokens_per_min=None, max_concurrency=None,
+                 max_retries=None, backoff=None, processes=None):
+        processes = processes or OPENAI_RATE_PROCESSES
+        self.requests = TokenBucket((requests_per_min or OPENAI_RPM) / processes)
+        self.tokens = TokenBucket((tokens_per_min or OPENAI_TPM) / processes)
+        self.max_concurrency = max_concurrency or OPENAI_MAX_CONCURRENCY
+        self.max_retries = OPENAI_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = OPENAI_BACKOFF if backoff is None else backoff
+        self.shared = None  # repository for cross-process pauses
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, arrival)
+        self._async_waiters = {}  # entry -> (loop, asyncio.Event) of acquire_async calls
+        self._arrivals = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._factor = 1.0
+        self._shared_checked = 0.0
+        RATE_FACTOR.set(self._factor)
+
+    # Slots
+    def _wait_time(self, entry, tokens, now):
+        """None to wait for a notify, else seconds until the slot may be free."""
+        if self._waiting[0] != entry or self._in_flight >= self.max_concurrency:
+            return None
+        if now < self._paused_until:
+            return self._paused_until - now
+        self.requests.refill(now, self._factor)
+        self.tokens.refill(now, self._factor)
+        return max(self.requests.wait_time(1, self._factor),
+                   self.tokens.wait_time(tokens, self._factor))
+
+    def _join(self, priority):
+        entry = (priority, next(self._arrivals))
+        heapq.heappush(self._waiting, entry)
+        QUEUE_DEPTH.inc(priority=PRIORITY_NAMES[priority])
+        return entry
+
+    def _leave(self, entry):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        QUEUE_DEPTH.dec(priority=PRIORITY_NAMES[entry[0]])
+        # The next call in line may be able to go too
+        self._notify()
+
+    def _notify(self):
+        """Wake the waiting calls (with self._cond held)."""
+        self._cond.notify_all()
+        # Only the head of the line can take a slot; if it is a coroutine,
+        # wake it on its event loop
+        waiter = self._async_waiters.get(self._waiting[0]) if self._waiting else None
+        if waiter is not None:
+            loop, event = waiter
+            loop.call_soon_threadsafe(event.set)
+
+    def _take(self, tokens):
+        self.requests.level -= 1
+        self.tokens.level -= tokens
+        self._in_flight += 1
+        IN_FLIGHT.set(self._in_flight)
+
+    def acquire(self, tokens, priority=INTERACTIVE):
+        """
+        Block until a call estimated at `tokens` tokens may start.
+        """
+        self._poll_shared()
+        start = time.monotonic()
+        with self._cond:
+            entry = self._join(priority)
+            try:
+                while True:
+                    wait = self._wait_time(entry, tokens, time.monotonic())
+                    if wait == 0:
+                        break
+                    self._cond.wait(wait)
+            finally:
+                self._leave(entry)
+            self._take(tokens)
+        WAIT_SECONDS.observe(time.monotonic() - start, priority=PRIORITY_NAMES[priority])
+
+    async def acquire_async(self, tokens, priority=INTERACTIVE):
+        """
+        acquire() for the event loop: the same line and buckets, but the
+        wait is awaited, so waiting calls hold no thread.
+        """
+        if self.shared is not None:
+            await asyncio.to_thread(self._poll_shared)
+        start = time.monotonic()
+        event = asyncio.Event()
+        with self._cond:
+            entry = self._join(priority)
+            self._async_waiters[entry] = (asyncio.get_running_loop(), event)
+        acquired = False
+        try:
+            while True:
+                with self._cond:
+                    event.clear()
+                    wait = self._wait_time(entry, tokens, time.monotonic())
+                    if wait == 0:
+                        del self._async_waiters[entry]
+                        self._leave(entry)
+                        self._take(tokens)
+                        acquired = True
+                        break
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if not acquired:
+                # Cancelled while waiting
+                with self._cond:
+                    del self._async_waiters[entry]
+                    self._leave(entry)
+        WAIT_SECONDS.observe(time.monotonic() - start, priority=PRIORITY_NAMES[priority])
+
+    def release(self, estimated, actual=None):
+        """
+        Free a slot, correcting the token bucket by the call's real usage.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            IN_FLIGHT.set(self._in_flight)
+            if actual is not None:
+                self.tokens.level += estimated - actual
+            self._notify()
+
+    # Adapting to 429s
+    def pause(self, seconds):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._factor = max(0.1, self._factor / 2)
+            RATE_FACTOR.set(self._factor)
+            self._notify()
+        if self.shared is not None:
+            try:
+                self.shared.set("rate_limits", "openai", {"paused_until": time.time() + seconds}, merge=True)
+            except Exception as e:
+                # Sharing the pause is best effort; this process still backs off
+                logger.warning("Rate limit pause not shared: %s", e)
+
+    def _succeeded(self):
+        if self._factor < 1.0:
+            with self._cond:
+                self._factor = min(1.0, self._factor + 0.05)
+                RATE_FACTOR.set(self._factor)
+
+    def _poll_shared(self):
+        now = time.monotonic()
+        if self.shared is None or now - self._shared_checked < SHARED_POLL_SECONDS:
+            return
+        self._shared_checked = now
+        try:
+            data = self.shared.get("rate_limits", "openai") or {}
+        except Exception as e:
+            logger.warning("Rate limit pause not read: %s", e)
+            return
+        remaining = data.get("paused_until", 0) - time.time()
+        if remaining > 0:
+            with self._cond:
+                self._paused_until = max(self._paused_until, now + remaining)
+
+    def backoff_delay(self, attempt):
+        # Full jitter keeps retrying workers from lining up again
+        return random.uniform(0.5, 1.0) * min(OPENAI_BACKOFF_MAX, self.backoff * 2 ** attempt)
+
+    # Calls
+    def call(self, fn, tokens, priority=INTERACTIVE):
+        """
+        Run fn() (an OpenAI request) under the limiter, retrying rate
+        limits and server errors with backoff. `tokens` estimates the
+        prompt plus completion; a response's usage corrects it.
+        """
+        for attempt in itertools.count():
+            self.acquire(tokens, priority)
+            actual = None
+            try:
+                response = fn()
+                usage = getattr(response, "usage", None)
+                actual = getattr(usage, "total_tokens", None)
+                self._succeeded()
+                return response
+            except Exception as e:
+                reason = retry_reason(e)
+                if reason is None or attempt >= self.max_retries:
+                    raise
+                RETRIES.inc(reason=reason)
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+            finally:
+                self.release(tokens, actual)
+
+            if reason == "rate_limit":
+                self.pause(delay)
+            else:
+                time.sleep(delay)
+
+    def stream(self, fn, tokens, priority=INTERACTIVE):
+        """
+        call() for a streamed response: fn() opens the stream, with the
+        same retries, and the events are yielded with the slot held until
+        the stream is read or closed. The usage on the final event corrects
+        the estimate.
+        """
+        for attempt in itertools.count():
+            self.acquire(tokens, priority)
+            try:
+                stream = fn()
+                break
+            except Exception as e:
+                self.release(tokens)
+                reason = retry_reason(e)
+                if reason is None or attempt >= self.max_retries:
+                    raise
+                RETRIES.inc(reason=reason)
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+
+            if reason == "rate_limit":
+                self.pause(delay)
+            else:
+                time.sleep(delay)
+
+        actual = None
+        try:
+            for event in stream:
+                usage = getattr(event, "usage", None)
+                if usage is not None:
+                    actual = getattr(usage, "total_tokens", None)
+                yield event
+            self._succeeded()
+        finally:
+            self.release(tokens, actual)
+
+    async def call_async(self, fn, tokens, priority=INTERACTIVE):
+        """
+        call() for coroutines: awaits fn() (an AsyncOpenAI request) under
+        the limiter, with the same retries.
+        """
+        for attempt in itertools.count():
+            await self.acquire_async(tokens, priority)
+            actual = None
+            try:
+                response = await fn()
+                usage = getattr(response, "usage", None)
+                actual = getattr(usage, "total_tokens", None)
+                self._succeeded()
+                return response
+            except Exception as e:
+                reason = retry_reason(e)
+                if reason is None or attempt >= self.max_retries:
+                    raise
+                RETRIES.inc(reason=reason)
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+            finally:
+                self.release(tokens, actual)
+
+            if reason == "rate_limit":
+                if self.shared is not None:
+                    await asyncio.to_thread(self.pause, delay)
+                else:
+                    self.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+
+
+    async def stream_async(self, fn, tokens, priority=INTERACTIVE):
+        """
+        stream() for coroutines: awaits fn() to open an AsyncOpenAI stream
+        and yields its events, holding the slot until it is read or closed.
+        """
+        for attempt in itertools.count():
+            await self.acquire_async(tokens, priority)
+            try:
+                stream = await fn()
+                break
+            except Exception as e:
+                self.release(tokens)
+                reason = retry_reason(e)
+                if reason is None or attempt >= self.max_retries:
+                    raise
+                RETRIES.inc(reason=reason)
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+
+            if reason == "rate_limit":
+                if self.shared is not None:
+                    await asyncio.to_thread(self.pause, delay)
+                else:
+                    self.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+
+        actual = None
+        try:
+            async for event in stream:
+                usage = getattr(event, "usage", None)
+                if usage is not None:
+                    actual = getattr(usage, "total_tokens", None)
+                yield event
+            self._succeeded()
+        finally:
+            self.release(tokens, actual)
+
+
+# Process-wide limiter used by functions.py; main.py attaches the shared store.
+openai_limiter = RateLimiter()
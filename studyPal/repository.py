@@ -0,0 +1,457 @@
+import copy
+import io
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# -------------------------
+# Storage repository
+# -------------------------
+# Everything the app persists goes through one of these repositories: a
+# small document-store API (paths, documents, simple queries, batches and
+# read-modify-write transactions) plus blob storage. FirestoreRepository
+# talks to Firebase; MemoryRepository keeps everything in-process with the
+# same semantics, for benchmarks, profiling and local development.
+#
+# Paths name a collection, e.g. "notes" or "notes/<note_id>/flashcards".
+# Queries take:
+#   where:       [(field, op, value)] with op in ==, <, <=, >, >=, in
+#   order_by:    [(field, "asc" | "desc")]; documents missing a field are
+#                left out, as in Firestore. Use ID to order by document id.
+#   start_after: values for the order_by fields, exclusive
+#   fields:      projection; only these fields are returned
+ID = "__name__"
+
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+# Field values resolved by the repository when a write is applied
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+# Returned by a transact_update function to delete the document
+DELETE = _Sentinel("DELETE")
+
+BATCH_LIMIT = 500  # Firestore's maximum writes per batch
+
+
+class NotFoundError(LookupError):
+    """Raised when updating a document that does not exist."""
+
+
+# -------------------------
+# Firestore / Cloud Storage
+# -------------------------
+class FirestoreRepository:
+
+    def __init__(self, db, bucket=None):
+        from firebase_admin import firestore
+        self.db = db
+        self.bucket = bucket
+        self._firestore = firestore
+
+    def _collection(self, path):
+        parts = path.split("/")
+        ref = self.db.collection(parts[0])
+        for i in range(1, len(parts), 2):
+            ref = ref.document(parts[i]).collection(parts[i + 1])
+        return ref
+
+    def _ref(self, path, doc_id):
+        return self._collection(path).document(doc_id)
+
+    def _out(self, data):
+        translate = {
+            SERVER_TIMESTAMP: self._firestore.SERVER_TIMESTAMP,
+            DELETE_FIELD: self._firestore.DELETE_FIELD,
+        }
+        return {k: translate.get(v, v) if isinstance(v, _Sentinel) else v for k, v in data.items()}
+
+    # Documents
+    def get(self, path, doc_id, fields=None):
+        ref = self._ref(path, doc_id)
+        doc = ref.get(field_paths=fields) if fields else ref.get()
+        return doc.to_dict() if doc.exists else None
+
+    def set(self, path, doc_id, data, merge=False):
+        self._ref(path, doc_id).set(self._out(data), merge=merge)
+
+    def update(self, path, doc_id, data):
+        self._ref(path, doc_id).update(self._out(data))
+
+    def delete(self, path, doc_id):
+        self._ref(path, doc_id).delete()
+
+    def query(self, path, where=(), order_by=(), start_after=None, limit=None, fields=None):
+        """
+        Run a query; returns a list of (doc_id, data) pairs.
+        """
+        query = self._collection(path)
+        for field, op, value in where:
+            query = query.where(field, op, value)
+        for field, direction in order_by:
+            query = query.order_by(field, direction=(
+                self._firestore.Query.DESCENDING if direction == "desc"
+                else self._firestore.Query.ASCENDING))
+        if fields is not None:
+            query = query.select(fields)
+        if start_after is not None:
+            query = query.start_after(dict(zip((f for f, _ in order_by), start_after)))
+        if limit:
+            query = query.limit(limit)
+        return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    def write_batch(self, writes):
+        """
+        Apply (op, path, doc_id, data) writes, op being set/update/delete,
+        in as few batches as possible.
+        """
+        batch, pending = self.db.batch(), 0
+        for op, path, doc_id, data in writes:
+            ref = self._ref(path, doc_id)
+            if op == "delete":
+                batch.delete(ref)
+            else:
+                getattr(batch, op)(ref, self._out(data))
+            pending += 1
+            if pending == BATCH_LIMIT:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+
+    def transact_update(self, path, doc_id, fn):
+        """
+        Atomically read a document and apply fn(data) -> updates (or None
+        to leave it unchanged, or DELETE to delete it; data is None if the
+        document is missing, and the updates then create it). Returns what
+        fn returned.
+        """
+        ref = self._ref(path, doc_id)
+
+        @self._firestore.transactional
+        def run(transaction):
+            snapshot = ref.get(transaction=transaction)
+            updates = fn(snapshot.to_dict() if snapshot.exists else None)
+            if updates is DELETE:
+                transaction.delete(ref)
+            elif updates is not None and snapshot.exists:
+                transaction.update(ref, self._out(updates))
+            elif updates is not None:
+                transaction.set(ref, self._out(updates))
+            return updates
+
+        return run(self.db.transaction())
+
+    # Blobs
+    def put_blob(self, name, data, content_type=None):
+        blob = self.bucket.blob(name)
+        if hasattr(data, "read"):
+            blob.upload_from_file(data, content_type=content_type)
+        else:
+            blob.upload_from_string(data, content_type=content_type)
+
+    def get_blob(self, name):
+        return self.bucket.blob(name).download_as_bytes()
+
+    def delete_blob(self, name):
+        self.bucket.blob(name).delete()
+
+    def blob_exists(self, name):
+        return self.bucket.blob(name).exists()
+
+    def open_blob_writer(self, name, content_type=None, chunk_size=None):
+        """
+        Writable file object backed by a resumable upload session: every
+        chunk_size bytes (a multiple of 256 KiB) are sent as they are
+        written, and close() finalises the blob.
+        """
+        return self.bucket.blob(name).open("wb", chunk_size=chunk_size, content_type=content_type)
+
+    def open_blob_reader(self, name, chunk_size=None):
+        """
+        Readable file object that downloads the blob chunk_size bytes at a
+        time, for copying large files without holding them whole.
+        """
+        return self.bucket.blob(name).open("rb", chunk_size=chunk_size)
+
+    def signed_url(self, name, expires_in):
+        """
+        Time-limited GET URL for a private blob, signed locally with the
+        service account key (no round trip).
+        """
+        return self.bucket.blob(name).generate_signed_url(
+            version="v4", expiration=timedelta(seconds=expires_in), method="GET")
+
+
+# -------------------------
+# In-process
+# -------------------------
+class MemoryRepository:
+
+    def __init__(self):
+        self._collections = {}  # path -> {doc_id: data}
+        self._blobs = {}  # name -> (bytes, content_type)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _apply(doc, data):
+        now = datetime.now(timezone.utc)
+        for key, value in data.items():
+            if value is DELETE_FIELD:
+                doc.pop(key, None)
+            elif value is SERVER_TIMESTAMP:
+                doc[key] = now
+            else:
+                doc[key] = copy.deepcopy(value)
+        return doc
+
+    @staticmethod
+    def _project(data, fields):
+        if fields is None:
+            return copy.deepcopy(data)
+        return {k: copy.deepcopy(data[k]) for k in fields if k in data}
+
+    # Documents
+    def get(self, path, doc_id, fields=None):
+        with self._lock:
+            data = self._collections.get(path, {}).get(doc_id)
+            return None if data is None else self._project(data, fields)
+
+    def set(self, path, doc_id, data, merge=False):
+        with self._lock:
+            docs = self._collections.setdefault(path, {})
+            base = docs.get(doc_id, {}) if merge else {}
+            docs[doc_id] = self._apply(dict(base), data)
+
+    def update(self, path, doc_id, data):
+        with self._lock:
+            docs = self._collections.get(path, {})
+            if doc_id not in docs:
+                raise NotFoundError(f"{path}/{doc_id}")
+            docs[doc_id] = self._apply(dict(docs[doc_id]), data)
+
+    def delete(self, path, doc_id):
+        with self._lock:
+            self._collections.get(path, {}).pop(doc_id, None)
+
+    _OPS = {
+        "==": lambda a, b: a == b,
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+        "in": lambda a, b: a in b,
+    }
+
+    def query(self, path, where=(), order_by=(), start_after=None, limit=None, fields=None):
+        def value(doc_id, data, field):
+            return doc_id if field == ID else data.get(field)
+
+        with self._lock:
+            docs = list(self._collections.get(path, {}).items())
+            for field, op, expected in where:
+                docs = [(i, d) for i, d in docs
+                        if (field == ID or field in d) and self._safe(op, value(i, d, field), expected)]
+            docs = [(i, d) for i, d in docs if all(f == ID or f in d for f, _ in order_by)]
+            for field, direction in reversed(order_by):
+                docs.sort(key=lambda item: value(*item, field), reverse=direction == "desc")
+            if start_after is not None:
+                def after(item):
+                    for (field, direction), cursor in zip(order_by, start_after):
+                        current = value(*item, field)
+                        if current != cursor:
+                            return current < cursor if direction == "desc" else current > cursor
+                    return False
+                docs = [item for item in docs if after(item)]
+            if limit:
+                docs = docs[:limit]
+            return [(i, self._project(d, fields)) for i, d in docs]
+
+    def _safe(self, op, actual, expected):
+        try:
+            return self._OPS[op](actual, expected)
+        except TypeError:
+            # Firestore never matches values of different types
+            return False
+
+    def write_batch(self, writes):
+        with self._lock:
+            for op, path, doc_id, data in writes:
+                if op == "delete":
+                    self.delete(path, doc_id)
+                else:
+                    getattr(self, op)(path, doc_id, data)
+
+    def transact_update(self, path, doc_id, fn):
+        with self._lock:
+            data = self.get(path, doc_id)
+            updates = fn(data)
+            if updates is DELETE:
+                self.delete(path, doc_id)
+            elif updates is not None:
+                self.set(path, doc_id, updates, merge=data is not None)
+            return updates
+
+    # Blobs
+    def put_blob(self, name, data, content_type=None):
+        if hasattr(data, "read"):
+            data = data.read()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            self._blobs[name] = (bytes(data), content_type)
+
+    def get_blob(self, name):
+        with self._lock:
+            if name not in self._blobs:
+                raise NotFoundError(name)
+            return self._blobs[name][0]
+
+    def delete_blob(self, name):
+        with self._lock:
+            self._blobs.pop(name, None)
+
+    def blob_exists(self, name):
+        with self._lock:
+            return name in self._blobs
+
+    def open_blob_writer(self, name, content_type=None, chunk_size=None):
+        return _MemoryBlobWriter(self, name, content_type)
+
+    def open_blob_reader(self, name, chunk_size=None):
+        return io.BytesIO(self.get_blob(name))
+
+    def signed_url(self, name, expires_in):
+        return f"memory://{name}?expires={int(time.time() + expires_in)}"
+
+
+class _MemoryBlobWriter(io.BytesIO):
+    """Collects the written bytes and stores them as a blob on close."""
+
+    def __init__(self, repo, name, content_type):
+        super().__init__()
+        self._repo = repo
+        self._name = name
+        self._content_type = content_type
+
+    def close(self):
+        if not self.closed:
+            self._repo.put_blob(self._name, self.getvalue(), self._content_type)
+        super().close()
+
+
+# -------------------------
+# Async (ASGI serving, asgi.py)
+# -------------------------
+# Coroutine versions of the document methods. Cloud Storage has no
+# asyncio client, so blobs stay with the sync repository.
+class AsyncFirestoreRepository(FirestoreRepository):
+    """
+    FirestoreRepository over a firestore AsyncClient; get, set, update,
+    delete, query, write_batch and transact_update are awaited.
+    """
+
+    def __init__(self, db):
+        from firebase_admin import firestore_async
+        self.db = db
+        self.bucket = None
+        self._firestore = firestore_async
+
+    async def get(self, path, doc_id, fields=None):
+        ref = self._ref(path, doc_id)
+        doc = await (ref.get(field_paths=fields) if fields else ref.get())
+        return doc.to_dict() if doc.exists else None
+
+    async def set(self, path, doc_id, data, merge=False):
+        await self._ref(path, doc_id).set(self._out(data), merge=merge)
+
+    async def update(self, path, doc_id, data):
+        await self._ref(path, doc_id).update(self._out(data))
+
+    async def delete(self, path, doc_id):
+        await self._ref(path, doc_id).delete()
+
+    async def query(self, path, where=(), order_by=(), start_after=None, limit=None, fields=None):
+        query = self._collection(path)
+        for field, op, value in where:
+            query = query.where(field, op, value)
+        for field, direction in order_by:
+            query = query.order_by(field, direction=(
+                self._firestore.Query.DESCENDING if direction == "desc"
+                else self._firestore.Query.ASCENDING))
+        if fields is not None:
+            query = query.select(fields)
+        if start_after is not None:
+            query = query.start_after(dict(zip((f for f, _ in order_by), start_after)))
+        if limit:
+            query = query.limit(limit)
+        return [(doc.id, doc.to_dict()) async for doc in query.stream()]
+
+    async def write_batch(self, writes):
+        batch, pending = self.db.batch(), 0
+        for op, path, doc_id, data in writes:
+            ref = self._ref(path, doc_id)
+            if op == "delete":
+                batch.delete(ref)
+            else:
+                getattr(batch, op)(ref, self._out(data))
+            pending += 1
+            if pending == BATCH_LIMIT:
+                await batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            await batch.commit()
+
+    async def transact_update(self, path, doc_id, fn):
+        ref = self._ref(path, doc_id)
+
+        @self._firestore.async_transactional
+        async def run(transaction):
+            snapshot = await ref.get(transaction=transaction)
+            updates = fn(snapshot.to_dict() if snapshot.exists else None)
+            if updates is DELETE:
+                transaction.delete(ref)
+            elif updates is not None and snapshot.exists:
+                transaction.update(ref, self._out(updates))
+            elif updates is not None:
+                transaction.set(ref, self._out(updates))
+            return updates
+
+        return await run(self.db.transaction())
+
+
+class AsyncMemoryRepository:
+    """
+    Async face of a MemoryRepository, sharing its data. Every call is
+    in-memory, so the coroutines never actually wait.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    async def get(self, path, doc_id, fields=None):
+        return self.repo.get(path, doc_id, fields)
+
+    async def set(self, path, doc_id, data, merge=False):
+        self.repo.set(path, doc_id, data, merge=merge)
+
+    async def update(self, path, doc_id, data):
+        self.repo.update(path, doc_id, data)
+
+    async def delete(self, path, doc_id):
+        self.repo.delete(path, doc_id)
+
+    async def query(self, path, where=(), order_by=(), start_after=None, limit=None, fields=None):
+        return self.repo.query(path, where, order_by, start_after, limit, fields)
+
+    async def write_batch(self, writes):
+        self.repo.write_batch(writes)
+
+    async def transact_update(self, path, doc_id, fn):
+        return self.repo.transact_update(path, doc_id, fn)
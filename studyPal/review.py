@@ -0,0 +1,200 @@
+"""
+Spaced-repetition review of flashcards.
+
+    python -m studyPal.review backfill [--user USER_ID]
+"""
+import argparse
+import hashlib
+import os
+import time
+from .repository import ID
+from .metrics import REGISTRY
+
+# -------------------------
+# Review scheduling
+# -------------------------
+# Every flashcard has a review record at reviews/<user_id>/cards/<card_id>
+# holding a copy of the card and its SM-2 state:
+#
+#   note_id, question, answer
+#   due:       epoch seconds of the next review
+#   interval:  days until the next review after a correct answer
+#   ease:      SM-2 ease factor (>= 1.3)
+#   reps, lapses
+#
+# The card id hashes the note id and the card's text, so a card keeps its
+# state when a note's flashcards are regenerated and the same card comes
+# back. Records are kept in step with the notes by update_note and
+# delete_note (functions.py).
+#
+# "What is due now" across all of a user's notes is a single range query
+# on `due`, answered in REVIEW_BATCH_CARDS batches with a (due, card_id)
+# cursor; the study page fetches the next batch while the current one is
+# being reviewed. Limiting a session to one note filters on note_id too,
+# which needs a composite (note_id, due) index in Firestore.
+REVIEWS_COLLECTION = "reviews"
+REVIEW_BATCH_CARDS = int(os.getenv("REVIEW_BATCH_CARDS", "20"))
+REVIEW_MAX_BATCH_CARDS = 100  # largest batch a client may ask for
+RELEARN_SECONDS = int(os.getenv("RELEARN_SECONDS", "600"))  # a missed card comes back after this
+DAY_SECONDS = 24 * 60 * 60
+
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+# Answer buttons and the SM-2 quality (0-5) they stand for
+GRADES = {"again": 1, "hard": 3, "good": 4, "easy": 5}
+
+REVIEWS = REGISTRY.counter("studypal_reviews_total", "Flashcard reviews, by grade.", ("grade",))
+
+
+def cards_path(user_id):
+    return f"{REVIEWS_COLLECTION}/{user_id}/cards"
+
+
+def card_id(note_id, card):
+    text = f"{card.get('question', '')}\n{card.get('answer', '')}"
+    return f"{note_id}-{hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]}"
+
+
+def new_card(note_id, card, now):
+    return {
+        "note_id": note_id,
+        "question": card.get("question", ""),
+        "answer": card.get("answer", ""),
+        "due": now,
+        "interval": 0,
+        "ease": INITIAL_EASE,
+        "reps": 0,
+        "lapses": 0,
+    }
+
+
+# -------------------------
+# Keeping records in step with notes
+# -------------------------
+def sync_note_cards(db, user_id, note_id, cards, now=None, new=False, writes=None):
+    """
+    Make a note's review records match its flashcards: new cards are due
+    now, unchanged cards keep their state, removed cards are dropped. A
+    new note has no records to look up; with a `writes` list the writes
+    are added to it instead of being committed.
+    """
+    now = time.time() if now is None else now
+    path = cards_path(user_id)
+    existing = set() if new else {
+        doc_id for doc_id, _ in db.query(path, where=[("note_id", "==", note_id)], fields=[])}
+    wanted = {card_id(note_id, card): card for card in cards}
+    pending = ([("set", path, cid, new_card(note_id, card, now)) for cid, card in wanted.items() if cid not in existing]
+               + [("delete", path, cid, None) for cid in existing if cid not in wanted])
+    if writes is not None:
+        writes.extend(pending)
+    else:
+        db.write_batch(pending)
+
+
+def remove_note_cards(db, user_id, note_id):
+    sync_note_cards(db, user_id, note_id, [])
+
+
+# -------------------------
+# SM-2
+# -------------------------
+def schedule(state, grade, now):
+    """
+    The SM-2 state after answering a card with `grade` (a GRADES key).
+    """
+    quality = GRADES[grade]
+    ease = max(MIN_EASE, state["ease"] + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        # Missed: relearn soon, then start the intervals over
+        return {"ease": ease, "interval": 0, "reps": 0, "lapses": state["lapses"] + 1,
+                "due": now + RELEARN_SECONDS, "reviewed_at": now}
+    reps = state["reps"] + 1
+    if reps == 1:
+        interval = 1
+    elif reps == 2:
+        interval = 6
+    else:
+        interval = round(max(state["interval"], 1) * state["ease"])
+    return {"ease": ease, "interval": interval, "reps": reps, "lapses": state["lapses"],
+            "due": now + interval * DAY_SECONDS, "reviewed_at": now}
+
+
+def record_review(db, user_id, cid, grade, now=None):
+    """
+    Apply a review result; returns the card's new state, or None if the
+    card does not exist (any more).
+    """
+    if grade not in GRADES:
+        raise ValueError(f"Unknown grade {grade!r}")
+    now = time.time() if now is None else now
+
+    def _review(data):
+        return schedule(data, grade, now) if data else None
+
+    updates = db.transact_update(cards_path(user_id), cid, _review)
+    if updates is not None:
+        REVIEWS.inc(grade=grade)
+    return updates
+
+
+def due_cards(db, user_id, limit=None, after=None, note_id=None, now=None):
+    """
+    Cards due for review, earliest first. Returns (cards, cursor); pass the
+    cursor as `after` for the next batch, it is None after the last one.
+    """
+    limit = limit or REVIEW_BATCH_CARDS
+    now = time.time() if now is None else now
+    where = [("due", "<=", now)]
+    if note_id:
+        where.append(("note_id", "==", note_id))
+    docs = db.query(cards_path(user_id), where=where, order_by=[("due", "asc"), (ID, "asc")],
+                    start_after=after, limit=limit,
+                    fields=["note_id", "question", "answer", "due"])
+    cards = [dict(data, card_id=doc_id) for doc_id, data in docs]
+    cursor = [docs[-1][1]["due"], docs[-1][0]] if len(docs) == limit else None
+    return cards, cursor
+
+
+# -------------------------
+# Backfill
+# -------------------------
+def backfill_user(db, user_id):
+    """
+    Create review records for notes whose flashcards predate reviews.
+    Returns the number of notes synced.
+    """
+    from .functions import iter_notes, get_flashcards
+
+    synced = 0
+    for listed in iter_notes(db, user_id, fields=["title"]):
+        sync_note_cards(db, user_id, listed["note_id"], get_flashcards(db, user_id, listed["note_id"]))
+        synced += 1
+    return synced
+
+
+def backfill_all(db, page_size=100):
+    users = synced = 0
+    last_id = None
+    while True:
+        docs = db.query("users", order_by=[(ID, "asc")],
+                        start_after=[last_id] if last_id else None, limit=page_size, fields=[])
+        for user_id, _ in docs:
+            synced += backfill_user(db, user_id)
+            users += 1
+        if len(docs) < page_size:
+            return users, synced
+        last_id = docs[-1][0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--user", help="only backfill this user's notes")
+    args = parser.parse_args()
+
+    from .main import db
+    if args.user:
+        print(f"Synced {backfill_user(db, args.user)} notes.")
+    else:
+        users, synced = backfill_all(db)
+        print(f"Synced {synced} notes of {users} users.")
@@ -0,0 +1,565 @@
+"""
+Full-text search over note titles, summaries and flashcards.
+
+    python -m studyPal.search reindex [--user USER_ID | --stale]
+"""
+import argparse
+import heapq
+import html
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from .repository import ID
+from .cache import note_cache
+from .metrics import stage
+
+logger = logging.getLogger("studypal.search")
+
+# -------------------------
+# Search index
+# -------------------------
+# Each user's notes are indexed into segments of up to SEARCH_SEGMENT_NOTES
+# notes, one document each at search_index/<user_id>/segments/<n>:
+#
+#   note_ids:  [note_id, ...]      a slot per note (None once deleted, reused)
+#   titles:    [title, ...]        so results need no note reads
+#   lengths:   [title, summary, flashcards token counts of slot 0, then
+#               of slot 1, ...] (flat: Firestore has no nested arrays)
+#   postings:  "<field>:<term> slot:tf,slot:tf\n..." one line per term
+#   full:      whether the segment is over SEARCH_SEGMENT_BYTES
+#
+# with field "t" (title), "s" (summary) or "f" (flashcards). Each field is
+# indexed separately, so updating a note's summary only rewrites its
+# summary postings. Postings are a single string rather than a map so a
+# segment stays one field however many terms its notes have (Firestore
+# caps documents at 20,000 fields and 1 MiB); on Firestore, exempt
+# `postings` and `titles` of the segments collection group from
+# single-field indexing, as they are never queried. In memory, postings
+# are decoded into a {"<field>:<term>": "slot:tf,..."} dict.
+#
+# search_index/<user_id> counts the notes per segment, lists the segments
+# that are full and flags the user "stale" when an update failed (see
+# `reindex --stale`); every note records its segment as "search_segment".
+#
+# Searching ranks with BM25 over the weighted fields (BM25F). Segments are
+# cached per process, refreshed after SEARCH_CACHE_SECONDS and updated in
+# place by this process's own writes.
+SEARCH_COLLECTION = "search_index"
+SEARCH_SEGMENT_NOTES = int(os.getenv("SEARCH_SEGMENT_NOTES", "100"))
+# Soft cap: a segment over it takes no new notes, leaving room below the
+# 1 MiB document limit for its notes to grow
+SEARCH_SEGMENT_BYTES = int(os.getenv("SEARCH_SEGMENT_BYTES", str(256 * 1024)))
+SEARCH_CACHE_SECONDS = float(os.getenv("SEARCH_CACHE_SECONDS", "30"))
+SEARCH_CACHE_USERS = int(os.getenv("SEARCH_CACHE_USERS", "256"))
+
+FIELDS = "tsf"
+FIELD_WEIGHTS = {"t": 3.0, "s": 1.0, "f": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+# -------------------------
+# Tokenising
+# -------------------------
+_TAG_RE = re.compile(r"<[^>]*>")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were "
+    "what when which who will with".split())
+# Longest first; a stem keeps at least three characters
+_SUFFIXES = [
+    ("ational", "ate"), ("ization", "ize"), ("fulness", "ful"), ("iveness", "ive"),
+    ("ousness", "ous"), ("tional", "tion"), ("ements", ""), ("ement", ""), ("ments", ""),
+    ("ment", ""), ("ness", ""), ("ingly", ""), ("edly", ""), ("ings", ""), ("ing", ""),
+    ("ies", "y"), ("ied", "y"), ("ers", ""), ("er", ""), ("ed", ""), ("ly", ""),
+    ("es", ""), ("s", ""),
+]
+
+
+def stem(word):
+    """
+    Light suffix-stripping stemmer: enough to match plurals and common
+    inflections ("schedulers", "scheduling" -> "schedul").
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) + len(replacement) >= 3:
+            if suffix == "s" and word.endswith(("ss", "us", "is")):
+                return word
+            return word[:len(word) - len(suffix)] + replacement
+    return word
+
+
+def tokenize(text):
+    """Stemmed terms of a text (HTML tags and stopwords removed)."""
+    text = html.unescape(_TAG_RE.sub(" ", text or "")).lower()
+    return [stem(word) for word in _TOKEN_RE.findall(text) if word not in STOPWORDS]
+
+
+def flashcards_text(cards):
+    return "\n".join(f"{card.get('question', '')} {card.get('answer', '')}" for card in cards or [])
+
+
+# -------------------------
+# Segments
+# -------------------------
+def _segments_path(user_id):
+    return f"{SEARCH_COLLECTION}/{user_id}/segments"
+
+
+def _segment_id(segment):
+    return f"{segment:05d}"
+
+
+def _decode(postings):
+    return [tuple(map(int, pair.split(":"))) for pair in postings.split(",")]
+
+
+def _encode(pairs):
+    return ",".join(f"{slot}:{tf}" for slot, tf in pairs)
+
+
+def _empty_segment():
+    return {"note_ids": [], "titles": [], "lengths": [], "postings": {}}
+
+
+def _load_segment(data):
+    """A stored segment with its postings decoded into a dict."""
+    data = dict(data or _empty_segment())
+    postings = data.get("postings") or {}
+    # Segments written before postings were encoded hold the map itself
+    if isinstance(postings, str):
+        postings = dict(line.split(" ", 1) for line in postings.split("\n"))
+    data["postings"] = dict(postings)
+    return data
+
+
+def _store_segment(data):
+    """A segment as stored, its postings encoded into one string."""
+    return dict(data, postings="\n".join(f"{key} {pairs}" for key, pairs in data["postings"].items()))
+
+
+def _segment_size(data):
+    """Rough stored size of a segment in bytes."""
+    postings = sum(len(key) + len(pairs) + 2 for key, pairs in data["postings"].items())
+    return (postings + sum(len(title or "") for title in data["titles"])
+            + 24 * len(data["note_ids"]) + 8 * len(data["lengths"]))
+
+
+def _drop_postings(postings, slot, fields):
+    for key in list(postings):
+        if key[0] not in fields:
+            continue
+        pairs = [pair for pair in _decode(postings[key]) if pair[0] != slot]
+        if pairs:
+            postings[key] = _encode(pairs)
+        else:
+            del postings[key]
+
+
+def _index_into(segment, note_id, title, texts):
+    """
+    Index a note into a segment dict in place. texts maps field codes to
+    the new text of each field that changed.
+    """
+    if note_id in segment["note_ids"]:
+        slot = segment["note_ids"].index(note_id)
+        _drop_postings(segment["postings"], slot, texts)
+    elif None in segment["note_ids"]:
+        # Slots are emptied of postings when their note is removed
+        slot = segment["note_ids"].index(None)
+        segment["note_ids"][slot], segment["titles"][slot] = note_id, ""
+    else:
+        slot = len(segment["note_ids"])
+        segment["note_ids"].append(note_id)
+        segment["titles"].append("")
+        segment["lengths"] += [0] * len(FIELDS)
+    if title is not None:
+        segment["titles"][slot] = title
+
+    for field, text in texts.items():
+        counts = {}
+        for term in tokenize(text):
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            key = f"{field}:{term}"
+            existing = segment["postings"].get(key)
+            segment["postings"][key] = f"{existing},{slot}:{tf}" if existing else f"{slot}:{tf}"
+        segment["lengths"][slot * len(FIELDS) + FIELDS.index(field)] = sum(counts.values())
+
+
+def _remove_from(segment, note_id):
+    if note_id not in segment["note_ids"]:
+        return False
+    slot = segment["note_ids"].index(note_id)
+    _drop_postings(segment["postings"], slot, FIELDS)
+    segment["note_ids"][slot], segment["titles"][slot] = None, None
+    segment["lengths"][slot * len(FIELDS):(slot + 1) * len(FIELDS)] = [0] * len(FIELDS)
+    return True
+
+
+def allocate_segments(db, user_id, count):
+    """Pick segments with room for `count` more notes of the user, one per note."""
+    chosen = []
+
+    def _allocate(data):
+        counts = list((data or {}).get("segments", []))
+        full = set((data or {}).get("full", []))
+        chosen.clear()
+        for _ in range(count):
+            free = [i for i, used in enumerate(counts) if used < SEARCH_SEGMENT_NOTES and i not in full]
+            segment = free[0] if free else len(counts)
+            if segment == len(counts):
+                counts.append(0)
+            counts[segment] += 1
+            chosen.append(segment)
+        return {"segments": counts}
+
+    db.transact_update(SEARCH_COLLECTION, user_id, _allocate)
+    return chosen
+
+
+def allocate_segment(db, user_id):
+    """Pick a segment with room for one more note of the user."""
+    return allocate_segments(db, user_id, 1)[0]
+
+
+def _release_segment(db, user_id, segment):
+    def _release(data):
+        counts = list((data or {}).get("segments", []))
+        if segment >= len(counts) or counts[segment] <= 0:
+            return None
+        counts[segment] -= 1
+        return {"segments": counts}
+
+    db.transact_update(SEARCH_COLLECTION, user_id, _release)
+
+
+def _mark_full(db, user_id, segment, full):
+    def _mark(data):
+        marked = set((data or {}).get("full", []))
+        if (segment in marked) == full:
+            return None
+        return {"full": sorted(marked | {segment} if full else marked - {segment})}
+
+    db.transact_update(SEARCH_COLLECTION, user_id, _mark)
+
+
+def _update_segment(db, user_id, segment, change):
+    """
+    Apply change(segment dict) atomically and refresh the local cache. A
+    segment crossing SEARCH_SEGMENT_BYTES either way is (un)marked full.
+    """
+    result = []
+
+    def _apply(stored):
+        data = _load_segment(stored)
+        if change(data) is False:
+            return None
+        was_full, data["full"] = bool(data.get("full")), _segment_size(data) > SEARCH_SEGMENT_BYTES
+        result[:] = [data, was_full]
+        return _store_segment(data)
+
+    db.transact_update(_segments_path(user_id), _segment_id(segment), _apply)
+    if result:
+        data, was_full = result
+        _cache.replace(user_id, segment, data)
+        if data["full"] != was_full:
+            _mark_full(db, user_id, segment, data["full"])
+
+
+# -------------------------
+# Index updates
+# -------------------------
+def _mark_stale(db, user_id):
+    try:
+        db.transact_update(SEARCH_COLLECTION, user_id, lambda data: {"stale": True})
+    except Exception:
+        logger.exception("Could not flag the search index of user %s for a rebuild", user_id)
+
+
+def index_note(db, note_id, note_data, title=None, summary=None, flashcards=None):
+    """
+    Update the search index for a note whose title, summary (HTML) and/or
+    flashcards changed; note_data is the note's metadata. Returns fields to
+    store on the note (its segment, when it is indexed for the first time).
+    """
+    user_id = note_data.get("user_id")
+    if not user_id:
+        return {}
+    fields = {}
+    try:
+        segment = note_data.get("search_segment")
+        if segment is None:
+            segment = fields["search_segment"] = allocate_segment(db, user_id)
+            title = note_data.get("title") if title is None else title
+        texts = {}
+        if title is not None:
+            texts["t"] = title
+        if summary is not None:
+            texts["s"] = summary
+        if flashcards is not None:
+            texts["f"] = flashcards_text(flashcards)
+        if texts:
+            with stage("search.index"):
+                _update_segment(db, user_id, segment, lambda data: _index_into(data, note_id, title, texts))
+    except Exception:
+        # Search is secondary: flag the user for `reindex --stale` to repair
+        logger.exception("Search index not updated for note %s", note_id)
+        _mark_stale(db, user_id)
+    return fields
+
+
+def index_notes(db, user_id, notes):
+    """
+    Index many new notes of a user at once: one transaction to allocate
+    their segments and one per segment they land in. notes is a list of
+    (note_id, title, summary, flashcards); returns {note_id: fields}.
+    """
+    fields = {}
+    try:
+        segments = allocate_segments(db, user_id, len(notes))
+        grouped = {}
+        for segment, note in zip(segments, notes):
+            grouped.setdefault(segment, []).append(note)
+            fields[note[0]] = {"search_segment": segment}
+
+        def _index_all(data, batch):
+            for note_id, title, summary, flashcards in batch:
+                texts = {"t": title or "", "s": summary or "", "f": flashcards_text(flashcards or [])}
+                _index_into(data, note_id, texts["t"], texts)
+
+        with stage("search.index"):
+            for segment, batch in grouped.items():
+                _update_segment(db, user_id, segment, lambda data, batch=batch: _index_all(data, batch))
+    except Exception:
+        logger.exception("Search index not updated for %s notes", len(notes))
+        _mark_stale(db, user_id)
+    return fields
+
+
+def unindex_note(db, note_id, note_data):
+    """Remove a deleted note from its user's search index."""
+    segment = note_data.get("search_segment")
+    if segment is None or not note_data.get("user_id"):
+        return
+    try:
+        _update_segment(db, note_data["user_id"], segment, lambda data: _remove_from(data, note_id))
+        _release_segment(db, note_data["user_id"], segment)
+    except Exception:
+        logger.exception("Search index not updated for note %s", note_id)
+        _mark_stale(db, note_data["user_id"])
+
+
+# -------------------------
+# Searching
+# -------------------------
+class UserIndex:
+    """
+    A user's loaded segments, with postings decoded and note lengths
+    weighted on first use. Other modules keep values derived from it in
+    `derived` (whole index) or `per_segment` (name -> {segment: value});
+    the latter survive updates to other segments.
+    """
+
+    def __init__(self, segments, previous=None, changed=None):
+        self.segments = segments  # segment number -> segment dict
+        self._postings = {}
+        self._lengths = None
+        self.derived = {}
+        self.per_segment = {}
+        if previous is not None:
+            self.per_segment = {name: {segment: value for segment, value in values.items() if segment != changed}
+                                for name, values in previous.per_segment.items()}
+
+    def locate(self, note_id):
+        """(segment, slot) of a note, or None if it is not indexed."""
+        for segment, data in self.segments.items():
+            if note_id in data["note_ids"]:
+                return segment, data["note_ids"].index(note_id)
+        return None
+
+    def postings(self, segment, key):
+        found = self._postings.get((segment, key))
+        if found is None:
+            raw = self.segments[segment]["postings"].get(key)
+            found = self._postings[(segment, key)] = _decode(raw) if raw else []
+        return found
+
+    def lengths(self):
+        """{(segment, slot): weighted length} of the live notes."""
+        if self._lengths is None:
+            weights = [FIELD_WEIGHTS[field] for field in FIELDS]
+            self._lengths = {}
+            for segment, data in self.segments.items():
+                lengths = data["lengths"]
+                for slot, note_id in enumerate(data["note_ids"]):
+                    if note_id is not None:
+                        start = slot * len(FIELDS)
+                        self._lengths[(segment, slot)] = sum(
+                            w * n for w, n in zip(weights, lengths[start:start + len(FIELDS)]))
+        return self._lengths
+
+
+class _SegmentCache:
+    """Per-user indexes, least recently used users evicted first."""
+
+    def __init__(self, max_users=SEARCH_CACHE_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> (loaded_at, UserIndex)
+        self._lock = threading.Lock()
+
+    def get(self, db, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry and time.monotonic() - entry[0] < SEARCH_CACHE_SECONDS:
+                self._users.move_to_end(user_id)
+                return entry[1]
+        docs = db.query(_segments_path(user_id))
+        index = UserIndex({int(doc_id): _load_segment(data) for doc_id, data in docs})
+        with self._lock:
+            self._users[user_id] = (time.monotonic(), index)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return index
+
+    def replace(self, user_id, segment, data):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry:
+                segments = dict(entry[1].segments)
+                segments[segment] = data
+                self._users[user_id] = (entry[0], UserIndex(segments, entry[1], segment))
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+_cache = _SegmentCache()
+
+
+def load_index(db, user_id):
+    """A user's search index, from the process cache when fresh."""
+    return _cache.get(db, user_id)
+
+
+def search_notes(db, user_id, query, limit=20):
+    """
+    Rank a user's notes for a query. Returns [{"note_id", "title",
+    "score"}], best first, reading only the user's index segments.
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+    with stage("search.query"):
+        index = load_index(db, user_id)
+        lengths = index.lengths()
+        if not lengths:
+            return []
+        average_length = sum(lengths.values()) / len(lengths) or 1.0
+
+        scores = {}
+        for term in terms:
+            # Weighted term frequency per matching (segment, slot)
+            found = {}
+            for segment in index.segments:
+                for field in FIELDS:
+                    weight = FIELD_WEIGHTS[field]
+                    for slot, tf in index.postings(segment, f"{field}:{term}"):
+                        key = (segment, slot)
+                        found[key] = found.get(key, 0.0) + weight * tf
+            idf = math.log(1 + (len(lengths) - len(found) + 0.5) / (len(found) + 0.5))
+            for key, tf in found.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[key] / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [{
+            "note_id": index.segments[segment]["note_ids"][slot],
+            "title": index.segments[segment]["titles"][slot],
+            "score": round(score, 4),
+        } for (segment, slot), score in best]
+
+
+# -------------------------
+# Rebuilding
+# -------------------------
+def reindex_user(db, user_id):
+    """
+    Rebuild a user's index from their notes (for notes saved before search
+    existed, or after a failed update). Returns the number of notes indexed.
+    """
+    from .functions import iter_notes, get_note, get_flashcards
+
+    segments = {}
+    counts = []
+    updates = []
+    for listed in iter_notes(db, user_id, fields=["title"]):
+        note_id = listed["note_id"]
+        note = get_note(db, note_id, summary=True)
+        # Fill segments in turn, each up to the note count or size cap
+        if not counts or counts[-1] >= SEARCH_SEGMENT_NOTES or segments[len(counts) - 1]["full"]:
+            segments[len(counts)] = dict(_empty_segment(), full=False)
+            counts.append(0)
+        segment = len(counts) - 1
+        counts[segment] += 1
+        texts = {"t": note.get("title") or "", "s": note.get("summary_text") or "",
+                 "f": flashcards_text(get_flashcards(db, user_id, note_id))}
+        _index_into(segments[segment], note_id, texts["t"], texts)
+        segments[segment]["full"] = _segment_size(segments[segment]) > SEARCH_SEGMENT_BYTES
+        updates.append(("update", "notes", note_id, {"search_segment": segment}))
+
+    new_ids = {_segment_id(i) for i in segments}
+    old = db.query(_segments_path(user_id), fields=[])
+    full = [i for i, data in segments.items() if data["full"]]
+    db.write_batch(
+        [("delete", _segments_path(user_id), doc_id, None) for doc_id, _ in old if doc_id not in new_ids]
+        + [("set", _segments_path(user_id), _segment_id(i), _store_segment(data)) for i, data in segments.items()]
+        + [("set", SEARCH_COLLECTION, user_id, {"segments": counts, "full": full, "stale": False})]
+        + updates
+    )
+    _cache.clear()
+    for _, _, note_id, _ in updates:
+        note_cache.invalidate(note_id)
+    return len(updates)
+
+
+def reindex_all(db, page_size=100, stale=False):
+    """
+    Rebuild every user's index, or with `stale` only those flagged after
+    a failed update. Returns (users, notes indexed).
+    """
+    users = indexed = 0
+    last_id = None
+    path, where = (SEARCH_COLLECTION, [("stale", "==", True)]) if stale else ("users", [])
+    while True:
+        docs = db.query(path, where=where, order_by=[(ID, "asc")],
+                        start_after=[last_id] if last_id else None, limit=page_size, fields=[])
+        for user_id, _ in docs:
+            indexed += reindex_user(db, user_id)
+            users += 1
+        if len(docs) < page_size:
+            return users, indexed
+        last_id = docs[-1][0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["reindex"])
+    parser.add_argument("--user", help="only rebuild this user's index")
+    parser.add_argument("--stale", action="store_true", help="only rebuild indexes whose updates failed")
+    args = parser.parse_args()
+
+    from .main import db
+    if args.user:
+        print(f"Indexed {reindex_user(db, args.user)} notes.")
+    else:
+        users, indexed = reindex_all(db, stale=args.stale)
+        print(f"Indexed {indexed} notes of {users} users.")
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+from .ratelimit import OPENAI_MAX_CONCURRENCY
+
+# -------------------------
+# Service clients
+# -------------------------
+# The repository (Firestore + Storage) and the OpenAI client are created
+# on first use rather than at import, so starting a worker or importing the
+# app for tests does not parse credentials, open connections or import the
+# heavy SDKs. Each is created once per process and shared by all threads;
+# the underlying clients pool their connections. The ASGI app (asgi.py)
+# adds async twins of both, created on its event loop.
+STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "studypal-93412.firebasestorage.app")
+# Enough for every job and chunk worker to hold a connection at once
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
+# Every async call goes through the rate limiter, which lets at most
+# OPENAI_MAX_CONCURRENCY run at once, so more connections would sit idle;
+# calls beyond that wait in the limiter's priority line rather than in
+# httpx's first-come pool queue, where they could hit its pool timeout
+OPENAI_ASYNC_MAX_CONNECTIONS = int(os.getenv("OPENAI_ASYNC_MAX_CONNECTIONS", str(OPENAI_MAX_CONCURRENCY)))
+
+
+class LazyService:
+    """
+    Stand-in for a client that is built by `factory` the first time any
+    attribute is used. Its own names are underscored so they never shadow
+    the client's.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+def _firebase_credentials():
+    from firebase_admin import credentials
+
+    json_str = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
+    if json_str:
+        # Load from GitHub Secret / env var
+        return credentials.Certificate(json.loads(json_str))
+    if os.path.exists("adminKey.json"):
+        # Local fallback (optional)
+        return credentials.Certificate("adminKey.json")
+    raise RuntimeError(
+        "Service account credentials not set. "
+        "Set GOOGLE_APPLICATION_CREDENTIALS_JSON or provide adminKey.json."
+    )
+
+
+def make_repository(backend=None):
+    """
+    STORAGE_BACKEND=memory keeps everything in-process (benchmarks, local
+    development); the default is Firebase.
+    """
+    from .metrics import InstrumentedRepository
+    from .repository import FirestoreRepository, MemoryRepository
+
+    if (backend or os.getenv("STORAGE_BACKEND", "firestore")) == "memory":
+        repo = MemoryRepository()
+    else:
+        import firebase_admin
+        from firebase_admin import firestore, storage
+
+        firebase_admin.initialize_app(_firebase_credentials())
+        repo = FirestoreRepository(firestore.client(), storage.bucket(STORAGE_BUCKET))
+
+    # Time every Firestore/Storage call for /metrics
+    return InstrumentedRepository(repo)
+
+
+def make_async_repository(repo):
+    """
+    Async repository over the same data as `repo` (a make_repository
+    result): the same MemoryRepository, or a Firestore AsyncClient of the
+    default Firebase app.
+    """
+    from .metrics import AsyncInstrumentedRepository
+    from .repository import AsyncFirestoreRepository, AsyncMemoryRepository, MemoryRepository
+
+    base = repo.repo  # unwrap the InstrumentedRepository
+    if isinstance(base, MemoryRepository):
+        return AsyncInstrumentedRepository(AsyncMemoryRepository(base))
+    from firebase_admin import firestore_async
+
+    # `repo` has already initialised the Firebase app
+    return AsyncInstrumentedRepository(AsyncFirestoreRepository(firestore_async.client()))
+
+
+def make_openai_client():
+    import httpx
+    from openai import OpenAI
+
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=OPENAI_TIMEOUT,
+        # Retries and backoff are left to the rate limiter (ratelimit.py)
+        max_retries=0,
+        http_client=httpx.Client(limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        )),
+    )
+
+
+def make_async_openai_client():
+    import httpx
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=OPENAI_TIMEOUT,
+        max_retries=0,
+        http_client=httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=OPENAI_ASYNC_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_ASYNC_MAX_CONNECTIONS,
+        )),
+    )
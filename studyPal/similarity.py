@@ -0,0 +1,155 @@
+import os
+import re
+import zlib
+from .search import FIELD_WEIGHTS, load_index, _decode
+from .metrics import stage
+
+# -------------------------
+# Similarity engine
+# -------------------------
+# Texts are compared as hashed feature vectors in NumPy arrays, entirely
+# offline (no embedding API):
+#   - flashcards: character trigram counts, so rephrasings and typos of
+#     the same card still match. Near-duplicates from overlapping chunks
+#     are dropped before a note's cards are written.
+#   - notes: TF-IDF over the stemmed terms already in the user's search
+#     index (search.py), with the same field weights. Related notes are a
+#     matrix product against all of the user's notes at once.
+# Each search segment's term block is kept with the cached index and only
+# rebuilt when that segment changes; the normalised matrix is rebuilt
+# from the blocks when any of them does. numpy is imported on first use.
+SIMILARITY_DIM = int(os.getenv("SIMILARITY_DIM", "2048"))  # hashed features per vector
+FLASHCARD_DUPLICATE_SIMILARITY = float(os.getenv("FLASHCARD_DUPLICATE_SIMILARITY", "0.85"))
+RELATED_NOTES = int(os.getenv("RELATED_NOTES", "5"))
+RELATED_MIN_SIMILARITY = 0.05
+
+_NORMALISE_RE = re.compile(r"[^a-z0-9]+")
+
+
+def _bucket(feature):
+    # crc32 rather than hash(): stable across processes and runs
+    return zlib.crc32(feature.encode("utf-8")) % SIMILARITY_DIM
+
+
+def _normalise_rows(matrix):
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+# -------------------------
+# Flashcards
+# -------------------------
+def trigram_vectors(texts):
+    """Unit-length hashed character trigram vectors, one row per text."""
+    import numpy as np
+
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        padded = f" {_NORMALISE_RE.sub(' ', text.lower()).strip()} "
+        for i in range(len(padded) - 2):
+            rows.append(row)
+            cols.append(_bucket(padded[i:i + 3]))
+    matrix = np.zeros((len(texts), SIMILARITY_DIM), dtype=np.float32)
+    np.add.at(matrix, (rows, cols), 1.0)
+    return _normalise_rows(matrix)
+
+
+def dedupe_flashcards(cards, threshold=None):
+    """
+    Drop cards whose question and answer are a near-duplicate (cosine
+    similarity >= threshold) of an earlier card. Order is kept.
+    """
+    threshold = FLASHCARD_DUPLICATE_SIMILARITY if threshold is None else threshold
+    if len(cards) < 2:
+        return list(cards)
+    with stage("similarity.flashcards"):
+        vectors = trigram_vectors([f"{c.get('question', '')} {c.get('answer', '')}" for c in cards])
+        similarity = vectors @ vectors.T
+        kept = []
+        for i in range(len(cards)):
+            if not kept or similarity[i, kept].max() < threshold:
+                kept.append(i)
+    return [cards[i] for i in kept]
+
+
+# -------------------------
+# Related notes
+# -------------------------
+def _segment_block(data):
+    """Weighted term counts of one search segment, one row per slot."""
+    import numpy as np
+
+    rows, cols, values = [], [], []
+    for key, postings in data["postings"].items():
+        field, term = key.split(":", 1)
+        column, weight = _bucket(term), FIELD_WEIGHTS[field]
+        for slot, tf in _decode(postings):
+            rows.append(slot)
+            cols.append(column)
+            values.append(weight * tf)
+    block = np.zeros((len(data["note_ids"]), SIMILARITY_DIM), dtype=np.float32)
+    np.add.at(block, (rows, cols), values)
+    return block
+
+
+def note_matrix(index):
+    """
+    (unit TF-IDF rows, [(segment, slot)], {note_id: row}) for a user's
+    index, built from cached per-segment blocks.
+    """
+    import numpy as np
+
+    if "similarity" in index.derived:
+        return index.derived["similarity"]
+    blocks = index.per_segment.setdefault("similarity", {})
+    keys, parts = [], []
+    for segment in sorted(index.segments):
+        if segment not in blocks:
+            blocks[segment] = _segment_block(index.segments[segment])
+        parts.append(blocks[segment])
+        keys += [(segment, slot) for slot in range(len(blocks[segment]))]
+    counts = np.vstack(parts) if parts else np.zeros((0, SIMILARITY_DIM), dtype=np.float32)
+
+    live = counts.any(axis=1)
+    document_frequency = (counts[live] > 0).sum(axis=0)
+    idf = np.log((1 + live.sum()) / (1 + document_frequency)) + 1
+    matrix = _normalise_rows(np.log1p(counts) * idf.astype(np.float32))
+    rows = {index.segments[segment]["note_ids"][slot]: row
+            for row, (segment, slot) in enumerate(keys) if index.segments[segment]["note_ids"][slot]}
+    index.derived["similarity"] = matrix, keys, rows
+    return index.derived["similarity"]
+
+
+def related_notes(db, user_id, note_ids, limit=None):
+    """
+    The notes most similar to each of note_ids, as {note_id: [{"note_id",
+    "title", "score"}]}, computed for all of them in one matrix product.
+    """
+    import numpy as np
+
+    limit = limit or RELATED_NOTES
+    with stage("similarity.related"):
+        index = load_index(db, user_id)
+        matrix, keys, rows = note_matrix(index)
+        wanted = [note_id for note_id in note_ids if note_id in rows]
+        results = {note_id: [] for note_id in note_ids}
+        if not wanted:
+            return results
+
+        scores = matrix[[rows[note_id] for note_id in wanted]] @ matrix.T
+        for note_id, row_scores in zip(wanted, scores):
+            row_scores[rows[note_id]] = -1  # not related to itself
+            count = min(limit, len(row_scores))
+            top = np.argpartition(-row_scores, count - 1)[:count]
+            for row in top[np.argsort(-row_scores[top])]:
+                if row_scores[row] < RELATED_MIN_SIMILARITY:
+                    break
+                segment, slot = keys[row]
+                results[note_id].append({
+                    "note_id": index.segments[segment]["note_ids"][slot],
+                    "title": index.segments[segment]["titles"][slot],
+                    "score": round(float(row_scores[row]), 4),
+                })
+    return results
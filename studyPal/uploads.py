@@ -0,0 +1,272 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+from .repository import DELETE, SERVER_TIMESTAMP
+from .metrics import REGISTRY
+
+logger = logging.getLogger("studypal.uploads")
+
+# -------------------------
+# Deduplicated uploads
+# -------------------------
+# Uploaded files are stored once per content, keyed by the SHA-256 of their
+# bytes. Alongside the blob, the first job that processes the file saves
+# the extracted page texts (uploads/<hash>.pages.json) so later uploads of
+# the same file skip download and extraction; chunking the same pages
+# again gives the same chunks, whose summaries and flashcards come
+# straight from the LLM cache.
+#
+# An "uploads/<hash>" record counts the notes using the file. Deleting a
+# note releases its reference; the last one deletes the record in the same
+# transaction and then the blobs it named, so an upload of the file racing
+# with it records the file afresh rather than reusing a blob being deleted.
+#
+# The request body is never held whole: the form parser writes the file
+# into a StreamingUpload, which hashes it and passes it on to a resumable
+# Storage upload in UPLOAD_CHUNK_BYTES pieces. The job is queued only once
+# Storage holds the whole file. Files up to UPLOAD_INLINE_BYTES are also
+# kept in memory and handed to the job, which then skips downloading them;
+# bigger ones are downloaded by the job. Files are never made public;
+# downloads get a signed URL.
+UPLOADS_COLLECTION = "uploads"
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024)))  # multiple of 256 KiB
+UPLOAD_INLINE_BYTES = int(os.getenv("UPLOAD_INLINE_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_QUEUE_CHUNKS = 2
+UPLOAD_IDLE_TIMEOUT = 60  # seconds without data before an upload is abandoned
+SIGNED_URL_SECONDS = int(os.getenv("SIGNED_URL_SECONDS", "600"))
+
+UPLOADS = REGISTRY.counter(
+    "studypal_uploads_total", "Uploaded documents, new or duplicates of a stored file.", ("result",))
+
+
+def new_blob_path(extension):
+    return f"uploads/{uuid.uuid4().hex}.{extension}"
+
+
+def pages_path(digest):
+    return f"uploads/{digest}.pages.json"
+
+
+def acquire_upload(db, digest, extension, size, content_type=None, blob_path=None):
+    """
+    Add a reference to the stored file with this hash, recording it (at
+    blob_path) if it is new. Returns (blob_path, new); when the file is
+    known the stored blob's path is returned instead.
+    """
+    record = {}
+
+    def _acquire(data):
+        record.clear()
+        # A record without references is left over: store the file again
+        if data and data.get("refs", 0) > 0:
+            record.update(data)
+            return {"refs": data["refs"] + 1}
+        record.update({
+            "hash": digest,
+            "blob_path": blob_path or new_blob_path(extension),
+            "extension": extension,
+            "content_type": content_type,
+            "size": size,
+            "refs": 1,
+            "createdAt": SERVER_TIMESTAMP,
+        })
+        return dict(record)
+
+    updates = db.transact_update(UPLOADS_COLLECTION, digest, _acquire)
+    new = updates.get("refs") == 1
+    UPLOADS.inc(result="new" if new else "duplicate")
+    return record["blob_path"], new
+
+
+def release_upload(db, digest):
+    """
+    Drop a note's reference to a stored file, deleting the file and its
+    extracted pages once no note uses it.
+    """
+    record = {}
+
+    def _release(data):
+        record.clear()
+        if not data or data.get("refs", 0) <= 0:
+            return None
+        record.update(data)
+        return DELETE if data["refs"] == 1 else {"refs": data["refs"] - 1}
+
+    if db.transact_update(UPLOADS_COLLECTION, digest, _release) is not DELETE:
+        return False
+    # Only the blob of the deleted record: a new upload gets a new blob_path
+    db.delete_blob(record["blob_path"])
+    db.delete_blob(pages_path(digest))
+    return True
+
+
+def load_pages(db, digest):
+    """
+    Page texts extracted from the stored file by an earlier job, or None.
+    """
+    if not db.blob_exists(pages_path(digest)):
+        return None
+    return json.loads(db.get_blob(pages_path(digest)))
+
+
+def save_pages(db, digest, pages):
+    db.put_blob(pages_path(digest), json.dumps(pages), content_type="application/json")
+
+
+# -------------------------
+# Streaming uploads
+# -------------------------
+class StreamingUpload(io.RawIOBase):
+    """
+    File object for the form parser to write an uploaded file into. What
+    is written is hashed and sent to Storage at `blob_path` by a
+    background thread; at most UPLOAD_QUEUE_CHUNKS pieces wait for it.
+    The parser rewinds the file once the body is complete, which ends the
+    upload; wait() then blocks until Storage has all of it. Unless keep()
+    is called, closing the file removes the blob again.
+    """
+
+    def __init__(self, db, blob_path, content_type=None):
+        super().__init__()
+        self.db = db
+        self.blob_path = blob_path
+        self.content_type = content_type
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._pending = bytearray()
+        self._kept = io.BytesIO()  # None once the file outgrows UPLOAD_INLINE_BYTES
+        self._queue = queue.Queue(maxsize=UPLOAD_QUEUE_CHUNKS)
+        self._ended = False
+        self._cancelled = False
+        self._kept_blob = False
+        self._stored = False
+        self._lock = threading.Lock()
+        self._error = None
+        self._thread = threading.Thread(target=self._upload, name="studypal-upload", daemon=True)
+        self._thread.start()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    @property
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        if self._kept is not None and self.size <= UPLOAD_INLINE_BYTES:
+            self._kept.write(data)
+        else:
+            self._kept = None
+        self._pending += data
+        while len(self._pending) >= UPLOAD_CHUNK_BYTES:
+            self._put(bytes(self._pending[:UPLOAD_CHUNK_BYTES]))
+            del self._pending[:UPLOAD_CHUNK_BYTES]
+        return len(data)
+
+    def _put(self, item):
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def end(self):
+        """Mark the body complete; the hash and size are final."""
+        if self._ended:
+            return
+        self._ended = True
+        if self._pending:
+            self._put(bytes(self._pending))
+            self._pending = bytearray()
+        self._put(None)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        try:
+            self.end()
+        except Exception:
+            pass  # the failed upload is reported by wait()
+        return self._kept.seek(offset, whence) if self._kept is not None else 0
+
+    def read(self, size=-1):
+        if self._kept is None:
+            raise io.UnsupportedOperation("upload too large to keep in memory")
+        return self._kept.read(size)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def getvalue(self):
+        """The whole file if it was small enough to keep, else None."""
+        return self._kept.getvalue() if self._kept is not None else None
+
+    def keep(self):
+        """The blob is in use (recorded by acquire_upload): keep it on close."""
+        self._kept_blob = True
+
+    def cancel(self):
+        """Stop uploading and remove whatever was stored."""
+        with self._lock:
+            self._cancelled = True
+            stored = self._stored
+        if stored:
+            # The upload had already finished
+            self.db.delete_blob(self.blob_path)
+        try:
+            self.end()
+        except Exception:
+            pass
+
+    def wait(self):
+        self.end()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        # A blob nothing refers to (parse error, rejected form, duplicate)
+        # must not be left behind
+        if not self.closed and not self._kept_blob and not self._cancelled:
+            self.cancel()
+            # Cancelled pieces are skipped, so this is quick
+            self._thread.join()
+        super().close()
+
+    def _upload(self):
+        try:
+            writer = self.db.open_blob_writer(self.blob_path, self.content_type, chunk_size=UPLOAD_CHUNK_BYTES)
+            while True:
+                try:
+                    piece = self._queue.get(timeout=UPLOAD_IDLE_TIMEOUT)
+                except queue.Empty:
+                    raise TimeoutError("upload body stalled") from None
+                if piece is None:
+                    break
+                if not self._cancelled:
+                    writer.write(piece)
+            writer.close()
+            with self._lock:
+                self._stored = True
+                cancelled = self._cancelled
+            if cancelled:
+                self.db.delete_blob(self.blob_path)
+        except Exception as e:
+            self._error = e
+            logger.warning("Upload of %s failed: %s", self.blob_path, e)
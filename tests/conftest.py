@@ -1,3 +1,5 @@
+import datetime
+import io
 import json
 import os
 import sys
@@ -9,6 +11,11 @@ ROOT = os.path.dirname(os.path.dirname(__file__))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
+# Shared across fakes: modules imported once keep the first fake firestore
+SERVER_TIMESTAMP = object()
+DELETE_FIELD = object()
+
+
 def _make_fake_firebase():
     """Build a fake firebase_admin package with credentials, firestore, storage"""
     fa = types.ModuleType("firebase_admin")
@@ -30,6 +37,19 @@ def _make_fake_firebase():
     creds_mod.Certificate = Certificate
 
     # firestore submodule
+
+    def _resolve(data):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return {k: (now if v is SERVER_TIMESTAMP else v) for k, v in data.items()}
+
+    def _apply(doc, data):
+        for k, v in _resolve(data).items():
+            if v is DELETE_FIELD:
+                doc.pop(k, None)
+            else:
+                doc[k] = v
+        return doc
+
     class FakeDoc:
         def __init__(self, data, id_="doc1", exists=True):
             self._data = data
@@ -39,65 +59,188 @@ def _make_fake_firebase():
             return dict(self._data)
 
     class FakeDocRef:
-        def __init__(self, store, id_):
+        def __init__(self, store, id_, root=None, path=""):
             self._store = store
             self._id = id_
-        def get(self):
-            return self._store.get(self._id, FakeDoc({}, self._id, exists=False))
+            self._root = root
+            self._path = f"{path}/{id_}"
+        @property
+        def id(self):
+            return self._id
+        def collection(self, name):
+            path = f"{self._path}/{name}"
+            return FakeCollection(self._root.setdefault(path, {}), self._root, path)
+        def get(self, transaction=None, field_paths=None):
+            doc = self._store.get(self._id, FakeDoc({}, self._id, exists=False))
+            if field_paths is None or not doc.exists:
+                return doc
+            return FakeDoc({k: v for k, v in doc.to_dict().items() if k in field_paths}, self._id)
+        def set(self, data, merge=False):
+            d = self._store[self._id].to_dict() if merge and self._id in self._store else {}
+            self._store[self._id] = FakeDoc(_apply(d, data), self._id, exists=True)
         def update(self, data):
             # simulate a doc existing to update
             if self._id not in self._store:
                 self._store[self._id] = FakeDoc({}, self._id, exists=True)
             d = self._store[self._id].to_dict()
-            d.update(data)
-            self._store[self._id] = FakeDoc(d, self._id, exists=True)
+            self._store[self._id] = FakeDoc(_apply(d, data), self._id, exists=True)
+        def delete(self):
+            self._store.pop(self._id, None)
+
+    _OPS = {
+        "==": lambda a, b: a == b,
+        "<": lambda a, b: a is not None and a < b,
+        "<=": lambda a, b: a is not None and a <= b,
+        ">": lambda a, b: a is not None and a > b,
+        ">=": lambda a, b: a is not None and a >= b,
+        "in": lambda a, b: a in b,
+    }
+
+    def _field(doc, name):
+        return doc.id if name == "__name__" else doc.to_dict().get(name)
 
     class FakeQuery:
-        def __init__(self, docs):
+        def __init__(self, docs, orders=(), fields=None):
             self._docs = docs
+            self._orders = list(orders)
+            self._fields = fields
+        def _with(self, docs, orders=None):
+            orders = self._orders if orders is None else orders
+            return FakeQuery(docs, orders, self._fields)
+        def where(self, field, op, value):
+            return self._with([d for d in self._docs if _OPS[op](_field(d, field), value)])
+        def order_by(self, field, direction="ASCENDING"):
+            orders = self._orders + [(field, direction)]
+            docs = list(self._docs)
+            for name, dir_ in reversed(orders):
+                docs.sort(key=lambda d: _field(d, name), reverse=dir_ == "DESCENDING")
+            return self._with(docs, orders)
+        def start_after(self, values):
+            def after(doc):
+                for name, dir_ in self._orders:
+                    a, b = _field(doc, name), values[name]
+                    if a != b:
+                        return a < b if dir_ == "DESCENDING" else a > b
+                return False
+            return self._with([d for d in self._docs if after(d)])
+        def select(self, fields):
+            return FakeQuery(self._docs, self._orders, list(fields))
+        def limit(self, n):
+            return self._with(self._docs[:n])
         def stream(self):
-            return self._docs
+            if self._fields is None:
+                return self._docs
+            return [FakeDoc({k: v for k, v in d.to_dict().items() if k in self._fields}, d.id)
+                    for d in self._docs]
+        def get(self):
+            return list(self.stream())
 
     class FakeCollection:
-        def __init__(self, notes_store):
+        def __init__(self, notes_store, root=None, path=""):
             self._notes_store = notes_store
-        def where(self, *_, **__):
-            # return all docs for simplicity
+            self._root = root if root is not None else {}
+            self._path = path
+        def _query(self):
             return FakeQuery(list(self._notes_store.values()))
+        def where(self, *args, **kwargs):
+            return self._query().where(*args, **kwargs)
+        def order_by(self, *args, **kwargs):
+            return self._query().order_by(*args, **kwargs)
+        def select(self, fields):
+            return self._query().select(fields)
+        def limit(self, n):
+            return self._query().limit(n)
+        def stream(self):
+            return list(self._notes_store.values())
         def document(self, id_):
-            return FakeDocRef(self._notes_store, id_)
+            return FakeDocRef(self._notes_store, id_, self._root, self._path)
         def add(self, data):
             new_id = f"note_{len(self._notes_store)+1}"
             self._notes_store[new_id] = FakeDoc(data, new_id, exists=True)
             return (self._notes_store[new_id], None)
 
+    class FakeBatch:
+        def __init__(self):
+            self._writes = []
+            self.commits = 0
+        def set(self, ref, data, merge=False):
+            self._writes.append(lambda: ref.set(data, merge=merge))
+        def update(self, ref, data):
+            self._writes.append(lambda: ref.update(data))
+        def delete(self, ref):
+            self._writes.append(ref.delete)
+        def commit(self):
+            for write in self._writes:
+                write()
+            self._writes = []
+            self.commits += 1
+
+    class FakeTransaction:
+        def set(self, ref, data, merge=False):
+            ref.set(data, merge=merge)
+        def update(self, ref, data):
+            ref.update(data)
+        def delete(self, ref):
+            ref.delete()
+
+    def transactional(fn):
+        def wrapper(transaction, *args, **kwargs):
+            return fn(transaction, *args, **kwargs)
+        return wrapper
+
     class FakeFirestoreClient:
         def __init__(self):
             self._notes = {"n1": FakeDoc({"user_id": "u1", "text": "hello"}, "n1")}
+            self._collections = {"notes": self._notes}
         def collection(self, name):
-            if name == "notes":
-                return FakeCollection(self._notes)
-            raise KeyError(name)
+            return FakeCollection(self._collections.setdefault(name, {}), self._collections, name)
+        def transaction(self):
+            return FakeTransaction()
+        def batch(self):
+            return FakeBatch()
 
     def firestore_client():
         return FakeFirestoreClient()
 
     # storage submodule
     class FakeBlob:
-        def __init__(self, path):
+        def __init__(self, bucket, path, data=b""):
+            self._bucket = bucket
             self.path = path
-            self._public_url = f"https://example.com/{path}"
-        def upload_from_file(self, f):
-            pass
-        def make_public(self):
-            pass
-        @property
-        def public_url(self):
-            return self._public_url
+            self.name = path
+            self._data = data
+        def upload_from_file(self, f, content_type=None):
+            self._data = f.read()
+            self._bucket._blobs[self.path] = self
+        def upload_from_string(self, data, content_type=None):
+            self._data = data.encode() if isinstance(data, str) else data
+            self._bucket._blobs[self.path] = self
+        def download_as_bytes(self):
+            return self._data
+        def download_as_text(self):
+            return self._data.decode()
+        def exists(self):
+            return self.path in self._bucket._blobs
+        def delete(self):
+            self._bucket._blobs.pop(self.path, None)
+        def open(self, mode, chunk_size=None, content_type=None):
+            if mode == "rb":
+                return io.BytesIO(self._data)
+            blob = self
+            class Writer(io.BytesIO):
+                def close(self):
+                    if not self.closed:
+                        blob.upload_from_string(self.getvalue(), content_type=content_type)
+                    super().close()
+            return Writer()
+        def generate_signed_url(self, version=None, expiration=None, method="GET"):
+            return f"https://example.com/{self.path}?expires={int(expiration.total_seconds())}"
 
     class FakeBucket:
+        def __init__(self):
+            self._blobs = {}
         def blob(self, path):
-            return FakeBlob(path)
+            return self._blobs.get(path) or FakeBlob(self, path)
 
     class storage_mod(types.ModuleType):
         @staticmethod
@@ -107,7 +250,13 @@ def _make_fake_firebase():
     # Wire modules
     fa.initialize_app = initialize_app
     fa.credentials = creds_mod
-    fa.firestore = types.SimpleNamespace(client=firestore_client)
+    fa.firestore = types.SimpleNamespace(
+        client=firestore_client,
+        SERVER_TIMESTAMP=SERVER_TIMESTAMP,
+        DELETE_FIELD=DELETE_FIELD,
+        Query=types.SimpleNamespace(ASCENDING="ASCENDING", DESCENDING="DESCENDING"),
+        transactional=transactional,
+    )
     fa.storage = storage_mod("firebase_admin.storage")
 
     return fa, calls
@@ -144,7 +293,7 @@ def fake_firebase(monkeypatch):
 def fake_openai(monkeypatch):
     """Stub OpenAI client so no network happens."""
     class FakeClient:
-        def __init__(self, api_key=None):
+        def __init__(self, api_key=None, **kwargs):
             self.api_key = api_key
     # module import style: from openai import OpenAI
     import types
@@ -166,17 +315,37 @@ def app(monkeypatch):
     # Also patch the imported symbol path main.render_template uses
     monkeypatch.setenv("FLASK_ENV", "testing")
 
-    # Import (or reload) main so top-level init runs once
-    # after
+    # Re-import main so its lazily created services use this test's fakes
     if "studyPal.main" in sys.modules:
         del sys.modules["studyPal.main"]
     mod = importlib.import_module("studyPal.main")
 
-
-    mod.app.testing = True
-    return mod.app
+    app = mod.create_app()
+    app.testing = True
+    return app
 
 
 @pytest.fixture
 def client(app):
     return app.test_client()
+
+
+@pytest.fixture
+def fake_db():
+    """A repository over a standalone fake Firestore client and bucket."""
+    fa = sys.modules["firebase_admin"]
+    repository = importlib.import_module("studyPal.repository")
+    return repository.FirestoreRepository(fa.firestore.client(), fa.storage.bucket())
+
+
+@pytest.fixture(autouse=True)
+def reset_llm_cache():
+    """Keep cached LLM results and notes from leaking between tests."""
+    yield
+    cache = sys.modules.get("studyPal.cache")
+    if cache is not None:
+        cache.llm_cache.shared = None
+        cache.llm_cache.async_shared = None
+        cache.llm_cache.clear()
+        cache.note_cache.shared = None
+        cache.note_cache.clear()
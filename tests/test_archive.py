@@ -0,0 +1,95 @@
+# tests/test_archive.py
+import importlib
+import io
+import json
+import zipfile
+
+CARDS = [{"question": "What is paging?", "answer": "Fixed-size memory blocks"}]
+
+
+def make_notes(db, user_id):
+    functions = importlib.import_module("studyPal.functions")
+    uploads = importlib.import_module("studyPal.uploads")
+    written = functions.save_note(db, user_id, "raw text", "<p>Paging</p>", "Written", flashcards=CARDS)
+    db.put_blob("uploads/doc.pdf", b"uploaded page")
+    blob_path, _ = uploads.acquire_upload(db, "hash1", "pdf", 13, blob_path="uploads/doc.pdf")
+    uploaded = functions.save_note(db, user_id, "uploaded page", "<p>Doc</p>", "Uploaded",
+                                   blob_path=blob_path, upload_hash="hash1")
+    return written, uploaded
+
+
+def test_zip_export_streams_notes_and_files(fake_db, monkeypatch):
+    archive = importlib.import_module("studyPal.archive")
+    monkeypatch.setattr(archive, "EXPORT_PAGE_SIZE", 1)
+    written, uploaded = make_notes(fake_db, "u10")
+
+    pieces = list(archive.iter_export(fake_db, "u10", "zip"))
+    assert len(pieces) > 3  # sent as it is built
+    with zipfile.ZipFile(io.BytesIO(b"".join(pieces))) as zf:
+        record = json.loads(zf.read(f"notes/{written}.json"))
+        assert record["summary_text"] == "<p>Paging</p>" and record["flashcards"] == CARDS
+        assert record["original_text"] == "raw text" and "file" not in record
+        assert json.loads(zf.read(f"notes/{uploaded}.json"))["file"] == f"files/{uploaded}.pdf"
+        assert zf.read(f"files/{uploaded}.pdf") == b"uploaded page"
+
+    lines = [json.loads(line) for line in b"".join(archive.iter_export(fake_db, "u10", "jsonl")).splitlines()]
+    assert {line["title"] for line in lines} == {"Written", "Uploaded"}
+
+
+def test_import_round_trips_an_export(fake_db, monkeypatch):
+    archive = importlib.import_module("studyPal.archive")
+    functions = importlib.import_module("studyPal.functions")
+    monkeypatch.setattr(archive, "IMPORT_BATCH_NOTES", 1)
+    make_notes(fake_db, "u10")
+    data = b"".join(archive.iter_export(fake_db, "u10", "zip"))
+
+    counts = archive.import_archive(fake_db, "u11", io.BytesIO(data), "zip")
+    assert counts == {"imported": 2, "queued": 0, "skipped": 0}
+    notes = {n["title"]: n for n in functions.iter_notes(fake_db, "u11")}
+    assert functions.get_flashcards(fake_db, "u11", notes["Written"]["note_id"]) == CARDS
+    # The attached file is the same stored upload, now referenced twice
+    upload_hash = notes["Uploaded"]["upload_hash"]
+    assert fake_db.get_blob(notes["Uploaded"]["blob_path"]) == b"uploaded page"
+    assert archive.import_archive(fake_db, "u11", io.BytesIO(data), "zip")["imported"] == 2
+    assert fake_db.get("uploads", upload_hash)["refs"] == 2
+
+
+def test_import_extracts_or_queues_attached_files(fake_db, monkeypatch):
+    archive = importlib.import_module("studyPal.archive")
+    monkeypatch.setattr(archive, "iter_pages", lambda data, ext: iter([data.decode()]))
+    functions = importlib.import_module("studyPal.functions")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("notes/a.json", json.dumps({"title": "Summarised", "summary_text": "<p>S</p>", "file": "files/a.pdf"}))
+        zf.writestr("files/a.pdf", "extracted text")
+        zf.writestr("notes/b.json", json.dumps({"title": "Raw", "file": "files/b.pdf"}))
+        zf.writestr("files/b.pdf", "needs a summary")
+        zf.writestr("notes/c.json", "not json")
+    queued = []
+
+    counts = archive.import_archive(fake_db, "u12", io.BytesIO(buffer.getvalue()), "zip",
+                                    on_queued=lambda *args: queued.append(args))
+    assert counts == {"imported": 2, "queued": 1, "skipped": 1}
+    notes = {n["title"]: n for n in functions.iter_notes(fake_db, "u12")}
+    assert functions.get_note(fake_db, notes["Summarised"]["note_id"], text=True)["original_text"] == "extracted text"
+    assert queued[0][0] == notes["Raw"]["note_id"] and queued[0][2] == "pdf"
+
+
+def test_export_and_import_routes(client):
+    main = importlib.import_module("studyPal.main")
+    main.save_note(main.db, "u13", "text", "<p>Summary</p>", "Mine", flashcards=CARDS)
+    with client.session_transaction() as sess:
+        sess["user_id"] = "u13"
+
+    response = client.get("/export?format=jsonl")
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    exported = response.get_data()
+    assert json.loads(exported)["title"] == "Mine"
+    assert client.get("/export?format=tar").status_code == 400
+
+    response = client.post("/import", data={"archive": (io.BytesIO(exported + b"{}\n"), "notes.jsonl")},
+                           content_type="multipart/form-data")
+    assert response.get_json() == {"imported": 1, "queued": 0, "skipped": 1}
+    bad = client.post("/import", data={"archive": (io.BytesIO(b"nope"), "notes.zip")},
+                      content_type="multipart/form-data")
+    assert bad.status_code == 400
@@ -0,0 +1,190 @@
+# tests/test_asgi.py
+import asyncio
+import importlib
+import json
+import sys
+import types
+
+import httpx
+import pytest
+
+
+class FakeAsyncOpenAI:
+    """Answers summaries and flashcards after a short await, counting overlap."""
+
+    def __init__(self):
+        self.chat = types.SimpleNamespace(completions=self)
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    async def create(self, **kwargs):
+        if kwargs.get("stream"):
+            return self._stream()
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.02)
+        self.in_flight -= 1
+        if "response_format" in kwargs:
+            content = json.dumps({"flashcards": [{"question": "Q", "answer": "A"}]})
+        else:
+            content = "```html<p>summary</p>```"
+        return types.SimpleNamespace(usage=None, choices=[
+            types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+
+    async def _stream(self):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        for piece in ("```html<p>sum", "mary</p>```"):
+            await asyncio.sleep(0.01)
+            yield types.SimpleNamespace(usage=None, choices=[
+                types.SimpleNamespace(delta=types.SimpleNamespace(content=piece))])
+        self.in_flight -= 1
+        yield types.SimpleNamespace(usage=types.SimpleNamespace(
+            prompt_tokens=3, completion_tokens=2, total_tokens=5), choices=[])
+
+
+@pytest.fixture
+def served(app, monkeypatch):
+    """The ASGI app around the test app, with a fake async OpenAI client."""
+    sys.modules.pop("studyPal.asgi", None)
+    asgi = importlib.import_module("studyPal.asgi")
+    fake = FakeAsyncOpenAI()
+    monkeypatch.setattr(asgi, "aclient", fake)
+    main = importlib.import_module("studyPal.main")
+    cache = importlib.import_module("studyPal.cache")
+    repository = importlib.import_module("studyPal.repository")
+    # The fake Firebase has no async client: await the fake Firestore
+    # directly, and keep the caches to their local tiers
+    monkeypatch.setattr(asgi, "adb", repository.AsyncMemoryRepository(main.db.repo))
+    monkeypatch.setattr(cache.llm_cache, "async_shared", None)
+    monkeypatch.setattr(cache.note_cache, "async_shared", None)
+    # The sync views must not be the ones answering
+    monkeypatch.setattr(main, "aiSummariser", lambda *a, **k: pytest.fail("sync summariser used"))
+    monkeypatch.setattr(main, "get_notes", lambda *a, **k: pytest.fail("sync notes listing used"))
+    monkeypatch.setattr(main, "aiSummariser_stream", lambda *a, **k: pytest.fail("sync stream used"))
+    monkeypatch.setattr(main, "get_flashcards", lambda *a, **k: pytest.fail("sync flashcards used"))
+    return asgi.create_asgi_app(app, threads=4), fake, main
+
+
+def run(asgi_app, scenario):
+    async def go():
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+            return await scenario(http)
+    return asyncio.run(go())
+
+
+async def log_in(http, main, email):
+    functions = importlib.import_module("studyPal.functions")
+    user_id, _ = functions.create_user(main.db, "A", email, "pw")
+    resp = await http.post("/login", data={"email": email, "password": "pw"})
+    assert resp.status_code == 302
+    return user_id
+
+
+def test_flask_routes_and_sessions_go_through_the_bridge(served):
+    asgi_app, _, main = served
+
+    async def scenario(http):
+        resp = await http.get("/study")
+        assert resp.status_code == 302 and resp.headers["location"].endswith("/login")
+        await log_in(http, main, "u14@example.com")
+        resp = await http.get("/study")
+        assert resp.status_code == 200 and resp.text == "review.html"
+    run(asgi_app, scenario)
+
+
+def test_home_reads_notes_through_the_async_repository(served):
+    asgi_app, _, main = served
+
+    async def scenario(http):
+        resp = await http.get("/")
+        assert resp.status_code == 302 and resp.headers["location"].endswith("/login")
+        await log_in(http, main, "u17@example.com")
+        resp = await http.get("/")
+        assert resp.status_code == 200 and resp.text == "home.html"
+        resp = await http.get("/", params={"cursor": "not-a-cursor"})
+        assert resp.status_code == 400
+    run(asgi_app, scenario)
+
+
+def test_errors_in_bridged_views_are_answered_with_500(served, monkeypatch):
+    asgi_app, _, main = served
+    main.app.config["PROPAGATE_EXCEPTIONS"] = True
+    monkeypatch.setattr(main, "render_template", lambda *a, **k: 1 / 0)
+
+    async def scenario(http):
+        await log_in(http, main, "u18@example.com")
+        resp = await http.get("/study")
+        assert resp.status_code == 500 and resp.text == "Internal Server Error"
+    run(asgi_app, scenario)
+
+
+def test_summarise_and_save_are_served_as_coroutines(served):
+    asgi_app, fake, main = served
+    functions = importlib.import_module("studyPal.functions")
+
+    async def scenario(http):
+        user_id = await log_in(http, main, "u15@example.com")
+        responses = await asyncio.gather(*(
+            http.post("/edit_note", data={"title": "T", "notes": f"Text {i}", "action": "summarise"})
+            for i in range(12)))
+        assert [r.status_code for r in responses] == [200] * 12
+        assert all(r.text == "write.html" for r in responses)
+
+        resp = await http.post("/edit_note", data={"title": "Saved", "notes": "Body", "action": "save"})
+        assert resp.status_code == 302 and resp.headers["location"].endswith("/")
+        return user_id
+
+    user_id = run(asgi_app, scenario)
+    # The requests waited on OpenAI together, not one after another
+    assert fake.calls == 13 and fake.peak > 1
+    notes, _ = functions.get_notes(main.db, user_id)
+    assert [n["title"] for n in notes] == ["Saved"]
+    assert functions.get_flashcards(main.db, user_id, notes[0]["note_id"]) == [{"question": "Q", "answer": "A"}]
+
+
+def test_other_edits_are_replayed_to_flask(served):
+    asgi_app, fake, main = served
+
+    async def scenario(http):
+        await log_in(http, main, "u16@example.com")
+        # An existing note (here someone else's) is edited by the Flask view
+        resp = await http.post("/edit_note", data={"note_id": "n1", "notes": "x", "action": "summarise"})
+        assert resp.status_code == 404 and resp.text == "Note not found"
+    run(asgi_app, scenario)
+    assert fake.calls == 0
+
+
+def test_streamed_summaries_are_served_as_coroutines(served):
+    asgi_app, fake, main = served
+
+    async def scenario(http):
+        await log_in(http, main, "u19@example.com")
+        # The editor posts FormData, i.e. multipart
+        responses = await asyncio.gather(*(
+            http.post("/edit_note/stream", files={"notes": (None, f"Streamed text {i}")})
+            for i in range(8)))
+        for resp in responses:
+            assert resp.status_code == 200 and resp.headers["content-type"].startswith("text/event-stream")
+            assert resp.text == "data: <p>sum\n\ndata: mary</p>\n\nevent: done\ndata: \n\n"
+    run(asgi_app, scenario)
+    assert fake.calls == 8 and fake.peak > 1
+
+
+def test_flashcards_are_read_through_the_async_repository(served):
+    asgi_app, _, main = served
+    functions = importlib.import_module("studyPal.functions")
+    asgi = importlib.import_module("studyPal.asgi")
+
+    async def scenario(http):
+        user_id = await log_in(http, main, "u20@example.com")
+        note_id = functions.save_note(main.db, user_id, "Body", None, "T",
+                                      flashcards=[{"question": "Q", "answer": "A"}])
+        resp = await http.get(f"/flashcards/{note_id}")
+        assert resp.status_code == 200 and resp.text == "flashcards.html"
+        return await functions.get_flashcards_async(asgi.adb, user_id, note_id)
+    assert run(asgi_app, scenario) == [{"question": "Q", "answer": "A"}]
@@ -0,0 +1,49 @@
+# tests/test_benchmarks.py
+import json
+import urllib.request
+
+from benchmarks import compare, corpus, run
+from benchmarks.stand_ins import MockOpenAI
+
+
+def post(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode(), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return response.read().decode()
+
+
+def test_mock_openai_answers_summaries_flashcards_and_streams():
+    with MockOpenAI(latency=0) as server:
+        url = server.base_url + "/chat/completions"
+        summary = json.loads(post(url, {"messages": [{"role": "user", "content": "cells divide"}]}))
+        assert "<p>cells divide</p>" in summary["choices"][0]["message"]["content"]
+        assert summary["usage"]["completion_tokens"] > 0
+
+        cards = json.loads(post(url, {"messages": [
+            {"role": "system", "content": "Output flashcard objects"}, {"role": "user", "content": "x"}]}))
+        assert len(json.loads(cards["choices"][0]["message"]["content"])) == server.flashcards
+
+        events = post(url, {"stream": True, "messages": [{"role": "user", "content": "cells divide"}]})
+        deltas = [json.loads(line[6:]) for line in events.splitlines()
+                  if line.startswith("data: {")]
+        assert "".join(d["choices"][0]["delta"].get("content", "") for d in deltas).startswith("<h2>")
+        assert events.rstrip().endswith("data: [DONE]")
+        assert server.stats["requests"] == 3 and server.stats["streamed"] == 1
+
+
+def test_corpus_documents_extract():
+    extraction = __import__("studyPal.extraction", fromlist=["extract_text"])
+    for name, data in corpus.documents(seed=3, count=3, max_pages=3):
+        assert extraction.extract_text(data, name.rsplit(".", 1)[1]).strip()
+
+
+def test_percentiles_and_regression_check():
+    stats = run.summarise([i / 1000 for i in range(1, 101)], errors=0, elapsed=2.0)
+    assert stats["latency_ms"]["p50"] == 50.0 and stats["latency_ms"]["p99"] == 99.0
+    assert stats["rps"] == 50.0
+
+    slower = json.loads(json.dumps(stats))
+    slower["latency_ms"]["p95"] *= 1.5
+    rows, regressions = compare.compare({"scenarios": {"home": stats}}, {"scenarios": {"home": slower}})
+    assert len(rows) == 4
+    assert [(name, metric) for name, metric, *_ in regressions] == [("home", "p95")]
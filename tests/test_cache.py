@@ -0,0 +1,176 @@
+# tests/test_cache.py
+import importlib
+import types
+
+import pytest
+
+
+class FakeCompletions:
+    def __init__(self, content):
+        self.content = content
+        self.calls = 0
+
+    def create(self, model, messages, **kwargs):
+        self.calls += 1
+        message = types.SimpleNamespace(content=self.content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def fake_client(content):
+    completions = FakeCompletions(content)
+    return types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions)), completions
+
+
+def test_lru_evicts_oldest_by_count_and_size():
+    cache = importlib.import_module("studyPal.cache")
+    lru = cache.LRUCache(max_entries=2, max_bytes=10)
+    lru.set("a", "1")
+    lru.set("b", "2")
+    lru.get("a")
+    lru.set("c", "3")
+    assert lru.get("b") is None and lru.get("a") == "1"
+    lru.set("big", "x" * 9)
+    assert lru.get("c") is None and lru.get("big") == "x" * 9
+
+
+def test_lru_expires_entries():
+    cache = importlib.import_module("studyPal.cache")
+    lru = cache.LRUCache(ttl=-1)
+    lru.set("a", "1")
+    assert lru.get("a") is None
+
+
+def test_summariser_reuses_cached_result():
+    functions = importlib.import_module("studyPal.functions")
+    cache = importlib.import_module("studyPal.cache")
+    client, completions = fake_client("```html<p>Sum</p>```")
+
+    assert functions.aiSummariser("same text", client) == "<p>Sum</p>"
+    assert functions.aiSummariser("same text", client) == "<p>Sum</p>"
+    assert completions.calls == 1
+    stats = cache.llm_cache.stats()
+    assert stats["local_hits"] == 1 and stats["misses"] == 1
+
+
+def test_shared_tier_serves_other_processes(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    cache = importlib.import_module("studyPal.cache")
+    cache.llm_cache.shared = cache.SharedCache(fake_db)
+    client, completions = fake_client('[{"question": "Q", "answer": "A"}]')
+
+    functions.generate_flashcards(fake_db, "u1", "n1", "summary", client)
+    cache.llm_cache.local.clear()  # as if this were a fresh worker
+    functions.generate_flashcards(fake_db, "u1", "n1", "summary", client)
+    assert completions.calls == 1
+    assert cache.llm_cache.stats()["shared_hits"] == 1
+
+
+def test_unparsable_flashcards_are_not_cached():
+    functions = importlib.import_module("studyPal.functions")
+    client, completions = fake_client("not json")
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            functions.generate_flashcards(None, "u1", "n1", "summary", client)
+    # Each attempt asks once more before giving up
+    assert completions.calls == 4
+
+
+def test_flashcard_output_is_repaired_locally():
+    functions = importlib.import_module("studyPal.functions")
+    truncated = '```json\n{"flashcards": [{"question": "Q1", "answer": "A1"}, {"question": "", "answer": "x"}, {"question": "Q3", "ans'
+    client, completions = fake_client(truncated)
+    assert functions.generate_flashcards(None, "u1", "n1", "summary", client) == [{"question": "Q1", "answer": "A1"}]
+    assert completions.calls == 1
+    assert functions.FLASHCARD_OUTPUTS.value(result="repaired") >= 1
+
+
+def test_unusable_flashcard_output_is_requested_again():
+    functions = importlib.import_module("studyPal.functions")
+
+    class SecondTimeLucky(FakeCompletions):
+        def create(self, model, messages, **kwargs):
+            self.content = "Sorry!" if self.calls == 0 else '{"flashcards": [{"question": "Q", "answer": "A"}]}'
+            assert kwargs["response_format"]["type"] == "json_schema"
+            return super().create(model, messages, **kwargs)
+
+    completions = SecondTimeLucky(None)
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    assert functions.generate_flashcards(None, "u1", "n1", "summary", client) == [{"question": "Q", "answer": "A"}]
+    assert functions.generate_flashcards(None, "u1", "n1", "summary", client) == [{"question": "Q", "answer": "A"}]
+    assert completions.calls == 2
+
+
+def test_streamed_summary_strips_fences_and_fills_cache():
+    functions = importlib.import_module("studyPal.functions")
+
+    class StreamingCompletions:
+        calls = 0
+
+        def create(self, model, messages, stream=False, **kwargs):
+            StreamingCompletions.calls += 1
+            for piece in ["``", "`html\n<p>", "Sum</p>\n`", "``"]:
+                delta = types.SimpleNamespace(content=piece)
+                yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=StreamingCompletions()))
+    assert "".join(functions.aiSummariser_stream("stream me", client)) == "<p>Sum</p>"
+    # the full summary is now cached for both the streaming and normal paths
+    assert functions.aiSummariser("stream me", client) == "<p>Sum</p>"
+    assert StreamingCompletions.calls == 1
+
+
+class CountingRepository:
+    """Counts reads of note documents going through to the repository."""
+
+    def __init__(self, db):
+        self.db = db
+        self.reads = 0
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def get(self, path, doc_id, fields=None):
+        self.reads += path == "notes"
+        return self.db.get(path, doc_id, fields=fields)
+
+
+def test_note_reads_go_through_cache_until_a_write(fake_db, monkeypatch):
+    cache = importlib.import_module("studyPal.cache")
+    functions = importlib.import_module("studyPal.functions")
+    # No sampled re-reads of hits
+    monkeypatch.setattr(cache.note_cache, "verify_rate", 0)
+    db = CountingRepository(fake_db)
+    note_id = functions.save_note(db, "u3", None, "<p>Summary</p>", "Cached")
+    functions.update_note(db, note_id, flashcards=[{"question": "Q", "answer": "A"}])
+    db.reads = 0
+
+    for _ in range(3):
+        note = functions.get_note(db, note_id, summary=True)
+        note["title"] = "changed by the caller"
+        assert functions.get_flashcards(db, "u3", note_id) == [{"question": "Q", "answer": "A"}]
+    assert db.reads == 1
+    assert functions.get_note(db, note_id)["title"] == "Cached"
+
+    functions.update_note(db, note_id, summary_text="<p>New</p>")
+    assert functions.get_note(db, note_id, summary=True)["summary_text"] == "<p>New</p>"
+    functions.delete_note(db, note_id)
+    assert functions.get_note(db, note_id) is None
+    stats = cache.note_cache.stats()
+    assert stats["hit_rate"] > 0.5 and stats["local_hits"] >= 6
+
+
+def test_sampled_hits_count_stale_reads(fake_db):
+    cache = importlib.import_module("studyPal.cache")
+    notes = cache.NoteCache(shared=cache.SharedCache(fake_db, collection="note_cache"), verify_rate=1.0)
+    stored = {"title": "v1"}
+    assert notes.get_or_load("note", "n9", lambda: dict(stored)) == {"title": "v1"}
+    assert fake_db.get("note_cache", "note:n9")["value"] == {"title": "v1"}
+
+    # Another process wrote the note without this one hearing about it
+    stored["title"] = "v2"
+    assert notes.get_or_load("note", "n9", lambda: dict(stored)) == {"title": "v2"}
+    assert notes.get_or_load("note", "n9", lambda: dict(stored)) == {"title": "v2"}
+    assert notes.stats()["stale"] == 1 and notes.stats()["stale_rate"] == 0.5
+
+    notes.invalidate("n9")
+    assert fake_db.get("note_cache", "note:n9") is None
@@ -0,0 +1,49 @@
+# tests/test_chunking.py
+import importlib
+
+
+def word_tokens(text):
+    return len(text.split())
+
+
+def test_chunks_are_exact_slices_with_page_metadata(monkeypatch):
+    chunking = importlib.import_module("studyPal.chunking")
+    monkeypatch.setattr(chunking, "count_tokens", word_tokens)
+    pages = [
+        "First sentence here. Second one follows.\n\nA new paragraph starts.\n",
+        "Page two has words. " * 10 + "\n",
+    ]
+    document = "".join(pages)
+    chunks = list(chunking.iter_chunks(iter(pages), max_tokens=12, overlap_tokens=0))
+
+    assert [c["index"] for c in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        assert document[chunk["start"]:chunk["end"]] == chunk["text"]
+        assert chunk["tokens"] <= 12
+    assert chunks[0]["pages"] == [1, 1]
+    assert chunks[-1]["pages"] == [2, 2]
+    assert chunks[-1]["end"] == len(document)
+
+
+def test_chunks_break_on_sentence_boundaries(monkeypatch):
+    chunking = importlib.import_module("studyPal.chunking")
+    monkeypatch.setattr(chunking, "count_tokens", word_tokens)
+    text = "One two three. Four five six. Seven eight nine."
+    chunks = list(chunking.iter_chunks([text], max_tokens=6, overlap_tokens=0))
+    assert [c["text"] for c in chunks] == ["One two three. Four five six. ", "Seven eight nine."]
+
+
+def test_overlap_repeats_tail_of_previous_chunk(monkeypatch):
+    chunking = importlib.import_module("studyPal.chunking")
+    monkeypatch.setattr(chunking, "count_tokens", word_tokens)
+    text = "A b. C d. E f. G h."
+    chunks = list(chunking.iter_chunks([text], max_tokens=4, overlap_tokens=2))
+    assert chunks[0]["text"] == "A b. C d. "
+    assert chunks[1]["text"].startswith("C d. ")
+
+
+def test_oversized_sentence_is_split_on_words(monkeypatch):
+    chunking = importlib.import_module("studyPal.chunking")
+    monkeypatch.setattr(chunking, "count_tokens", word_tokens)
+    chunks = list(chunking.iter_chunks(["w " * 25], max_tokens=10, overlap_tokens=0))
+    assert [c["tokens"] for c in chunks] == [10, 10, 5]
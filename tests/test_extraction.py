@@ -0,0 +1,99 @@
+# tests/test_extraction.py
+import importlib
+import io
+
+import pytest
+
+
+def make_pdf(pages):
+    """Build a minimal PDF with one line of text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 712 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode())
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_docx(paragraphs):
+    from docx import Document
+    document = Document()
+    for text in paragraphs:
+        document.add_paragraph(text)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def test_pdf_pages_are_yielded_in_order():
+    extraction = importlib.import_module("studyPal.extraction")
+    pages = list(extraction.iter_pages(make_pdf(["Alpha", "Beta"]), "pdf"))
+    assert [p.strip() for p in pages] == ["Alpha", "Beta"]
+
+
+def test_pdf_page_ranges_run_in_process_pool(monkeypatch):
+    extraction = importlib.import_module("studyPal.extraction")
+    monkeypatch.setattr(extraction, "EXTRACT_PROCESSES", 2)
+    monkeypatch.setattr(extraction, "PAGES_PER_TASK", 2)
+    names = [f"Page{i}" for i in range(5)]
+    text = extraction.extract_text(make_pdf(names), "pdf")
+    assert text.split() == names
+
+
+def test_docx_is_a_single_page():
+    extraction = importlib.import_module("studyPal.extraction")
+    pages = list(extraction.iter_pages(make_docx(["One", "Two"]), "docx"))
+    assert pages == ["One\nTwo\n"]
+
+
+def test_limits_are_enforced():
+    extraction = importlib.import_module("studyPal.extraction")
+    with pytest.raises(extraction.ExtractionLimitError):
+        extraction.extract_text(make_pdf(["A", "B", "C"]), "pdf", max_pages=2)
+    with pytest.raises(extraction.ExtractionLimitError):
+        extraction.extract_text(make_docx(["x" * 100]), "docx", max_bytes=10)
+
+
+def test_unsupported_extension():
+    extraction = importlib.import_module("studyPal.extraction")
+    with pytest.raises(ValueError):
+        list(extraction.iter_pages(b"", "txt"))
+
+
+def test_pdf_ranges_in_flight_are_bounded(monkeypatch):
+    extraction = importlib.import_module("studyPal.extraction")
+    monkeypatch.setattr(extraction, "EXTRACT_PROCESSES", 2)
+    monkeypatch.setattr(extraction, "PAGES_PER_TASK", 1)
+    submitted = []
+    pool = extraction._get_pool()
+
+    class RecordingPool:
+        def submit(self, fn, source, start, stop):
+            submitted.append(source)
+            return pool.submit(fn, source, start, stop)
+    monkeypatch.setattr(extraction, "_get_pool", RecordingPool)
+
+    names = [f"Page{i}" for i in range(10)]
+    pages = extraction.iter_pages(make_pdf(names), "pdf")
+    assert next(pages).strip() == "Page0"
+    # Two ranges per worker, the file sent by path
+    assert len(submitted) == 4 and all(isinstance(s, str) for s in submitted)
+    assert [p.strip() for p in pages] == names[1:]
+    assert len(submitted) == 10
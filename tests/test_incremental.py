@@ -0,0 +1,100 @@
+# tests/test_incremental.py
+import importlib
+
+
+def paragraphs(*names):
+    return "".join(f"Paragraph {name} has a few words in it.\n\n" for name in names)
+
+
+def setup_note(fake_db, monkeypatch, text):
+    incremental = importlib.import_module("studyPal.incremental")
+    functions = importlib.import_module("studyPal.functions")
+    monkeypatch.setattr(incremental, "EDIT_CHUNK_TOKENS", 12)
+    calls = []
+
+    def fake_summariser(text, client, priority=None):
+        calls.append(text)
+        return f"<p>{text.split()[1]}</p>"
+
+    monkeypatch.setattr(incremental, "aiSummariser", fake_summariser)
+    monkeypatch.setattr(incremental, "generate_flashcards", lambda db, uid, nid, summary, client, priority=None:
+                        [{"question": summary, "answer": "A"}])
+    note_id = functions.save_note(fake_db, "u1", text, None, "T")
+    return incremental, functions, note_id, calls
+
+
+def test_first_save_processes_every_chunk(fake_db, monkeypatch):
+    text = paragraphs("a", "b", "c")
+    incremental, functions, note_id, calls = setup_note(fake_db, monkeypatch, text)
+    batches, write_batch = [], fake_db.write_batch
+    monkeypatch.setattr(fake_db, "write_batch", lambda writes: batches.append(writes) or write_batch(writes))
+
+    assert incremental.resummarise_note(fake_db, None, "u1", note_id, text) == {"chunks": 3, "changed": 3}
+    # The note, its summary, flashcards and chunk records are committed together
+    assert len(batches) == 1
+    assert {path.rsplit("/", 1)[-1] for _, path, _, _ in batches[0]} >= {"notes", "summary", "flashcards", "chunks"}
+    note = functions.get_note(fake_db, note_id, summary=True)
+    assert note["summary_text"] == "<p>a</p>\n<p>b</p>\n<p>c</p>\n"
+    assert [c["question"] for c in functions.get_flashcards(fake_db, "u1", note_id)] == \
+        ["<p>a</p>", "<p>b</p>", "<p>c</p>"]
+
+
+def test_edit_only_reprocesses_changed_chunks(fake_db, monkeypatch):
+    incremental, functions, note_id, calls = setup_note(fake_db, monkeypatch, "")
+    incremental.resummarise_note(fake_db, None, "u1", note_id, paragraphs("a", "b", "c", "d"))
+    calls.clear()
+
+    edited = paragraphs("a", "x", "c", "new", "d")
+    assert incremental.resummarise_note(fake_db, None, "u1", note_id, edited) == {"chunks": 5, "changed": 2}
+    assert sorted(calls) == [paragraphs("new"), paragraphs("x")]
+
+    note = functions.get_note(fake_db, note_id, summary=True, text=True)
+    assert note["original_text"] == edited
+    assert note["summary_text"] == "<p>a</p>\n<p>x</p>\n<p>c</p>\n<p>new</p>\n<p>d</p>\n"
+    assert [c["question"] for c in functions.get_flashcards(fake_db, "u1", note_id)] == \
+        ["<p>a</p>", "<p>x</p>", "<p>c</p>", "<p>new</p>", "<p>d</p>"]
+
+    # Saving the same text again costs nothing
+    calls.clear()
+    assert incremental.resummarise_note(fake_db, None, "u1", note_id, edited)["changed"] == 0
+    assert calls == []
+
+
+def test_failed_chunks_are_retried_on_next_save(fake_db, monkeypatch):
+    incremental, functions, note_id, calls = setup_note(fake_db, monkeypatch, "")
+    working = incremental.aiSummariser
+
+    def flaky(text, client, priority=None):
+        if "b" in text.split()[1]:
+            raise RuntimeError("boom")
+        return working(text, client)
+
+    monkeypatch.setattr(incremental, "aiSummariser", flaky)
+    text = paragraphs("a", "b")
+    incremental.resummarise_note(fake_db, None, "u1", note_id, text)
+
+    monkeypatch.setattr(incremental, "aiSummariser", working)
+    calls.clear()
+    assert incremental.resummarise_note(fake_db, None, "u1", note_id, text)["changed"] == 1
+    assert calls == [paragraphs("b")]
+
+
+def test_edit_route_updates_existing_note(client, monkeypatch):
+    main = importlib.import_module("studyPal.main")
+    with client.session_transaction() as sess:
+        sess["user_id"] = "u1"
+    note_id = main.save_note(main.db, "u1", "old text", None, "Old")
+    edits = []
+    monkeypatch.setattr(main, "resummarise_note",
+                        lambda db, client, uid, nid, text: edits.append((uid, nid, text)))
+
+    assert client.get(f"/edit_note?note_id={note_id}").status_code == 200
+    resp = client.post("/edit_note", data={"note_id": note_id, "title": "New", "notes": "new text",
+                                           "action": "save"})
+    assert resp.status_code in (301, 302)
+    assert edits == [("u1", note_id, "new text")]
+    assert main.db.get("notes", note_id)["title"] == "New"
+
+    with client.session_transaction() as sess:
+        sess["user_id"] = "someone-else"
+    assert client.get(f"/edit_note?note_id={note_id}").status_code == 404
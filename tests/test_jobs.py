@@ -0,0 +1,148 @@
+# tests/test_jobs.py
+import importlib
+import pytest
+import io
+
+
+def login(client):
+    with client.session_transaction() as sess:
+        sess["user_id"] = "uid123"
+
+
+def test_run_upload_job_fills_note_and_marks_done(fake_db, monkeypatch):
+    jobs = importlib.import_module("studyPal.jobs")
+    chunking = importlib.import_module("studyPal.chunking")
+    monkeypatch.setattr(chunking, "CHUNK_TOKENS", 20)
+    monkeypatch.setattr(chunking, "CHUNK_OVERLAP_TOKENS", 0)
+    monkeypatch.setattr(jobs, "iter_pages", lambda f, ext: iter(["a" * 60 + "\n", "b" * 60 + "\n"]))
+    monkeypatch.setattr(jobs, "aiSummariser", lambda text, client, priority=None: f"<p>{text[0]}</p>")
+    monkeypatch.setattr(jobs, "generate_flashcards",
+                        lambda db, uid, nid, text, client, priority=None: [{"question": text, "answer": "A"}])
+
+    functions = importlib.import_module("studyPal.functions")
+    note_id = functions.save_note(fake_db, "uid123", None, None, "T", file_url="https://f")
+    jobs.create_job(fake_db, note_id, "uid123", "notes/file.pdf", "pdf")
+
+    assert jobs.run_upload_job(fake_db, None, note_id, data=b"%PDF") is True
+
+    note = functions.get_note(fake_db, note_id, summary=True, text=True)
+    assert note["summary_text"] == "<p>a</p>\n<p>b</p>\n"
+    assert note["original_text"] == "a" * 60 + "\n" + "b" * 60 + "\n"
+    assert len(functions.get_flashcards(fake_db, "uid123", note_id)) == 2
+
+    job = jobs.get_job(fake_db, note_id)
+    assert job["status"] == jobs.DONE
+    assert job["progress"] == job["total"] == 2
+
+
+def test_run_upload_job_skips_already_claimed_job(fake_db):
+    jobs = importlib.import_module("studyPal.jobs")
+    jobs.create_job(fake_db, "n2", "uid123", "notes/file.pdf", "pdf")
+    assert jobs.claim_job(fake_db, "n2") is not None
+    assert jobs.run_upload_job(fake_db, None, "n2", data=b"") is False
+
+
+def test_run_upload_job_records_failure(fake_db, monkeypatch, caplog):
+    jobs = importlib.import_module("studyPal.jobs")
+
+    def broken(f, ext):
+        raise ValueError("bad pdf")
+    monkeypatch.setattr(jobs, "iter_pages", broken)
+    fake_db.set("notes", "n2", {"user_id": "uid123"})
+    jobs.create_job(fake_db, "n2", "uid123", "notes/file.pdf", "pdf")
+
+    try:
+        jobs.run_upload_job(fake_db, None, "n2", data=b"")
+    except ValueError:
+        pass
+    job = jobs.get_job(fake_db, "n2")
+    assert job["status"] == jobs.FAILED
+    assert job["error"] == "bad pdf"
+    assert any(r.name == "studypal.jobs" and r.exc_info for r in caplog.records)
+
+
+def test_job_of_deleted_note_stops(fake_db, monkeypatch):
+    jobs = importlib.import_module("studyPal.jobs")
+    monkeypatch.setattr(jobs, "iter_pages", lambda f, ext: pytest.fail("deleted note processed"))
+    jobs.create_job(fake_db, "gone", "uid123", "notes/file.pdf", "pdf")
+
+    assert jobs.run_upload_job(fake_db, None, "gone", data=b"") is False
+    assert jobs.get_job(fake_db, "gone") is None
+
+
+def test_upload_doc_enqueues_job_and_redirects(client, monkeypatch):
+    login(client)
+    main = importlib.import_module("studyPal.main")
+    queued = {}
+    monkeypatch.setattr(main, "save_note",
+                        lambda db, uid, text, _none, title, upload_hash=None, blob_path=None: "note123")
+    monkeypatch.setattr(main, "enqueue_upload",
+                        lambda db, client, note_id, uid, path, ext, data, upload_hash=None: queued.update(
+                            note_id=note_id, ext=ext, data=data))
+
+    resp = client.post("/upload_doc", data={
+        "action": "save", "title": "T",
+        "document": (io.BytesIO(b"%PDF-1.4"), "slides.pdf"),
+    }, content_type="multipart/form-data")
+    assert resp.status_code in (301, 302)
+    assert queued == {"note_id": "note123", "ext": "pdf", "data": b"%PDF-1.4"}
+
+
+def test_note_status_reports_job_progress(client, monkeypatch):
+    login(client)
+    main = importlib.import_module("studyPal.main")
+    monkeypatch.setattr(main, "get_job", lambda db, note_id: {
+        "user_id": "uid123", "status": "running", "stage": "summarising",
+        "progress": 1, "total": 3, "error": None,
+    })
+    resp = client.get("/Note/n1/status")
+    assert resp.status_code == 200
+    assert resp.get_json()["progress"] == 1
+
+
+def test_requeue_job_only_requeues_failed_jobs(fake_db):
+    jobs = importlib.import_module("studyPal.jobs")
+    jobs.create_job(fake_db, "n2", "uid123", "notes/file.pdf", "pdf")
+    assert jobs.requeue_job(fake_db, "n2") is False
+    jobs.update_job(fake_db, "n2", status=jobs.FAILED, error="boom")
+    assert jobs.requeue_job(fake_db, "n2") is True
+    assert jobs.get_job(fake_db, "n2")["status"] == jobs.QUEUED
+
+
+def test_job_of_dead_worker_is_claimed_again(fake_db, monkeypatch):
+    jobs = importlib.import_module("studyPal.jobs")
+    jobs.create_job(fake_db, "n3", "uid123", "notes/file.pdf", "pdf")
+    assert jobs.claim_job(fake_db, "n3") is not None
+    # Held by a live worker
+    assert jobs.claim_job(fake_db, "n3") is None
+    assert jobs.requeue_job(fake_db, "n3") is False
+
+    # ... until it stops updating the job
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", -1)
+    submitted = []
+    monkeypatch.setattr(jobs, "get_executor", lambda: type("Pool", (), {
+        "submit": staticmethod(lambda fn, db, client, note_id: submitted.append(note_id))})())
+    jobs.resume_pending_jobs(fake_db, None)
+    assert submitted == ["n3"]
+    assert jobs.claim_job(fake_db, "n3") is not None
+    assert jobs.requeue_job(fake_db, "n3") is True
+    assert jobs.get_job(fake_db, "n3")["status"] == jobs.QUEUED
+
+
+def test_stalled_worker_stops_once_its_job_is_claimed_again(fake_db, monkeypatch):
+    jobs = importlib.import_module("studyPal.jobs")
+    functions = importlib.import_module("studyPal.functions")
+    note_id = functions.save_note(fake_db, "uid123", None, None, "T")
+    jobs.create_job(fake_db, note_id, "uid123", "notes/file.pdf", "pdf")
+
+    def stalled(f, ext):
+        # Another worker takes the job over while this one is extracting
+        monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", -1)
+        assert jobs.claim_job(fake_db, note_id) is not None
+        yield "page"
+
+    monkeypatch.setattr(jobs, "iter_pages", stalled)
+    monkeypatch.setattr(jobs, "aiSummariser", lambda *a, **k: pytest.fail("stale worker kept going"))
+    assert jobs.run_upload_job(fake_db, None, note_id, data=b"%PDF") is False
+    assert jobs.get_job(fake_db, note_id)["status"] == jobs.RUNNING
+    assert functions.get_note(fake_db, note_id, summary=True)["summary_text"] is None
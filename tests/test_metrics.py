@@ -0,0 +1,77 @@
+# tests/test_metrics.py
+import importlib
+import json
+import logging
+import types
+
+import pytest
+
+
+def login(client):
+    with client.session_transaction() as sess:
+        sess["user_id"] = "uid123"
+
+
+def test_histogram_renders_cumulative_buckets():
+    metrics = importlib.import_module("studyPal.metrics")
+    histogram = metrics.Registry().histogram("t_seconds", "Test.", ("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5, stage="a")
+    lines = histogram.render()
+    assert 't_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{stage="a",le="1"} 2' in lines
+    assert 't_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 't_seconds_count{stage="a"} 3' in lines
+
+
+def test_stage_counts_errors():
+    metrics = importlib.import_module("studyPal.metrics")
+    before = metrics.STAGE_ERRORS.value(stage="test.fail")
+    with pytest.raises(ValueError):
+        with metrics.stage("test.fail"):
+            raise ValueError("boom")
+    assert metrics.STAGE_ERRORS.value(stage="test.fail") == before + 1
+    assert metrics.STAGE_SECONDS.count(stage="test.fail") >= 1
+
+
+def test_openai_usage_is_counted():
+    metrics = importlib.import_module("studyPal.metrics")
+    functions = importlib.import_module("studyPal.functions")
+    before = metrics.OPENAI_TOKENS.value(function="aiSummariser", kind="completion")
+
+    def create(model, messages, **kwargs):
+        message = types.SimpleNamespace(content="<p>Sum</p>")
+        usage = types.SimpleNamespace(prompt_tokens=120, completion_tokens=7)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+
+    assert functions.aiSummariser("count my tokens", client) == "<p>Sum</p>"
+    assert metrics.OPENAI_TOKENS.value(function="aiSummariser", kind="completion") == before + 7
+
+
+def test_requests_are_logged_and_exported(client, caplog):
+    login(client)
+    with caplog.at_level(logging.INFO, logger="studypal.requests"):
+        assert client.get("/Note/n1").status_code == 200
+
+    line = json.loads(caplog.records[-1].getMessage())
+    assert line["route"] == "/Note/<note_id>" and line["status"] == 200
+    assert line["stages"]["db.get"]["count"] >= 1
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'studypal_request_seconds_count{route="/Note/<note_id>",method="GET",status="200"}' in body
+    assert 'studypal_stage_seconds_count{stage="db.get"}' in body
+
+
+def test_unsampled_requests_are_not_logged(caplog):
+    metrics = importlib.import_module("studyPal.metrics")
+    flask = importlib.import_module("flask")
+    quiet = flask.Flask("quiet")
+    metrics.init_app(quiet, sample_rate=0)
+    quiet.add_url_rule("/ping", "ping", lambda: "pong")
+
+    with caplog.at_level(logging.INFO, logger="studypal.requests"):
+        assert quiet.test_client().get("/ping").data == b"pong"
+    assert not caplog.records
+    assert metrics.REQUEST_SECONDS.count(route="/ping", method="GET", status="200") >= 1
@@ -0,0 +1,132 @@
+# tests/test_note_storage.py
+import importlib
+
+
+def test_note_document_only_holds_metadata(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    note_id = functions.save_note(fake_db, "u1", "raw text", "<p>a</p>\n<p>b</p>\n", "T")
+    functions.update_note(fake_db, note_id, flashcards=[{"question": "Q", "answer": "A"}])
+
+    doc = fake_db.get("notes", note_id)
+    assert "original_text" not in doc and "summary_text" not in doc and "flashcards" not in doc
+    assert doc["text_path"] == f"note_text/{note_id}.txt"
+
+    note = functions.get_note(fake_db, note_id, summary=True, text=True)
+    assert note["summary_text"] == "<p>a</p>\n<p>b</p>\n"
+    assert note["original_text"] == "raw text"
+    assert functions.get_flashcards(fake_db, "u1", note_id) == [{"question": "Q", "answer": "A"}]
+
+
+def test_summary_is_split_into_sections(fake_db, monkeypatch):
+    storage = importlib.import_module("studyPal.note_storage")
+    functions = importlib.import_module("studyPal.functions")
+    monkeypatch.setattr(storage, "SECTION_MAX_CHARS", 10)
+    note_id = functions.save_note(fake_db, "u1", None, "<p>one</p>\n<p>two</p>\n<p>three</p>\n", "T")
+
+    assert len(fake_db.query(f"notes/{note_id}/summary")) == 3
+    assert functions.get_note(fake_db, note_id, summary=True)["summary_text"] == "<p>one</p>\n<p>two</p>\n<p>three</p>\n"
+
+
+def test_shorter_update_drops_stale_flashcards(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    note_id = functions.save_note(fake_db, "u1", None, None, "T")
+    functions.update_note(fake_db, note_id, flashcards=[{"question": str(i), "answer": ""} for i in range(3)])
+    functions.update_note(fake_db, note_id, flashcards=[{"question": "only", "answer": ""}])
+    assert functions.get_flashcards(fake_db, "u1", note_id) == [{"question": "only", "answer": ""}]
+
+
+def test_update_can_clear_text_and_summary(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    search = importlib.import_module("studyPal.search")
+    note_id = functions.save_note(fake_db, "u1", "raw text", "<p>Paging</p>", "T")
+    assert functions.update_note(fake_db, note_id, original_text="", summary_text="") is True
+
+    note = functions.get_note(fake_db, note_id, summary=True, text=True)
+    assert note["original_text"] == "" and not note["summary_text"]
+    assert fake_db.query(f"notes/{note_id}/summary") == []
+    assert search.search_notes(fake_db, "u1", "paging") == []
+
+
+def test_legacy_notes_are_read_and_migrated(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    migrate = importlib.import_module("studyPal.migrate_notes")
+    fake_db.set("notes", "old", {
+        "user_id": "u1", "title": "Old", "original_text": "https://files/old.pdf",
+        "summary_text": "<p>s</p>", "flashcards": [{"question": "Q", "answer": "A"}],
+    })
+
+    assert functions.get_note(fake_db, "old", summary=True)["summary_text"] == "<p>s</p>"
+    assert functions.get_note(fake_db, "old")["file_url"] == "https://files/old.pdf"
+    assert functions.get_flashcards(fake_db, "u1", "old") == [{"question": "Q", "answer": "A"}]
+
+    assert migrate.migrate_notes(fake_db, dry_run=True) == (2, 0)  # "old" and the fixture's n1
+    assert migrate.migrate_notes(fake_db) == (2, 0)
+    assert migrate.migrate_notes(fake_db) == (0, 2)
+
+    doc = fake_db.get("notes", "old")
+    assert doc["file_url"] == "https://files/old.pdf"
+    assert "summary_text" not in doc and "flashcards" not in doc and "original_text" not in doc
+    assert functions.get_note(fake_db, "old", summary=True)["summary_text"] == "<p>s</p>"
+    assert functions.get_flashcards(fake_db, "u1", "old") == [{"question": "Q", "answer": "A"}]
+
+
+def test_delete_note_removes_body(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    note_id = functions.save_note(fake_db, "u1", "text", "<p>s</p>", "T")
+    functions.delete_note(fake_db, note_id)
+    assert functions.get_note(fake_db, note_id) is None
+    assert not fake_db.blob_exists(f"note_text/{note_id}.txt")
+    assert fake_db.query(f"notes/{note_id}/summary") == []
+
+
+class RecordingRepository:
+    """Records the batches written, passing everything through."""
+
+    def __init__(self, db):
+        self.db = db
+        self.batches = []
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def write_batch(self, writes):
+        writes = list(writes)
+        self.batches.append(writes)
+        self.db.write_batch(writes)
+
+
+def test_note_is_created_in_one_batch_with_document_last(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    db = RecordingRepository(fake_db)
+    cards = [{"question": "Q1", "answer": "A1"}, {"question": "Q2", "answer": "A2"}]
+    note_id = functions.save_note(db, "u4", "text", "<p>Summary</p>", "One go", flashcards=cards)
+
+    [batch] = db.batches
+    assert batch[-1][:3] == ("set", "notes", note_id)
+    assert {path for _, path, _, _ in batch[:-1]} == {
+        f"notes/{note_id}/summary", f"notes/{note_id}/flashcards", "reviews/u4/cards"}
+    assert functions.get_flashcards(fake_db, "u4", note_id) == cards
+    assert fake_db.get("notes", note_id)["flashcard_count"] == 2
+
+    db.batches.clear()
+    functions.update_note(db, note_id, summary_text="<p>New</p>", flashcards=cards[:1])
+    [batch] = db.batches
+    assert batch[-1][:3] == ("update", "notes", note_id)
+
+
+def test_save_notes_writes_many_notes_at_once(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    search = importlib.import_module("studyPal.search")
+    db = RecordingRepository(fake_db)
+    note_ids = functions.save_notes(db, "u4", [
+        {"title": "Paging", "summary_text": "<p>Pages and frames</p>"},
+        {"title": "Threads", "flashcards": [{"question": "Thread?", "answer": "Unit of scheduling"}]},
+        {"title": "Locks", "original_text": "mutex"},
+    ])
+
+    [batch] = db.batches
+    assert [w[2] for w in batch if w[1] == "notes"] == note_ids
+    assert all(w[1] == "notes" for w in batch[-3:])
+    assert [fake_db.get("notes", i)["title"] for i in note_ids] == ["Paging", "Threads", "Locks"]
+    assert [r["note_id"] for r in search.search_notes(fake_db, "u4", "scheduling")] == [note_ids[1]]
+    assert fake_db.get("search_index", "u4")["segments"] == [3]
@@ -0,0 +1,67 @@
+# tests/test_notes.py
+import base64
+import datetime
+import importlib
+
+import pytest
+
+
+def add_notes(db, count, user_id="uid123"):
+    base = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(count):
+        db.set("notes", f"note{i}", {
+            "user_id": user_id,
+            "title": f"Note {i}",
+            "original_text": "x" * 1000,
+            "summary_text": "<p>long</p>",
+            "flashcards": [{"question": "Q", "answer": "A"}],
+            "timestamp": base + datetime.timedelta(minutes=i),
+        })
+
+
+def test_get_notes_pages_newest_first_with_projection(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    add_notes(fake_db, 5)
+
+    first, cursor = functions.get_notes(fake_db, "uid123", 2, fields=functions.LISTING_FIELDS)
+    assert [n["note_id"] for n in first] == ["note4", "note3"]
+    assert set(first[0]) == {"note_id", "title", "timestamp"}
+
+    second, cursor = functions.get_notes(fake_db, "uid123", 2, cursor, functions.LISTING_FIELDS)
+    third, last_cursor = functions.get_notes(fake_db, "uid123", 2, cursor, functions.LISTING_FIELDS)
+    assert [n["note_id"] for n in second + third] == ["note2", "note1", "note0"]
+    assert last_cursor is None
+
+
+def test_iter_notes_walks_every_page(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    add_notes(fake_db, 5)
+    add_notes(fake_db, 1, user_id="someone_else")  # overwrites note0
+    ids = [n["note_id"] for n in functions.iter_notes(fake_db, "uid123", page_size=2)]
+    assert ids == ["note4", "note3", "note2", "note1"]
+
+
+def test_home_rejects_bad_cursor(client):
+    with client.session_transaction() as sess:
+        sess["user_id"] = "uid123"
+    resp = client.get("/?cursor=not-a-cursor")
+    assert resp.status_code == 400
+    # Well-formed JSON of the wrong shape
+    for payload in (b'"x"', b'{"t": 5, "id": "n"}'):
+        assert client.get("/", query_string={"cursor": base64.urlsafe_b64encode(payload)}).status_code == 400
+
+
+def test_home_does_not_report_listing_failures_as_bad_cursors(client, monkeypatch):
+    main = importlib.import_module("studyPal.main")
+    functions = importlib.import_module("studyPal.functions")
+    with client.session_transaction() as sess:
+        sess["user_id"] = "uid123"
+    cursor = functions.encode_cursor({"timestamp": datetime.datetime(2025, 1, 1), "note_id": "note1"})
+
+    def broken(db, user_id, page_size, start_after, fields):
+        assert start_after == [datetime.datetime(2025, 1, 1), "note1"]
+        raise KeyError("timestamp")
+
+    monkeypatch.setattr(main, "get_notes", broken)
+    with pytest.raises(KeyError):
+        client.get("/", query_string={"cursor": cursor})
@@ -0,0 +1,118 @@
+# tests/test_pipeline.py
+import importlib
+import threading
+import time
+
+
+def test_process_chunks_keeps_document_order(monkeypatch):
+    pipeline = importlib.import_module("studyPal.pipeline")
+
+    def summarise(chunk):
+        # later chunks finish first
+        time.sleep(0.01 * (3 - int(chunk)))
+        return f"S{chunk}"
+
+    results = pipeline.process_chunks(["0", "1", "2"], summarise, lambda s: [s], max_workers=3)
+    assert [r["summary"] for r in results] == ["S0", "S1", "S2"]
+    assert [r["flashcards"] for r in results] == [["S0"], ["S1"], ["S2"]]
+
+
+def test_process_chunks_respects_concurrency_limit():
+    pipeline = importlib.import_module("studyPal.pipeline")
+    lock = threading.Lock()
+    active = {"now": 0, "max": 0}
+
+    def summarise(chunk):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        time.sleep(0.01)
+        with lock:
+            active["now"] -= 1
+        return chunk
+
+    pipeline.process_chunks(list("abcdefgh"), summarise, lambda s: [], max_workers=2)
+    assert active["max"] <= 2
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def test_failed_flashcards_keep_the_summary_and_are_not_retried_again():
+    pipeline = importlib.import_module("studyPal.pipeline")
+    calls = {"summarise": 0, "cards": 0}
+
+    def summarise(chunk):
+        calls["summarise"] += 1
+        return chunk
+
+    def make_cards(summary):
+        # The rate limiter already retried this call before giving up
+        calls["cards"] += 1
+        raise RateLimited("rate limited")
+
+    results = pipeline.process_chunks(["a"], summarise, make_cards)
+    assert results[0] == {"summary": "a", "flashcards": [], "error": "rate limited"}
+    assert calls == {"summarise": 1, "cards": 1}
+
+
+def test_chunk_that_fails_is_reported():
+    pipeline = importlib.import_module("studyPal.pipeline")
+    calls = []
+
+    def summarise(chunk):
+        calls.append(chunk)
+        if chunk == "bad":
+            raise RuntimeError("boom")
+        return chunk
+
+    results = pipeline.process_chunks(["ok", "bad"], summarise, lambda s: [s])
+    assert results[0]["error"] is None
+    assert results[1]["error"] == "boom"
+    assert sorted(calls) == ["bad", "ok"]
+
+
+def test_reduce_summaries_concatenates_when_small():
+    pipeline = importlib.import_module("studyPal.pipeline")
+    calls = []
+    result = pipeline.reduce_summaries(["<p>a</p>", "<p>b</p>"], calls.append, max_tokens=100)
+    assert result == "<p>a</p>\n<p>b</p>\n"
+    assert calls == []
+
+
+def test_reduce_summaries_merges_level_by_level(monkeypatch):
+    pipeline = importlib.import_module("studyPal.pipeline")
+    monkeypatch.setattr(pipeline, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(pipeline, "REDUCE_INPUT_TOKENS", 2)
+    saved = {}
+
+    def summarise(text):
+        return "m" + "".join(text.split())[:3]
+
+    result = pipeline.reduce_summaries(
+        ["a", "b", "c", "d", "e"], summarise, max_tokens=1,
+        save_level=lambda level, key, summaries: saved.setdefault(level, summaries),
+    )
+    assert saved[1] == ["mab", "mcde"]
+    assert saved[2] == ["mmab"]
+    assert result == "mmab\n"
+
+
+def test_reduce_summaries_resumes_from_stored_level(monkeypatch):
+    pipeline = importlib.import_module("studyPal.pipeline")
+    monkeypatch.setattr(pipeline, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(pipeline, "REDUCE_INPUT_TOKENS", 2)
+    calls = []
+
+    def summarise(text):
+        calls.append(text)
+        return "final"
+
+    stored = {1: ["x", "y"]}
+    result = pipeline.reduce_summaries(
+        ["a", "b", "c", "d"], summarise, max_tokens=1,
+        load_level=lambda level, key: stored.get(level),
+    )
+    assert result == "final\n"
+    assert calls == ["x\ny"]
@@ -0,0 +1,165 @@
+# tests/test_ratelimit.py
+import asyncio
+import importlib
+import threading
+import time
+import types
+
+import pytest
+
+
+class APIError(Exception):
+    def __init__(self, status_code, headers=None, code=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.code = code
+        self.response = types.SimpleNamespace(headers=headers or {})
+
+
+def test_rate_limits_are_retried_after_retry_after():
+    ratelimit = importlib.import_module("studyPal.ratelimit")
+    limiter = ratelimit.RateLimiter(requests_per_min=6000, tokens_per_min=10**6, backoff=0)
+    attempts = []
+
+    def call():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise APIError(429, {"retry-after-ms": "50"})
+        return types.SimpleNamespace(usage=types.SimpleNamespace(total_tokens=10))
+
+    before = ratelimit.RETRIES.value(reason="rate_limit")
+    limiter.call(call, tokens=100)
+    assert len(attempts) == 3
+    assert attempts[1] - attempts[0] >= 0.045
+    assert ratelimit.RETRIES.value(reason="rate_limit") == before + 2
+    assert limiter._factor < 1.0 and limiter._in_flight == 0
+
+
+def test_other_errors_are_not_retried():
+    ratelimit = importlib.import_module("studyPal.ratelimit")
+    limiter = ratelimit.RateLimiter(backoff=0)
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise APIError(429, code="insufficient_quota")
+
+    with pytest.raises(APIError):
+        limiter.call(call, tokens=1)
+    with pytest.raises(APIError):
+        limiter.call(lambda: (_ for _ in ()).throw(APIError(400)), tokens=1)
+    assert len(calls) == 1 and limiter._in_flight == 0
+
+
+def test_gives_up_after_max_retries():
+    ratelimit = importlib.import_module("studyPal.ratelimit")
+    limiter = ratelimit.RateLimiter(max_retries=2, backoff=0.001)
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise APIError(503)
+
+    with pytest.raises(APIError):
+        limiter.call(call, tokens=1)
+    assert len(calls) == 3
+
+
+def test_streams_hold_their_slot_until_read():
+    ratelimit = importlib.import_module("studyPal.ratelimit")
+    limiter = ratelimit.RateLimiter(requests_per_min=6000, tokens_per_min=6000, backoff=0)
+    opened = []
+
+    def open_stream():
+        opened.append(1)
+        if len(opened) == 1:
+            raise APIError(503)
+        return iter(["a", "b", types.SimpleNamespace(usage=types.SimpleNamespace(total_tokens=10))])
+
+    events = limiter.stream(open_stream, tokens=1000)
+    assert next(events) == "a"
+    assert len(opened) == 2 and limiter._in_flight == 1
+    rest = list(events)
+    assert rest[0] == "b" and limiter._in_flight == 0
+    # The stream is charged the final event's usage, not the estimate (the
+    # failed attempt keeps its estimate)
+    assert limiter.tokens.level > 6000 - 2 * 1000
+
+
+def test_token_bucket_makes_calls_wait():
+    ratelimit = importlib.import_module("studyPal.ratelimit")
+    limiter = ratelimit.RateLimiter(requests_per_min=6000, tokens_per_min=6000)  # 100 tokens/s
+    limiter.call(lambda: None, tokens=6000)
+    start = time.monotonic()
+    limiter.call(lambda: None, tokens=10)
+    assert time.monotonic() - start >= 0.08
+
+
+def test_interactive_calls_go_before_background_ones():
+    ratelimit = importlib.import_module("studyPal.ratelimit")
+    limiter = ratelimit.RateLimiter(max_concurrency=1)
+    limiter.acquire(1)
+    order = []
+
+    def run(priority, name):
+        limiter.acquire(1, priority)
+        order.append(name)
+        limiter.release(1)
+
+    threads = [threading.Thread(target=run, args=(ratelimit.BACKGROUND, "background"))]
+    threads[0].start()
+    while ratelimit.QUEUE_DEPTH.value(priority="background") < 1:
+        time.sleep(0.001)
+    threads.append(threading.Thread(target=run, args=(ratelimit.INTERACTIVE, "interactive")))
+    threads[1].start()
+    while ratelimit.QUEUE_DEPTH.value(priority="interactive") < 1:
+        time.sleep(0.001)
+
+    limiter.release(1)
+    for thread in threads:
+        thread.join()
+    assert order == ["interactive", "background"]
+
+
+def test_async_calls_share_the_concurrency_cap_and_retries():
+    ratelimit = importlib.import_module("studyPal.ratelimit")
+    limiter = ratelimit.RateLimiter(requests_per_min=60000, tokens_per_min=10**7, max_concurrency=3, backoff=0)
+    peak, failures = [0], []
+
+    async def call():
+        peak[0] = max(peak[0], limiter._in_flight)
+        await asyncio.sleep(0.01)
+        if len(failures) < 2:
+            failures.append(1)
+            raise APIError(503)
+        return types.SimpleNamespace(usage=types.SimpleNamespace(total_tokens=10))
+
+    async def run():
+        return await asyncio.gather(*(limiter.call_async(call, tokens=10) for _ in range(12)))
+
+    responses = asyncio.run(run())
+    assert len(responses) == 12 and len(failures) == 2
+    assert peak[0] == 3
+    assert limiter._in_flight == 0 and not limiter._waiting
+
+
+def test_pause_is_shared_between_processes():
+    ratelimit = importlib.import_module("studyPal.ratelimit")
+    repository = importlib.import_module("studyPal.repository")
+    shared = repository.MemoryRepository()
+    first, second = ratelimit.RateLimiter(), ratelimit.RateLimiter()
+    first.shared = second.shared = shared
+
+    first.pause(0.1)
+    start = time.monotonic()
+    second.acquire(1)
+    assert time.monotonic() - start >= 0.08
+
+
+def test_retry_after_header_formats():
+    ratelimit = importlib.import_module("studyPal.ratelimit")
+    assert ratelimit.retry_after(APIError(429, {"retry-after": "3"})) == 3
+    assert ratelimit.retry_after(APIError(429, {"retry-after-ms": "250"})) == 0.25
+    assert ratelimit.retry_after(APIError(429, {"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert ratelimit.retry_after(APIError(429, {"retry-after": "soon"})) is None
+    assert ratelimit.retry_after(ValueError()) is None
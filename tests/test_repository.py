@@ -0,0 +1,90 @@
+# tests/test_repository.py
+import importlib
+import sys
+
+import pytest
+
+
+@pytest.fixture(params=["memory", "firestore"])
+def repo(request, fake_db):
+    repository = importlib.import_module("studyPal.repository")
+    if request.param == "memory":
+        return repository.MemoryRepository()
+    return fake_db
+
+
+def test_documents_round_trip(repo):
+    repository = importlib.import_module("studyPal.repository")
+    repo.set("notes", "a", {"title": "A", "body": "x", "timestamp": repository.SERVER_TIMESTAMP})
+    assert repo.get("notes", "a")["timestamp"] is not None
+    assert repo.get("notes", "a", fields=["title"]) == {"title": "A"}
+
+    repo.update("notes", "a", {"body": repository.DELETE_FIELD, "title": "B"})
+    assert "body" not in repo.get("notes", "a")
+    assert repo.get("notes", "a")["title"] == "B"
+
+    repo.delete("notes", "a")
+    assert repo.get("notes", "a") is None
+
+
+def test_query_orders_pages_and_projects(repo):
+    repository = importlib.import_module("studyPal.repository")
+    for i, (user, rank) in enumerate([("u1", 2), ("u1", 1), ("u2", 3), ("u1", 1)]):
+        repo.set("cards", f"c{i}", {"user_id": user, "rank": rank, "text": "t"})
+
+    order = [("rank", "desc"), (repository.ID, "desc")]
+    first = repo.query("cards", where=[("user_id", "==", "u1")], order_by=order, limit=2, fields=["rank"])
+    assert first == [("c0", {"rank": 2}), ("c3", {"rank": 1})]
+
+    rest = repo.query("cards", where=[("user_id", "==", "u1")], order_by=order, start_after=[1, "c3"])
+    assert [doc_id for doc_id, _ in rest] == ["c1"]
+
+
+def test_subcollections_and_batches(repo):
+    repo.write_batch([("set", "notes/n9/flashcards", f"{i:05d}", {"index": i}) for i in range(3)])
+    repo.write_batch([("delete", "notes/n9/flashcards", "00002", None)])
+    docs = repo.query("notes/n9/flashcards", order_by=[("index", "asc")])
+    assert [data["index"] for _, data in docs] == [0, 1]
+
+
+def test_transact_update_applies_only_returned_updates(repo):
+    repo.set("jobs", "j1", {"status": "queued"})
+    claim = lambda job: {"status": "running"} if job and job["status"] == "queued" else None
+    assert repo.transact_update("jobs", "j1", claim) == {"status": "running"}
+    assert repo.transact_update("jobs", "j1", claim) is None
+    assert repo.transact_update("jobs", "missing", claim) is None
+    assert repo.get("jobs", "j1")["status"] == "running"
+
+
+def test_transact_update_creates_missing_documents(repo):
+    count = lambda data: {"refs": (data or {}).get("refs", 0) + 1}
+    repo.transact_update("uploads", "h1", count)
+    repo.transact_update("uploads", "h1", count)
+    assert repo.get("uploads", "h1") == {"refs": 2}
+
+    repository = importlib.import_module("studyPal.repository")
+    assert repo.transact_update("uploads", "h1", lambda data: repository.DELETE) is repository.DELETE
+    assert repo.get("uploads", "h1") is None
+
+
+def test_blobs(repo):
+    repo.put_blob("note_text/n1.txt", "héllo", content_type="text/plain")
+    assert repo.get_blob("note_text/n1.txt").decode("utf-8") == "héllo"
+    assert repo.blob_exists("note_text/n1.txt")
+    with repo.open_blob_reader("note_text/n1.txt", chunk_size=256 * 1024) as reader:
+        assert reader.read().decode("utf-8") == "héllo"
+    repo.delete_blob("note_text/n1.txt")
+    assert not repo.blob_exists("note_text/n1.txt")
+
+
+def test_main_runs_on_memory_backend(monkeypatch):
+    monkeypatch.setenv("STORAGE_BACKEND", "memory")
+    sys.modules.pop("studyPal.main", None)
+    main = importlib.import_module("studyPal.main")
+    sys.modules.pop("studyPal.main", None)
+    repository = importlib.import_module("studyPal.repository")
+    assert isinstance(main.db.repo, repository.MemoryRepository)
+
+    functions = importlib.import_module("studyPal.functions")
+    user_id, _ = functions.create_user(main.db, "Ann", "ann@example.com", "pw")
+    assert functions.login_user(main.db, "ann@example.com", "pw") == (True, "Welcome Ann", user_id)
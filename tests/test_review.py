@@ -0,0 +1,86 @@
+# tests/test_review.py
+import importlib
+
+CARDS = [{"question": "What is a process?", "answer": "A program in execution"},
+         {"question": "What is a thread?", "answer": "A unit of scheduling"}]
+
+
+def test_sm2_intervals_grow_and_reset_on_a_miss():
+    review = importlib.import_module("studyPal.review")
+    state = review.new_card("n", CARDS[0], 0)
+    intervals = []
+    for grade in ["good", "good", "good", "again", "good"]:
+        state.update(review.schedule(state, grade, 0))
+        intervals.append(state["interval"])
+    assert intervals == [1, 6, 15, 0, 1]
+    assert state["lapses"] == 1 and state["ease"] < review.INITIAL_EASE
+    assert review.schedule(review.new_card("n", CARDS[0], 0), "again", 100)["due"] == 100 + review.RELEARN_SECONDS
+    assert review.schedule(state, "easy", 0)["ease"] > state["ease"]
+
+
+def test_due_cards_follow_note_flashcards_and_reviews(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    review = importlib.import_module("studyPal.review")
+    first = functions.save_note(fake_db, "u5", None, None, "Processes")
+    second = functions.save_note(fake_db, "u5", None, None, "Threads")
+    functions.update_note(fake_db, first, flashcards=CARDS)
+    functions.update_note(fake_db, second, flashcards=[{"question": "Q", "answer": "A"}])
+
+    cards, cursor = review.due_cards(fake_db, "u5", limit=2)
+    assert len(cards) == 2 and cursor is not None
+    rest, cursor = review.due_cards(fake_db, "u5", limit=2, after=cursor)
+    assert len(rest) == 1 and cursor is None
+    assert {c["question"] for c in cards + rest} == {"What is a process?", "What is a thread?", "Q"}
+
+    process = review.card_id(first, CARDS[0])
+    assert review.record_review(fake_db, "u5", process, "good")["interval"] == 1
+    assert review.record_review(fake_db, "u5", "missing", "good") is None
+    due, _ = review.due_cards(fake_db, "u5", note_id=first)
+    assert [c["card_id"] for c in due] == [review.card_id(first, CARDS[1])]
+
+    # Regenerated flashcards keep the state of cards that come back
+    functions.update_note(fake_db, first, flashcards=[CARDS[0], {"question": "New?", "answer": "Yes"}])
+    assert fake_db.get(review.cards_path("u5"), process)["reps"] == 1
+    assert fake_db.get(review.cards_path("u5"), review.card_id(first, CARDS[1])) is None
+
+    functions.delete_note(fake_db, first)
+    assert [c["note_id"] for c in review.due_cards(fake_db, "u5")[0]] == [second]
+
+
+def test_review_routes(client):
+    main = importlib.import_module("studyPal.main")
+    functions = importlib.import_module("studyPal.functions")
+    review = importlib.import_module("studyPal.review")
+    note_id = main.save_note(main.db, "u6", None, None, "Processes")
+    functions.update_note(main.db, note_id, flashcards=CARDS)
+    with client.session_transaction() as sess:
+        sess["user_id"] = "u6"
+
+    assert client.get("/study").status_code == 200
+    first = client.get("/review/due?limit=1").get_json()
+    assert len(first["cards"]) == 1 and first["cursor"]
+    after = client.get(f"/review/due?limit=1&after_due={first['cursor'][0]}&after_id={first['cursor'][1]}")
+    assert after.get_json()["cards"][0]["card_id"] != first["cards"][0]["card_id"]
+    for half in (f"after_id={first['cursor'][1]}", "after_due=soon&after_id=x", "after_due=1.5"):
+        assert client.get(f"/review/due?{half}").status_code == 400
+
+    card = first["cards"][0]["card_id"]
+    assert client.post(f"/review/{card}", json={"grade": "maybe"}).status_code == 400
+    response = client.post(f"/review/{card}", json={"grade": "easy"})
+    assert response.status_code == 200 and response.get_json()["interval"] == 1
+    assert client.post("/review/missing", data={"grade": "good"}).status_code == 404
+    assert len(client.get("/review/due").get_json()["cards"]) == 1
+    assert review.REVIEWS.value(grade="easy") >= 1
+
+
+def test_review_batch_size_is_clamped(client, monkeypatch):
+    main = importlib.import_module("studyPal.main")
+    review = importlib.import_module("studyPal.review")
+    limits = []
+    monkeypatch.setattr(main, "due_cards", lambda db, user_id, limit, after, note_id: limits.append(limit) or ([], None))
+    with client.session_transaction() as sess:
+        sess["user_id"] = "u6"
+
+    for query in ("", "?limit=-5", "?limit=100000", "?limit=7"):
+        assert client.get(f"/review/due{query}").status_code == 200
+    assert limits == [review.REVIEW_BATCH_CARDS, 1, review.REVIEW_MAX_BATCH_CARDS, 7]
@@ -31,12 +31,20 @@ def test_edit_note_save_creates_note_and_redirects(client, monkeypatch):
     login(client)
     main = importlib.import_module("studyPal.main")
     calls = {}
-    monkeypatch.setattr(main, "save_note", lambda db, uid, text, _none, title: "note123")
-    monkeypatch.setattr(main, "generate_flashcards", lambda db, uid, nid, text, client: calls.setdefault("gen", True))
+    cards = [{"question": "Q", "answer": "A"}]
+
+    def fake_save_note(db, uid, text, _none, title, flashcards=None):
+        calls["saved"] = flashcards
+        return "note123"
+
+    monkeypatch.setattr(main, "save_note", fake_save_note)
+    monkeypatch.setattr(main, "generate_flashcards", lambda db, uid, nid, text, client: cards)
 
     resp = client.post("/edit_note", data={"title":"T","notes":"Body","action":"save"}, follow_redirects=False)
     assert resp.status_code in (301,302)
     assert resp.headers["Location"].endswith("/")
+    # The generated cards are saved with the note, not thrown away
+    assert calls["saved"] == cards
 
 def test_edit_note_summarise_renders(client, monkeypatch):
     login(client)
@@ -55,3 +63,13 @@ def test_upload_doc_missing_file_returns_400(client):
     login(client)
     resp = client.post("/upload_doc", data={"action":"save","title":"T"})
     assert resp.status_code == 400
+
+def test_edit_note_stream_sends_summary_as_events(client, monkeypatch):
+    login(client)
+    main = importlib.import_module("studyPal.main")
+    monkeypatch.setattr(main, "aiSummariser_stream", lambda text, client: iter(["<h3>A</h3>\n", "<p>b</p>"]))
+    resp = client.post("/edit_note/stream", data={"title": "T", "notes": "Body"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    body = resp.get_data(as_text=True)
+    assert body == "data: <h3>A</h3>\ndata: \n\ndata: <p>b</p>\n\nevent: done\ndata: \n\n"
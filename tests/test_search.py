@@ -0,0 +1,106 @@
+# tests/test_search.py
+import importlib
+
+
+def test_tokenize_strips_html_stopwords_and_suffixes():
+    search = importlib.import_module("studyPal.search")
+    assert search.tokenize("<h3>The Schedulers</h3><p>scheduling &amp; processes</p>") == \
+        ["schedul", "schedul", "process"]
+    assert search.stem("class") == "class" and search.stem("policies") == "policy"
+
+
+def test_notes_are_indexed_on_save_update_and_delete(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    search = importlib.import_module("studyPal.search")
+    paging = functions.save_note(fake_db, "u1", "text", "<p>Virtual memory uses paging.</p>", "Memory")
+    threads = functions.save_note(fake_db, "u1", None, None, "Threads")
+    functions.save_note(fake_db, "u2", None, "<p>Paging for someone else</p>", "Other")
+
+    assert [r["note_id"] for r in search.search_notes(fake_db, "u1", "pages")] == [paging]
+
+    functions.update_note(fake_db, threads, flashcards=[{"question": "What is a thread?",
+                                                          "answer": "A unit of scheduling"}])
+    functions.update_note(fake_db, threads, summary_text="<p>Threads share memory.</p>")
+    results = search.search_notes(fake_db, "u1", "memory")
+    # The title match weighs more than a summary mention
+    assert [r["note_id"] for r in results] == [paging, threads]
+    assert results[0]["title"] == "Memory"
+    assert [r["note_id"] for r in search.search_notes(fake_db, "u1", "scheduled")] == [threads]
+
+    functions.delete_note(fake_db, paging)
+    assert [r["note_id"] for r in search.search_notes(fake_db, "u1", "memory paging")] == [threads]
+    assert search.search_notes(fake_db, "u1", "the") == []
+
+
+def test_segments_fill_up_and_reuse_slots(fake_db, monkeypatch):
+    functions = importlib.import_module("studyPal.functions")
+    search = importlib.import_module("studyPal.search")
+    monkeypatch.setattr(search, "SEARCH_SEGMENT_NOTES", 2)
+    notes = [functions.save_note(fake_db, "u1", None, None, f"Topic {i}") for i in range(5)]
+
+    assert fake_db.get("search_index", "u1")["segments"] == [2, 2, 1]
+    functions.delete_note(fake_db, notes[1])
+    replacement = functions.save_note(fake_db, "u1", None, None, "Topic 9")
+    assert fake_db.get("notes", replacement)["search_segment"] == 0
+    assert fake_db.get("search_index/u1/segments", "00000")["note_ids"] == [notes[0], replacement]
+    assert len(search.search_notes(fake_db, "u1", "topic")) == 5
+
+
+def test_reindex_matches_incremental_index(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    search = importlib.import_module("studyPal.search")
+    for i, summary in enumerate(["<p>Deadlock needs mutual exclusion.</p>", "<p>Semaphores avoid races.</p>"]):
+        note_id = functions.save_note(fake_db, "u7", None, summary, f"Sync {i}")
+        functions.update_note(fake_db, note_id, flashcards=[{"question": "Deadlock?", "answer": "A cycle"}])
+    before = search.search_notes(fake_db, "u7", "deadlock")
+
+    assert search.reindex_user(fake_db, "u7") == 2
+    assert search.search_notes(fake_db, "u7", "deadlock") == before
+
+
+def test_search_route_renders_results(client, monkeypatch):
+    main = importlib.import_module("studyPal.main")
+    with client.session_transaction() as sess:
+        sess["user_id"] = "u1"
+    monkeypatch.setattr(main, "search_notes", lambda db, uid, query: [{"note_id": "n1", "title": query}])
+    resp = client.get("/search?q=paging")
+    assert resp.status_code == 200
+    assert b"home.html" in resp.data
+
+
+def test_segments_store_postings_as_one_field_and_fill_up_by_size(fake_db, monkeypatch):
+    functions = importlib.import_module("studyPal.functions")
+    search = importlib.import_module("studyPal.search")
+    monkeypatch.setattr(search, "SEARCH_SEGMENT_BYTES", 200)
+    long_summary = "<p>" + " ".join(f"word{i}" for i in range(30)) + "</p>"
+    big = functions.save_note(fake_db, "u8", None, long_summary, "Big")
+    small = functions.save_note(fake_db, "u8", None, None, "Small")
+
+    stored = fake_db.get("search_index/u8/segments", "00000")
+    assert isinstance(stored["postings"], str) and "s:word7 0:1" in stored["postings"].split("\n")
+    assert stored["full"] and fake_db.get("search_index", "u8")["full"] == [0]
+    assert fake_db.get("notes", small)["search_segment"] == 1
+
+    functions.update_note(fake_db, big, summary_text="<p>Short now.</p>")
+    assert fake_db.get("search_index", "u8")["full"] == []
+    assert [r["note_id"] for r in search.search_notes(fake_db, "u8", "short")] == [big]
+
+    assert search.reindex_user(fake_db, "u8") == 2
+    assert fake_db.get("search_index", "u8")["segments"] == [2]
+
+
+def test_failed_index_updates_flag_the_user_for_reindex(fake_db, monkeypatch):
+    functions = importlib.import_module("studyPal.functions")
+    search = importlib.import_module("studyPal.search")
+
+    def _fail(*args):
+        raise RuntimeError("contention")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(search, "_update_segment", _fail)
+        note_id = functions.save_note(fake_db, "u9", None, "<p>Lost in the index.</p>", "Lost")
+    assert fake_db.get("search_index", "u9")["stale"] is True
+
+    assert search.reindex_all(fake_db, stale=True) == (1, 1)
+    assert fake_db.get("search_index", "u9")["stale"] is False
+    assert [r["note_id"] for r in search.search_notes(fake_db, "u9", "lost")] == [note_id]
@@ -0,0 +1,55 @@
+# tests/test_services.py
+import importlib
+import sys
+import threading
+
+
+def test_lazy_service_builds_once_on_first_use():
+    services = importlib.import_module("studyPal.services")
+    built = []
+
+    def factory():
+        built.append(1)
+        return "client"
+
+    lazy = services.LazyService(factory)
+    assert built == []
+    threads = [threading.Thread(target=lambda: lazy.upper()) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert built == [1]
+    assert lazy.upper() == "CLIENT"
+
+
+def test_create_app_does_not_touch_firebase(fake_firebase):
+    sys.modules.pop("studyPal.main", None)
+    main = importlib.import_module("studyPal.main")
+    first, second = main.create_app(), main.create_app()
+    assert first is not second
+    assert "home" in first.view_functions and "metrics" in second.view_functions
+    assert fake_firebase["init"] == 0
+
+    client = first.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = "uid123"
+    assert client.get("/").status_code == 200
+    assert fake_firebase["init"] == 1
+
+
+def test_async_repository_shares_the_memory_backend():
+    import asyncio
+    services = importlib.import_module("studyPal.services")
+    cache = importlib.import_module("studyPal.cache")
+    repo = services.make_repository("memory")
+    adb = services.make_async_repository(repo)
+    shared = cache.AsyncSharedCache(adb)
+
+    async def run():
+        await adb.set("notes", "a", {"title": "T"})
+        await shared.set("k", "v")
+        return await adb.query("notes"), await shared.get("k")
+
+    assert asyncio.run(run()) == ([("a", {"title": "T"})], "v")
+    assert cache.SharedCache(repo).get("k") == "v"
@@ -0,0 +1,50 @@
+# tests/test_similarity.py
+import importlib
+
+
+def test_near_duplicate_flashcards_are_dropped():
+    similarity = importlib.import_module("studyPal.similarity")
+    cards = [
+        {"question": "What is a page fault?", "answer": "An access to a page not in memory."},
+        {"question": "What is a page fault?", "answer": "An access to a page that is not in memory"},
+        {"question": "What does the TLB cache?", "answer": "Page table entries."},
+        {"question": "What is a Page Fault", "answer": "An access to a page not in memory!"},
+    ]
+    assert similarity.dedupe_flashcards(cards) == [cards[0], cards[2]]
+    assert similarity.dedupe_flashcards(cards, threshold=1.01) == cards
+    assert similarity.dedupe_flashcards([]) == []
+
+
+def test_related_notes_rank_by_shared_terms(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    similarity = importlib.import_module("studyPal.similarity")
+    paging = functions.save_note(fake_db, "u8", None, "<p>Paging maps virtual pages to frames.</p>", "Paging")
+    tlb = functions.save_note(fake_db, "u8", None, "<p>The TLB caches virtual page translations.</p>", "TLB")
+    locks = functions.save_note(fake_db, "u8", None, "<p>Mutex locks guard critical sections.</p>", "Locks")
+    functions.save_note(fake_db, "u9", None, "<p>Virtual pages and frames.</p>", "Paging too")
+
+    related = similarity.related_notes(fake_db, "u8", [paging, locks, "missing"])
+    assert [r["note_id"] for r in related[paging]] == [tlb]
+    assert related[paging][0]["title"] == "TLB"
+    assert related[locks] == [] and related["missing"] == []
+
+    # A new note shows up once its segment changes
+    frames = functions.save_note(fake_db, "u8", None, "<p>Frames hold virtual pages.</p>", "Frames")
+    assert {r["note_id"] for r in similarity.related_notes(fake_db, "u8", [paging])[paging]} == {tlb, frames}
+
+
+
+def test_related_route_checks_owner(client):
+    main = importlib.import_module("studyPal.main")
+    paging = main.save_note(main.db, "u8", None, "<p>Paging maps virtual pages to frames.</p>", "Paging")
+    main.save_note(main.db, "u8", None, "<p>The TLB caches virtual page translations.</p>", "TLB")
+    main.save_note(main.db, "u8", None, "<p>Frames hold virtual pages.</p>", "Frames")
+
+    with client.session_transaction() as sess:
+        sess["user_id"] = "u8"
+    response = client.get(f"/Note/{paging}/related?limit=1")
+    assert response.status_code == 200 and len(response.get_json()["related"]) == 1
+    assert client.get(f"/Note/{paging}").status_code == 200
+    with client.session_transaction() as sess:
+        sess["user_id"] = "u9"
+    assert client.get(f"/Note/{paging}/related").status_code == 404
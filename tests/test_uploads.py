@@ -0,0 +1,181 @@
+# tests/test_uploads.py
+import hashlib
+import importlib
+import io
+
+import pytest
+
+
+def login(client, user_id="uid123"):
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+
+
+def post_document(client, data, name="slides.pdf"):
+    return client.post("/upload_doc", data={
+        "action": "save", "title": "T", "document": (io.BytesIO(data), name),
+    }, content_type="multipart/form-data")
+
+
+def test_duplicate_uploads_share_one_blob(client, monkeypatch):
+    main = importlib.import_module("studyPal.main")
+    login(client)
+    queued = []
+    monkeypatch.setattr(main, "enqueue_upload",
+                        lambda db, client, note_id, uid, path, ext, data=None, upload_hash=None: queued.append(
+                            (note_id, path, upload_hash)))
+
+    for name in ("slides.pdf", "copy.pdf"):
+        assert post_document(client, b"%PDF-1.4 same bytes", name).status_code in (301, 302)
+
+    (first, path, digest), (second, path2, digest2) = queued
+    assert path == path2 and digest == digest2 == hashlib.sha256(b"%PDF-1.4 same bytes").hexdigest()
+    assert main.db.get("uploads", digest)["refs"] == 2
+    assert main.db.get_blob(path) == b"%PDF-1.4 same bytes"
+    assert main.db.get("notes", first)["blob_path"] == main.db.get("notes", second)["blob_path"] == path
+    # The second copy was not kept
+    assert sorted(main.db.repo.bucket._blobs) == [path]
+
+
+def test_large_uploads_are_streamed_in_pieces(client, monkeypatch):
+    main = importlib.import_module("studyPal.main")
+    uploads = importlib.import_module("studyPal.uploads")
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 256)
+    monkeypatch.setattr(uploads, "UPLOAD_INLINE_BYTES", 1024)
+    login(client)
+    queued = []
+    monkeypatch.setattr(main, "enqueue_upload",
+                        lambda db, client, note_id, uid, path, ext, data=None, upload_hash=None: queued.append(
+                            (path, data)))
+    written = []
+    open_writer = main.db.repo.open_blob_writer
+
+    def recording_writer(name, content_type=None, chunk_size=None):
+        writer = open_writer(name, content_type, chunk_size)
+        write = writer.write
+        writer.write = lambda piece: written.append(len(piece)) or write(piece)
+        return writer
+    monkeypatch.setattr(main.db.repo, "open_blob_writer", recording_writer)
+
+    body = bytes(range(256)) * 10
+    assert post_document(client, body).status_code in (301, 302)
+    (path, data), = queued
+    # Too big to keep in memory: the job downloads it once it is stored
+    assert data is None
+    assert main.db.get_blob(path) == body
+    assert written == [256] * 10
+
+
+def test_download_redirects_to_signed_url(client, monkeypatch):
+    main = importlib.import_module("studyPal.main")
+    login(client)
+    note_id = main.save_note(main.db, "uid123", None, None, "T", blob_path="uploads/abc.pdf")
+
+    resp = client.get(f"/Note/{note_id}/download")
+    assert resp.status_code == 302
+    assert resp.headers["Location"] == f"https://example.com/uploads/abc.pdf?expires={main.SIGNED_URL_SECONDS}"
+
+    login(client, "someone-else")
+    assert client.get(f"/Note/{note_id}/download").status_code == 404
+
+
+def test_duplicate_job_reuses_extracted_pages(fake_db, monkeypatch):
+    jobs = importlib.import_module("studyPal.jobs")
+    functions = importlib.import_module("studyPal.functions")
+    uploads = importlib.import_module("studyPal.uploads")
+    monkeypatch.setattr(jobs, "aiSummariser", lambda text, client, priority=None: f"<p>{text[:4]}</p>")
+    monkeypatch.setattr(jobs, "generate_flashcards",
+                        lambda db, uid, nid, text, client, priority=None: [{"question": text, "answer": "A"}])
+    monkeypatch.setattr(jobs, "iter_pages", lambda f, ext: iter(["page one\n", "page two\n"]))
+
+    data = b"%PDF"
+    digest = hashlib.sha256(data).hexdigest()
+    notes = []
+    for _ in range(2):
+        path, _ = uploads.acquire_upload(fake_db, digest, "pdf", len(data))
+        note_id = functions.save_note(fake_db, "uid123", None, None, "T", upload_hash=digest)
+        jobs.create_job(fake_db, note_id, "uid123", path, "pdf", digest)
+        notes.append(note_id)
+
+    jobs.run_upload_job(fake_db, None, notes[0], data=data)
+
+    def no_extraction(f, ext):
+        raise AssertionError("pages should come from the first job")
+    monkeypatch.setattr(jobs, "iter_pages", no_extraction)
+    # Neither the upload bytes nor the blob are needed
+    jobs.run_upload_job(fake_db, None, notes[1])
+
+    first, second = (functions.get_note(fake_db, n, summary=True, text=True) for n in notes)
+    assert second["original_text"] == first["original_text"] == "page one\npage two\n"
+    assert second["summary_text"] == first["summary_text"]
+
+
+def test_deleting_notes_releases_the_blob(fake_db):
+    functions = importlib.import_module("studyPal.functions")
+    uploads = importlib.import_module("studyPal.uploads")
+    data = b"bytes"
+    digest = hashlib.sha256(data).hexdigest()
+
+    path, new = uploads.acquire_upload(fake_db, digest, "docx", len(data))
+    assert new
+    fake_db.put_blob(path, data)
+    assert uploads.acquire_upload(fake_db, digest, "docx", len(data)) == (path, False)
+    notes = [functions.save_note(fake_db, "u1", None, None, "T", upload_hash=digest) for _ in range(2)]
+
+    functions.delete_note(fake_db, notes[0])
+    assert fake_db.blob_exists(path)
+    functions.delete_note(fake_db, notes[1])
+    assert not fake_db.blob_exists(path)
+    assert fake_db.get("uploads", digest) is None
+
+    # A later upload of the same file stores it again
+    assert uploads.acquire_upload(fake_db, digest, "docx", len(data))[1] is True
+
+
+def test_upload_racing_the_last_release_keeps_its_blob(fake_db, monkeypatch):
+    uploads = importlib.import_module("studyPal.uploads")
+    digest = hashlib.sha256(b"bytes").hexdigest()
+    old, _ = uploads.acquire_upload(fake_db, digest, "docx", 5)
+    fake_db.put_blob(old, b"bytes")
+    raced = []
+    delete_blob = fake_db.delete_blob
+
+    def acquire_first(name):
+        # The same file is uploaded again while the old blob is being deleted
+        if not raced:
+            raced.append(uploads.acquire_upload(fake_db, digest, "docx", 5))
+            fake_db.put_blob(raced[0][0], b"bytes")
+        delete_blob(name)
+
+    monkeypatch.setattr(fake_db, "delete_blob", acquire_first)
+    assert uploads.release_upload(fake_db, digest) is True
+
+    new, is_new = raced[0]
+    assert is_new and new != old
+    assert not fake_db.blob_exists(old) and fake_db.blob_exists(new)
+    assert fake_db.get("uploads", digest)["blob_path"] == new
+
+
+def test_rejected_form_leaves_no_blob(client):
+    main = importlib.import_module("studyPal.main")
+    login(client)
+    resp = client.post("/upload_doc", data={
+        "action": "nope", "title": "T", "document": (io.BytesIO(b"%PDF-1.4 rejected"), "slides.pdf"),
+    }, content_type="multipart/form-data")
+    assert resp.status_code == 400
+    assert main.db.repo.bucket._blobs == {}
+
+
+def test_failed_storage_upload_records_nothing(client, monkeypatch):
+    main = importlib.import_module("studyPal.main")
+    login(client, "uid-failed-upload")
+
+    def broken_writer(name, content_type=None, chunk_size=None):
+        raise ConnectionError("storage down")
+    monkeypatch.setattr(main.db.repo, "open_blob_writer", broken_writer)
+    monkeypatch.setattr(main, "enqueue_upload", lambda *a, **k: pytest.fail("job enqueued"))
+
+    body = b"%PDF-1.4 never stored"
+    assert post_document(client, body).status_code == 502
+    assert main.db.get("uploads", hashlib.sha256(body).hexdigest()) is None
+    assert main.db.query("notes", where=[("user_id", "==", "uid-failed-upload")]) == []